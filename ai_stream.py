@@ -0,0 +1,118 @@
+"""Streaming delle risposte LLM verso i client web (Server-Sent Events) e verso Slack."""
+
+import json
+import time
+
+STREAMING_CURSOR = " \u258d"
+
+
+def iter_completion_deltas(stream):
+    """Estrae i frammenti di testo da uno stream `chat.completions` (stream=True)."""
+    for chunk in stream:
+        choices = getattr(chunk, "choices", None)
+        if not choices:
+            continue
+        content = getattr(choices[0].delta, "content", None)
+        if content:
+            yield content
+
+
+def sse_event(data, event=None):
+    """Serializza un evento SSE con payload JSON."""
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def wants_event_stream(data, accept_header):
+    """True se il client chiede la risposta in streaming.
+
+    Si attiva con `"stream": true` nel body JSON oppure con
+    `Accept: text/event-stream`.
+    """
+    if isinstance(data, dict) and data.get("stream") is True:
+        return True
+    return "text/event-stream" in (accept_header or "")
+
+
+def stream_completion_events(stream, on_complete=None, done_payload=None):
+    """Converte uno stream OpenAI in eventi SSE `token` / `done` / `error`.
+
+    `on_complete(full_text)` viene chiamata a stream terminato (es. per salvare
+    la risposta finale); `done_payload(full_text)` costruisce il payload
+    dell'evento `done`.
+    """
+    parts = []
+    try:
+        for delta in iter_completion_deltas(stream):
+            parts.append(delta)
+            yield sse_event({"delta": delta}, event="token")
+    except Exception as e:
+        yield sse_event({"status": "error", "message": str(e)}, event="error")
+        return
+
+    full_text = "".join(parts)
+    if on_complete is not None:
+        on_complete(full_text)
+    payload = done_payload(full_text) if done_payload else {"status": "success", "text": full_text}
+    yield sse_event(payload, event="done")
+
+
+class ProgressiveSlackReply:
+    """Messaggio Slack aggiornato man mano che arrivano i token.
+
+    `post(text)` pubblica il placeholder e ritorna il suo `ts`;
+    `update(ts, text)` lo modifica (chat.update). Il primo token viene mostrato
+    subito, i successivi al massimo ogni `min_interval` secondi per restare
+    dentro i rate limit di chat.update.
+    """
+
+    def __init__(self, post, update, placeholder, min_interval=1.5, clock=time.monotonic):
+        self._post = post
+        self._update = update
+        self._placeholder = placeholder
+        self._min_interval = min_interval
+        self._clock = clock
+        self._parts = []
+        self._last_update_at = None
+        self.ts = None
+        self.started_at = None
+        self.first_text_at = None
+        self.updates = 0
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    @property
+    def time_to_first_text(self):
+        """Secondi tra il placeholder e il primo testo generato visibile."""
+        if self.first_text_at is None or self.started_at is None:
+            return None
+        return self.first_text_at - self.started_at
+
+    def start(self):
+        self.started_at = self._clock()
+        self.ts = self._post(self._placeholder)
+        return self.ts
+
+    def feed(self, delta):
+        self._parts.append(delta)
+        now = self._clock()
+        if self._last_update_at is not None and now - self._last_update_at < self._min_interval:
+            return
+        if not self.text.strip():
+            return
+        self._push(self.text + STREAMING_CURSOR, now)
+
+    def finish(self, final_text):
+        self._push(final_text, self._clock())
+
+    def _push(self, text, now):
+        self._update(self.ts, text)
+        self.updates += 1
+        self._last_update_at = now
+        if self.first_text_at is None:
+            self.first_text_at = now
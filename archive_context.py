@@ -0,0 +1,332 @@
+"""Contesto AI letto dall'archivio SQLite, con Slack solo per i buchi.
+
+`handle_message` archivia già ogni messaggio in `messages` (`archive_message`,
+anche le mention del bot); qui teniamo per
+canale un watermark di ingestione (`ingest_watermarks`: da `first_ts` a
+`last_ts` l'archivio è considerato continuo) e gli intervalli noti in cui il
+bot non ascoltava (`ingest_gaps`, aperti a ogni avvio da `last_ts` a ora).
+Le risposte AI del bot non passano da `handle_message` (Bolt ignora i propri
+eventi) e vengono salvate in `bot_replies`.
+
+Il contesto di thread/canale si legge dal DB; Slack viene chiamato solo per le
+porzioni scoperte, e quello che arriva viene salvato nell'archivio (senza
+embeddings, li calcola `utilities/update_embeddings.py`) così il buco non si
+ripaga alla mention successiva.
+"""
+
+import logging
+import time
+
+import archive_index
+import message_entities
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SLACK_PAGE_SIZE = 200
+# Messaggi Slack con subtype che vanno comunque in archivio
+ARCHIVED_SUBTYPES = (None, "thread_broadcast", "file_share")
+
+
+def format_ts(seconds):
+    """Timestamp nel formato Slack (confrontabile come stringa con quelli archiviati)."""
+    return f"{seconds:.6f}"
+
+
+def record_ingest(conn, channel, ts):
+    """Avanza il watermark del canale dopo l'archiviazione di un messaggio live."""
+    conn.execute(
+        """
+        INSERT INTO ingest_watermarks (channel, first_ts, last_ts, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(channel) DO UPDATE SET
+            last_ts = MAX(last_ts, excluded.last_ts),
+            updated_at = excluded.updated_at
+        """,
+        (channel, ts, ts, time.time()),
+    )
+    conn.commit()
+
+
+def archive_message(conn, channel, ts, thread_ts, user, text, permalink, embedding=None):
+    """Archivia un messaggio live (opt-out già applicato) e avanza il watermark.
+
+    Usata da `handle_message` sia per i messaggi normali sia per le mention del
+    bot, che altrimenti mancherebbero dal contesto letto dal DB.
+    """
+    conn.execute(
+        "INSERT INTO messages VALUES(?, ?, ?, ?, ?, ?, ?)",
+        (text, user, channel, ts, permalink, thread_ts, embedding),
+    )
+    archive_index.record_message(conn, channel, ts, thread_ts)
+    message_entities.record(conn, channel, ts, text)
+    conn.commit()
+    record_ingest(conn, channel, ts)
+
+
+def get_watermark(conn, channel):
+    """Ritorna (first_ts, last_ts) del canale oppure None."""
+    row = conn.execute(
+        "SELECT first_ts, last_ts FROM ingest_watermarks WHERE channel = ?",
+        (channel,),
+    ).fetchone()
+    return (row[0], row[1]) if row else None
+
+
+def open_restart_gaps(conn, now_ts=None):
+    """All'avvio segna come buco, per ogni canale, il periodo da `last_ts` a ora.
+
+    Gli eventi arrivati mentre il bot era giù potrebbero essere persi. Se il buco
+    con lo stesso inizio esiste già (riavvii senza nuovi messaggi) lo estende.
+    """
+    now_ts = now_ts or format_ts(time.time())
+    cursor = conn.execute(
+        """
+        INSERT INTO ingest_gaps (channel, start_ts, end_ts)
+        SELECT channel, last_ts, ? FROM ingest_watermarks WHERE last_ts < ?
+        ON CONFLICT(channel, start_ts) DO UPDATE SET end_ts = MAX(end_ts, excluded.end_ts)
+        """,
+        (now_ts, now_ts),
+    )
+    conn.commit()
+    return cursor.rowcount
+
+
+def overlapping_gaps(conn, channel, start_ts, end_ts):
+    """Buchi aperti del canale che intersecano [start_ts, end_ts]."""
+    return conn.execute(
+        """
+        SELECT id, start_ts, end_ts FROM ingest_gaps
+        WHERE channel = ? AND end_ts > ? AND start_ts < ?
+        ORDER BY start_ts
+        """,
+        (channel, start_ts, end_ts),
+    ).fetchall()
+
+
+def record_bot_reply(conn, channel, ts, thread_ts, user, text):
+    """Salva una risposta del bot, che altrimenti non finirebbe in archivio."""
+    if not ts:
+        return
+    conn.execute(
+        "INSERT OR REPLACE INTO bot_replies (channel, timestamp, thread_ts, user, text) VALUES (?, ?, ?, ?, ?)",
+        (channel, ts, thread_ts or ts, user, text),
+    )
+    conn.commit()
+
+
+def _optout_users(conn):
+    return {row[0] for row in conn.execute("SELECT user FROM optout").fetchall()}
+
+
+def store_slack_messages(conn, channel, messages, bot_user_id=None):
+    """Salva in archivio messaggi letti da Slack, senza toccare quelli già presenti.
+
+    Rispetta l'opt-out come `handle_message`; le risposte del bot vanno in
+    `bot_replies`. Ritorna il numero di messaggi nuovi.
+    """
+    optout = _optout_users(conn)
+    inserted = 0
+    for msg in messages:
+        user = msg.get("user")
+        text = msg.get("text")
+        ts = msg.get("ts")
+        if not user or text is None or not ts or msg.get("subtype") not in ARCHIVED_SUBTYPES:
+            continue
+        if user == "USLACKBOT":
+            continue
+        thread_ts = msg.get("thread_ts") or ts
+        if bot_user_id and user == bot_user_id:
+            conn.execute(
+                "INSERT OR IGNORE INTO bot_replies (channel, timestamp, thread_ts, user, text) VALUES (?, ?, ?, ?, ?)",
+                (channel, ts, thread_ts, user, text),
+            )
+            continue
+        if user in optout:
+            text = "User opted out of archiving. This message has been deleted"
+            user = "USLACKBOT"
+        cursor = conn.execute(
+            """
+            INSERT OR IGNORE INTO messages (message, user, channel, timestamp, permalink, thread_ts)
+            VALUES (?, ?, ?, ?, '', ?)
+            """,
+            (text, user, channel, ts, thread_ts),
+        )
+        inserted += cursor.rowcount
+        if cursor.rowcount:
+            archive_index.record_message(conn, channel, ts, thread_ts)
+            message_entities.record(conn, channel, ts, text)
+    conn.commit()
+    return inserted
+
+
+def _rows_to_messages(rows):
+    return [{"user": user, "text": text, "ts": ts} for user, text, ts in rows]
+
+
+def _fetch_thread_from_slack(client, channel, thread_ts):
+    response = client.conversations_replies(channel=channel, ts=thread_ts)
+    metrics.incr("archive_context.slack_calls")
+    messages = response.get("messages", [])
+    while response.get("has_more", False):
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            break
+        response = client.conversations_replies(channel=channel, ts=thread_ts, cursor=cursor)
+        metrics.incr("archive_context.slack_calls")
+        messages.extend(response.get("messages", []))
+    return messages
+
+
+def _fetch_history_from_slack(client, channel, oldest=None, latest=None, limit=None):
+    """Pagina `conversations_history` in [oldest, latest]. Ritorna (messaggi, completo)."""
+    kwargs = {"channel": channel, "inclusive": True}
+    if oldest:
+        kwargs["oldest"] = oldest
+    if latest:
+        kwargs["latest"] = latest
+
+    messages = []
+    cursor = None
+    while True:
+        page_size = SLACK_PAGE_SIZE if limit is None else min(limit - len(messages), SLACK_PAGE_SIZE)
+        if cursor:
+            kwargs["cursor"] = cursor
+        response = client.conversations_history(limit=page_size, **kwargs)
+        metrics.incr("archive_context.slack_calls")
+        messages.extend(response.get("messages", []))
+        has_more = response.get("has_more", False)
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not has_more or not cursor:
+            return messages, not has_more
+        if limit is not None and len(messages) >= limit:
+            return messages, False
+
+
+def _thread_rows(conn, channel, thread_ts):
+    return conn.execute(
+        """
+        SELECT user, message, timestamp FROM messages
+        WHERE channel = ? AND (thread_ts = ? OR timestamp = ?)
+        UNION ALL
+        SELECT user, text, timestamp FROM bot_replies
+        WHERE channel = ? AND thread_ts = ?
+        ORDER BY timestamp
+        """,
+        (channel, thread_ts, thread_ts, channel, thread_ts),
+    ).fetchall()
+
+
+def thread_messages(conn, client, channel, thread_ts, bot_user_id=None, now_ts=None):
+    """Messaggi del thread (root compreso) in ordine cronologico.
+
+    Legge dal DB se il thread è coperto dall'archivio: root presente, dentro il
+    watermark e nessun buco aperto dopo il root non ancora recuperato per
+    questo thread. Altrimenti rilegge il thread da Slack e lo archivia.
+    """
+    now_ts = now_ts or format_ts(time.time())
+    watermark = get_watermark(conn, channel)
+    rows = _thread_rows(conn, channel, thread_ts)
+    has_root = any(row[2] == thread_ts for row in rows)
+
+    covered = watermark is not None and has_root and thread_ts >= watermark[0]
+    if covered:
+        gaps = overlapping_gaps(conn, channel, thread_ts, now_ts)
+        if gaps:
+            filled = conn.execute(
+                "SELECT filled_until FROM thread_fills WHERE channel = ? AND thread_ts = ?",
+                (channel, thread_ts),
+            ).fetchone()
+            covered = filled is not None and all(filled[0] >= gap[2] for gap in gaps)
+
+    if covered:
+        metrics.incr("archive_context.thread.db")
+        return _rows_to_messages(rows)
+
+    metrics.incr("archive_context.thread.slack_fill")
+    logger.info(f"[CONTEXT] Thread {channel}/{thread_ts} not covered by the archive, fetching from Slack")
+    fetched = _fetch_thread_from_slack(client, channel, thread_ts)
+    store_slack_messages(conn, channel, fetched, bot_user_id)
+    conn.execute(
+        "INSERT OR REPLACE INTO thread_fills (channel, thread_ts, filled_until) VALUES (?, ?, ?)",
+        (channel, thread_ts, now_ts),
+    )
+    conn.commit()
+    return _rows_to_messages(_thread_rows(conn, channel, thread_ts))
+
+
+def _channel_rows(conn, channel, latest_ts, limit):
+    rows = conn.execute(
+        """
+        SELECT user, message, timestamp FROM messages
+        WHERE channel = ? AND timestamp <= ? AND (thread_ts IS NULL OR thread_ts = timestamp)
+        ORDER BY timestamp DESC
+        LIMIT ?
+        """,
+        (channel, latest_ts, limit),
+    ).fetchall()
+    rows.reverse()
+    return rows
+
+
+def _fill_gap(conn, client, channel, gap, bot_user_id):
+    gap_id, start_ts, end_ts = gap
+    fetched, complete = _fetch_history_from_slack(client, channel, oldest=start_ts, latest=end_ts)
+    store_slack_messages(conn, channel, fetched, bot_user_id)
+    if complete:
+        conn.execute("DELETE FROM ingest_gaps WHERE id = ?", (gap_id,))
+        conn.commit()
+    metrics.incr("archive_context.channel.gap_fills")
+    logger.info(f"[CONTEXT] Filled gap {start_ts}-{end_ts} in {channel} with {len(fetched)} messages")
+
+
+def _extend_history(conn, client, channel, before_ts, count, bot_user_id):
+    """Recupera da Slack `count` messaggi precedenti all'inizio dell'archivio."""
+    fetched, complete = _fetch_history_from_slack(client, channel, latest=before_ts, limit=count)
+    store_slack_messages(conn, channel, fetched, bot_user_id)
+    timestamps = [m["ts"] for m in fetched if m.get("ts")]
+    # Con complete=True abbiamo raggiunto l'inizio del canale
+    first_ts = "0" if complete else min(timestamps, default=before_ts)
+    last_ts = max(timestamps, default=before_ts)
+    conn.execute(
+        """
+        INSERT INTO ingest_watermarks (channel, first_ts, last_ts, updated_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(channel) DO UPDATE SET
+            first_ts = MIN(first_ts, excluded.first_ts),
+            updated_at = excluded.updated_at
+        """,
+        (channel, first_ts, last_ts, time.time()),
+    )
+    conn.commit()
+    metrics.incr("archive_context.channel.history_fills")
+
+
+def channel_messages(conn, client, channel, latest_ts=None, limit=1000, bot_user_id=None):
+    """Ultimi `limit` messaggi top-level del canale fino a `latest_ts`, dal più vecchio.
+
+    Chiama Slack solo per i buchi aperti nella finestra e, se l'archivio non
+    arriva abbastanza indietro, per i messaggi precedenti al watermark.
+    """
+    latest_ts = latest_ts or format_ts(time.time())
+    rows = _channel_rows(conn, channel, latest_ts, limit)
+    watermark = get_watermark(conn, channel)
+
+    window_start = rows[0][2] if len(rows) >= limit else (watermark[0] if watermark else "0")
+    gaps = overlapping_gaps(conn, channel, window_start, latest_ts)
+    for gap in gaps:
+        _fill_gap(conn, client, channel, gap, bot_user_id)
+
+    if gaps:
+        rows = _channel_rows(conn, channel, latest_ts, limit)
+
+    if len(rows) < limit and (watermark is None or watermark[0] != "0"):
+        before_ts = watermark[0] if watermark else latest_ts
+        if before_ts > latest_ts:
+            before_ts = latest_ts
+        _extend_history(conn, client, channel, before_ts, limit - len(rows), bot_user_id)
+        rows = _channel_rows(conn, channel, latest_ts, limit)
+    elif not gaps:
+        metrics.incr("archive_context.channel.db")
+
+    return _rows_to_messages(rows)
@@ -0,0 +1,191 @@
+"""Indici derivati da `messages`, mantenuti in scrittura invece che ricalcolati in lettura.
+
+`threads` ha una riga per ogni messaggio root (anche senza risposte) e per ogni
+thread di cui abbiamo risposte: utente del root, numero di risposte, numero di
+partecipanti (root compreso), `first_ts` e `last_reply_ts`. Chi scrive in
+`messages` chiama `record_message()` nella stessa transazione; la riga viene
+ricalcolata per il solo thread toccato (indici su (channel, thread_ts) e
+(channel, timestamp)), quindi è idempotente anche quando Slack riconsegna lo
+stesso evento e la riga viene sostituita.
+
+`channel_stats` ha una riga per canale con l'ultimo timestamp e il numero di
+messaggi e di risposte: `refresh_thread()` confronta la riga di `threads`
+prima e dopo e applica solo la differenza, l'ultimo timestamp si legge
+dall'indice (channel, timestamp).
+
+`channel_page()` pagina i messaggi root di un canale per cursore (`before_ts` /
+`after_ts`) sull'indice parziale `idx_messages_channel_roots`: una pagina in
+fondo alla storia costa come la prima.
+"""
+
+import archive_versions
+
+THREAD_COLUMNS = ("root_user", "reply_count", "participant_count", "first_ts", "last_reply_ts")
+
+
+def is_reply(ts, thread_ts):
+    return bool(thread_ts) and thread_ts != ts
+
+
+def _thread_counts(row, thread_ts):
+    """(messaggi, risposte) di una riga (reply_count, first_ts) di `threads`.
+
+    Il root, se archiviato, è sempre il primo messaggio del thread.
+    """
+    if row is None:
+        return 0, 0
+    reply_count, first_ts = row
+    return reply_count + (1 if first_ts == thread_ts else 0), reply_count
+
+
+def update_channel_stats(conn, channel, message_delta, reply_delta):
+    """Applica una differenza di conteggi a `channel_stats` (non fa commit)."""
+    conn.execute(
+        """
+        INSERT INTO channel_stats (channel, last_message_ts, message_count, reply_count)
+        VALUES (:channel, (SELECT MAX(timestamp) FROM messages WHERE channel = :channel), :messages, :replies)
+        ON CONFLICT(channel) DO UPDATE SET
+            last_message_ts = excluded.last_message_ts,
+            message_count = message_count + excluded.message_count,
+            reply_count = reply_count + excluded.reply_count
+        """,
+        {"channel": channel, "messages": message_delta, "replies": reply_delta},
+    )
+
+
+def refresh_thread(conn, channel, thread_ts):
+    """Ricalcola la riga di `threads` di un thread e i conteggi del canale (non fa commit)."""
+    archive_versions.bump_channel(conn, channel)
+    old_messages, old_replies = _thread_counts(
+        conn.execute(
+            "SELECT reply_count, first_ts FROM threads WHERE channel = ? AND thread_ts = ?", (channel, thread_ts)
+        ).fetchone(),
+        thread_ts,
+    )
+    # I root archiviati prima della colonna thread_ts hanno thread_ts NULL
+    row = conn.execute(
+        """
+        SELECT
+            MAX(CASE WHEN timestamp = :ts THEN user END),
+            COALESCE(SUM(CASE WHEN timestamp != :ts THEN 1 ELSE 0 END), 0),
+            COUNT(DISTINCT user),
+            MIN(timestamp),
+            MAX(CASE WHEN timestamp != :ts THEN timestamp END),
+            COUNT(*)
+        FROM messages
+        WHERE channel = :channel
+          AND (thread_ts = :ts OR (timestamp = :ts AND thread_ts IS NULL))
+        """,
+        {"channel": channel, "ts": thread_ts},
+    ).fetchone()
+    if not row[5]:
+        conn.execute("DELETE FROM threads WHERE channel = ? AND thread_ts = ?", (channel, thread_ts))
+        update_channel_stats(conn, channel, -old_messages, -old_replies)
+        return
+    conn.execute(
+        f"""
+        INSERT OR REPLACE INTO threads (channel, thread_ts, {", ".join(THREAD_COLUMNS)})
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        (channel, thread_ts) + tuple(row)[:5],
+    )
+    update_channel_stats(conn, channel, row[5] - old_messages, row[1] - old_replies)
+
+
+def record_message(conn, channel, ts, thread_ts):
+    """Da chiamare dopo ogni scrittura in `messages` (non fa commit)."""
+    refresh_thread(conn, channel, thread_ts or ts)
+
+
+def user_threads(conn, user):
+    """Thread (channel, thread_ts) in cui l'utente ha scritto: da ricalcolare se cambia `user`."""
+    return conn.execute(
+        "SELECT DISTINCT channel, COALESCE(thread_ts, timestamp) FROM messages WHERE user = ?",
+        (user,),
+    ).fetchall()
+
+
+def refresh_threads(conn, keys):
+    for channel, thread_ts in keys:
+        refresh_thread(conn, channel, thread_ts)
+
+
+def backfill(conn):
+    """Ricostruisce `threads` e `channel_stats` da `messages` (non fa commit). Ritorna il numero di thread."""
+    conn.execute("DELETE FROM threads")
+    conn.execute(
+        f"""
+        INSERT INTO threads (channel, thread_ts, {", ".join(THREAD_COLUMNS)})
+        SELECT
+            channel,
+            COALESCE(thread_ts, timestamp) AS root_ts,
+            MAX(CASE WHEN timestamp = COALESCE(thread_ts, timestamp) THEN user END),
+            SUM(CASE WHEN timestamp != COALESCE(thread_ts, timestamp) THEN 1 ELSE 0 END),
+            COUNT(DISTINCT user),
+            MIN(timestamp),
+            MAX(CASE WHEN timestamp != COALESCE(thread_ts, timestamp) THEN timestamp END)
+        FROM messages
+        GROUP BY channel, root_ts
+        """
+    )
+    backfill_channel_stats(conn)
+    return conn.execute("SELECT COUNT(*) FROM threads").fetchone()[0]
+
+
+def backfill_channel_stats(conn):
+    """Ricostruisce `channel_stats` da `messages` (non fa commit)."""
+    conn.execute("DELETE FROM channel_stats")
+    conn.execute(
+        """
+        INSERT INTO channel_stats (channel, last_message_ts, message_count, reply_count)
+        SELECT
+            channel,
+            MAX(timestamp),
+            COUNT(*),
+            SUM(CASE WHEN thread_ts IS NOT NULL AND thread_ts != timestamp THEN 1 ELSE 0 END)
+        FROM messages
+        GROUP BY channel
+        """
+    )
+
+
+def channel_page(conn, channel, limit, before_ts=None, after_ts=None):
+    """Messaggi root di un canale, dal più recente, con `thread_count`.
+
+    Con `before_ts` la pagina successiva (più vecchia), con `after_ts` la
+    precedente (più recente). `thread_count` conta il root e le risposte, come
+    la vecchia subquery correlata. Le righe sono `(message, user, channel,
+    timestamp, permalink, thread_ts, user_name, thread_count)`.
+    """
+    params = [channel]
+    sql = """
+        SELECT
+            m.message,
+            m.user,
+            m.channel,
+            m.timestamp,
+            m.permalink,
+            m.thread_ts,
+            u.name as user_name,
+            COALESCE(t.reply_count, 0) + (CASE WHEN m.thread_ts = m.timestamp THEN 1 ELSE 0 END) as thread_count
+        FROM messages m INDEXED BY idx_messages_channel_roots
+        JOIN users u ON m.user = u.id
+        LEFT JOIN threads t ON t.channel = m.channel AND t.thread_ts = m.timestamp
+        WHERE m.channel = ?
+          AND (m.thread_ts IS NULL OR m.thread_ts = m.timestamp)
+          AND m.user NOT IN (SELECT user FROM optout)
+    """
+    if before_ts:
+        sql += " AND m.timestamp < ?"
+        params.append(before_ts)
+    if after_ts:
+        sql += " AND m.timestamp > ?"
+        params.append(after_ts)
+    # Verso il futuro si legge in ordine crescente e poi si ribalta
+    sql += " ORDER BY m.timestamp " + ("ASC" if after_ts and not before_ts else "DESC") + " LIMIT ?"
+    params.append(limit)
+
+    rows = conn.execute(sql, params).fetchall()
+    if after_ts and not before_ts:
+        rows.reverse()
+    return rows
@@ -0,0 +1,58 @@
+"""Versioni dell'archivio per le GET condizionali (ETag / Last-Modified).
+
+Ogni scrittura che cambia quello che restituiscono `/channels`, `/users`,
+`/messages/<id>` e `/thread/<id>` incrementa una generazione in
+`cache_generations`: `users`, `channels` e `messages:<channel>` per i messaggi
+di un canale (lo fa `archive_index.refresh_thread`, più le modifiche di testo e
+permalink che non passano da lì). `version()` somma le generazioni coinvolte e
+prende il loro `updated_at` più recente con una query sulla chiave primaria, così
+una richiesta con `If-None-Match` uguale può avere 304 senza eseguire la query
+dell'endpoint. Le generazioni crescono e basta, quindi la somma cambia a ogni
+scrittura.
+"""
+
+import utils
+
+USERS_SCOPE = "users"
+CHANNELS_SCOPE = "channels"
+MESSAGES_PREFIX = "messages:"
+
+
+def channel_scope(channel):
+    return MESSAGES_PREFIX + channel
+
+
+def bump_channel(conn, channel):
+    """Da chiamare dopo aver modificato i messaggi di un canale (non fa commit)."""
+    utils.bump_generation(conn, channel_scope(channel))
+
+
+def bump_users(conn):
+    utils.bump_generation(conn, USERS_SCOPE)
+
+
+def bump_channels(conn):
+    utils.bump_generation(conn, CHANNELS_SCOPE)
+
+
+def version(conn, scopes=(), all_channels=False):
+    """(somma delle generazioni, `updated_at` più recente o None) degli scope indicati.
+
+    Con `all_channels` conta anche tutti gli scope `messages:<channel>`.
+    """
+    sql = "SELECT COALESCE(SUM(generation), 0), MAX(updated_at) FROM cache_generations WHERE scope IN ({})".format(
+        ", ".join("?" for _ in scopes) or "NULL"
+    )
+    params = list(scopes)
+    if all_channels:
+        # Range sulla chiave primaria: ';' è il carattere successivo a ':'
+        sql += " OR (scope >= ? AND scope < ?)"
+        params += [MESSAGES_PREFIX, MESSAGES_PREFIX[:-1] + ";"]
+    generation, updated_at = conn.execute(sql, params).fetchone()
+    return generation, updated_at
+
+
+def thread_scopes(conn, thread_ts):
+    """Scope dei canali che contengono il thread `thread_ts`."""
+    rows = conn.execute("SELECT channel FROM threads WHERE thread_ts = ?", (thread_ts,)).fetchall()
+    return [channel_scope(row[0]) for row in rows]
@@ -2,16 +2,35 @@ import argparse
 import json
 import logging
 import os
+import time
 import traceback
-from sentence_transformers import SentenceTransformer
+import uuid
 import re
 from datetime import datetime, timedelta
 
 from slack_bolt import App
-from openai import OpenAI
 
 from ai_context import format_messages_for_prompt, get_ai_context_scope, is_engage_request
-from utils import db_connect, migrate_db
+from ai_stream import ProgressiveSlackReply, iter_completion_deltas
+import archive_context
+import archive_index
+import archive_versions
+import auth_context
+import background
+import channel_directory
+import embeddings
+import llm_client
+import message_entities
+import metrics
+import permalinks
+import rate_limiter
+import rollups
+import slack_api
+import thread_coalescer
+import thread_state
+from clown_index import ClownIndex, parse_expiry as _parse_clown_expiry, sweep_expired
+from user_directory import UserDirectory
+from utils import bump_generation, db_connect, migrate_db
 from url_cleaner import UrlCleaner
 from sferait_context import (
     SFERAIT_SYSTEM_PROMPT,
@@ -35,18 +54,6 @@ ADMIN_USERS = [
     'U011PN35BHT'
 ]
 
-# Lazy-loaded SentenceTransformer model (loaded once on first use)
-_sentence_transformer_model = None
-
-
-def _get_sentence_transformer():
-    """Get or initialize the SentenceTransformer model (lazy loading)."""
-    global _sentence_transformer_model
-    if _sentence_transformer_model is None:
-        logger.info("Loading SentenceTransformer model (one-time initialization)...")
-        _sentence_transformer_model = SentenceTransformer('paraphrase-MiniLM-L6-v2')
-        logger.info("SentenceTransformer model loaded successfully")
-    return _sentence_transformer_model
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -77,13 +84,42 @@ assert log_level in ["CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"]
 logging.basicConfig(level=getattr(logging, log_level))
 logger = logging.getLogger(__name__)
 
+# Client condiviso con rate limit per metodo, retry sui 429, coalescing e cache delle letture
 app = App(
-    token=os.environ.get("SLACK_BOT_TOKEN"),
+    client=slack_api.create_client(os.environ.get("SLACK_BOT_TOKEN")),
     signing_secret=os.environ.get("SLACK_SIGNING_SECRET"),
     logger=logger,
 )
 
+
+# Tempo di cold start del processo fino al primo evento gestito
+_cold_start = {"started": time.monotonic(), "first_event_seen": False}
+
+
+def mark_worker_started():
+    """Riparte il cronometro di cold start (chiamato dopo il fork dei worker Gunicorn)."""
+    _cold_start.update(started=time.monotonic(), first_event_seen=False)
+
+
+@app.middleware
+def _use_shared_client(context, next):
+    # Bolt crea un WebClient nuovo per ogni richiesta: usiamo quello condiviso con i rate limit
+    context["client"] = app.client
+    if not _cold_start["first_event_seen"]:
+        _cold_start["first_event_seen"] = True
+        elapsed = time.monotonic() - _cold_start["started"]
+        metrics.observe("startup.first_event_seconds", elapsed)
+        logger.info(f"[STARTUP] First event handled {elapsed:.2f}s after start (pid {os.getpid()})")
+    next()
+
+
 CHANNEL_RECAP_MESSAGE_LIMIT = 1000
+AI_RATE_LIMITS = ((60, 2), (3600, 10))  # (finestra in secondi, richieste massime) per utente
+
+# Risposte alle mention in streaming: placeholder subito, poi chat_update progressivi
+AI_STREAM_REPLIES = os.environ.get("ARCHIVE_BOT_AI_STREAMING", "true").lower() == "true"
+AI_STREAM_UPDATE_INTERVAL = float(os.environ.get("ARCHIVE_BOT_AI_STREAM_INTERVAL", 1.5))
+AI_STREAM_PLACEHOLDER = "_Sto pensando..._ :hourglass_flowing_sand:"
 
 # Auto-engagement storico su #trash: lasciato nel codice per compatibilità, ma non viene più chiamato.
 TRASH_CHANNEL_NAMES = ["trash"]
@@ -97,18 +133,22 @@ ENGAGED_THREAD_STOP_ACTION_ID = "trash_stop_thread"  # legacy action_id: non cam
 # URL cleaner instance loading local rules
 _url_cleaner = UrlCleaner(rules_file=os.path.join(os.path.dirname(__file__), "url_rules.json"))
 
-# Save the bot user's user ID e display name (per identificare i propri messaggi nei thread)
-app._bot_user_id = app.client.auth_test()["user_id"]
-try:
-    _bot_profile = app.client.users_info(user=app._bot_user_id)["user"]["profile"]
-    app._bot_display_name = (
-        _bot_profile.get("display_name")
-        or _bot_profile.get("real_name")
-        or "bot"
-    )
-except Exception as _e:
-    logger.warning(f"Impossibile recuperare display_name del bot: {_e}")
-    app._bot_display_name = "bot"
+# Save the bot user's user ID (per identificare i propri messaggi nei thread).
+# La risposta di auth_test è già in cache nel client: Bolt la chiama nel costruttore di App.
+_auth = app.client.auth_test()
+app._bot_user_id = _auth["user_id"]
+# Dominio del workspace per costruire i permalink senza chat_getPermalink
+PERMALINK_BASE_URL = permalinks.workspace_url(_auth)
+
+# Directory utenti con cache: i path delle richieste non fanno mai un users_list completo
+USER_DIRECTORY = UserDirectory(app.client, database_path)
+USERS_SYNC_INTERVAL_SECONDS = 30 * 60
+background.register("users_sync", USERS_SYNC_INTERVAL_SECONDS, USER_DIRECTORY.sync)
+
+
+def get_bot_display_name():
+    """Display name del bot, risolto al primo uso (users_info) e poi dalla cache della directory."""
+    return USER_DIRECTORY.display_name(app._bot_user_id, default="bot")
 
 
 MENTION_HINT_PROMPT = (
@@ -126,104 +166,47 @@ MENTION_HINT_PROMPT = (
 # Uses slack API to get most recent user list
 # Necessary for User ID correlation
 def update_users(conn, cursor):
+    """Sync completo (ma incrementale) della directory utenti. Usato all'avvio."""
     logger.info("Updating users")
-    info = app.client.users_list()
-
-    args = []
-    for m in info["members"]:
-        name = m["profile"]["display_name"]
-        if not name:
-            name = m["profile"]["real_name"]
-        args.append(
-            (
-                name,
-                m["id"],
-                m["profile"].get(
-                    "image_72",
-                    "http://fst.slack-edge.com/66f9/img/avatars/ava_0024-32.png",
-                ),
-                m.get("deleted", False),
-                m["profile"].get("real_name", ""),
-                m["profile"].get("display_name", ""),
-                m["profile"].get("email", "")
-            )
-        )
-    cursor.executemany("INSERT OR REPLACE INTO users(name, id, avatar, is_deleted, real_name, display_name, email) VALUES(?,?,?,?,?,?,?)", args)
-    conn.commit()
+    USER_DIRECTORY.sync(force=True)
 
 
 def create_embeddings(message):
     try:
-        model = _get_sentence_transformer()
-        embeddings = model.encode(message)
+        return embeddings.encode(message)
     except Exception as e:
         logger.warning(f"Error creating embeddings: {e}")
-        embeddings = ""
-    return embeddings
+        return ""
 
 
 def get_channel_info(channel_id):
-    channel = app.client.conversations_info(channel=channel_id)["channel"]
-
     # Get a list of members for the channel. This will be used when querying private channels.
-    response = app.client.conversations_members(channel=channel["id"])
-    members = response["members"]
-    while response["response_metadata"]["next_cursor"]:
-        response = app.client.conversations_members(
-            channel=channel["id"], cursor=response["response_metadata"]["next_cursor"]
-        )
-        members += response["members"]
-
-    return (
-        channel["id"],
-        channel["name"],
-        channel["is_private"],
-        [(channel["id"], m) for m in members],
-    )
+    return channel_directory.fetch_channel(app.client, channel_id)
 
 
 def update_channels(conn, cursor):
+    """Refresh completo dello snapshot di canali e membri, su un pool di thread."""
     logger.info("Updating channels")
-    channels = app.client.conversations_list(types="public_channel,private_channel")[
-        "channels"
-    ]
+    channel_directory.refresh(app.client, database_path, force=True)
 
-    channel_args = []
-    member_args = []
-    for channel in channels:
-        if channel["is_member"]:
-            channel_id, channel_name, channel_is_private, members = get_channel_info(
-                channel["id"]
-            )
 
-            channel_args.append((channel_name, channel_id, channel_is_private))
-
-            member_args += members
-
-    cursor.executemany(
-        "INSERT INTO channels(name, id, is_private) VALUES(?,?,?)", channel_args
-    )
-    cursor.executemany("INSERT INTO members(channel, user) VALUES(?,?)", member_args)
-    conn.commit()
+def warm_up():
+    """Refresh di utenti e canali dopo l'avvio, mentre il server accetta già eventi.
 
+    Fino alla fine si usa lo snapshot nel DB; entrambi i sync sono saltati se lo
+    snapshot è recente e girano in un solo worker alla volta.
+    """
+    started = time.monotonic()
+    USER_DIRECTORY.sync()
+    channel_directory.refresh(app.client, database_path)
+    elapsed = time.monotonic() - started
+    metrics.observe("startup.warmup_seconds", elapsed)
+    logger.info(f"[STARTUP] Warm-up done in {elapsed:.2f}s")
 
-def _parse_clown_expiry(expiry_date):
-    """Parsing robusto della scadenza clown.
 
-    Non ci fidiamo del confronto lessicografico su TEXT: se in futuro il formato
-    cambia leggermente, un clown può restare attivo per sempre. Qui convertiamo
-    sempre a datetime e, se il valore è illeggibile, lo consideriamo scaduto.
-    """
-    if not expiry_date:
-        return None
-    try:
-        return datetime.fromisoformat(str(expiry_date))
-    except Exception:
-        try:
-            return datetime.strptime(str(expiry_date), "%Y-%m-%d %H:%M:%S")
-        except Exception:
-            logger.warning(f"[CLOWN] expiry_date non parsabile, considero scaduto: {expiry_date}")
-            return None
+background.register_startup("warm_up", warm_up)
+if embeddings.WARM_UP:
+    background.register_startup("embeddings_warm_up", embeddings.warm_up)
 
 
 def _is_clown_expired(expiry_date, now=None):
@@ -233,17 +216,63 @@ def _is_clown_expired(expiry_date, now=None):
     return expiry <= (now or datetime.now())
 
 
+# Copia in memoria della lista clown, ricaricata quando cambia la generazione nel DB
+CLOWN_INDEX = ClownIndex()
+CLOWN_SWEEP_INTERVAL_SECONDS = 60
+
+
+def _sweep_expired_clowns():
+    conn, _ = db_connect(database_path)
+    try:
+        expired = sweep_expired(conn)
+        if expired:
+            logger.info(f"[CLOWN] Sweep removed expired clown users: {expired}")
+    finally:
+        conn.close()
+
+
+background.register("clown_sweep", CLOWN_SWEEP_INTERVAL_SECONDS, _sweep_expired_clowns)
+
+
+# Verifica a campione dei permalink calcolati localmente (opzionale)
+PERMALINK_VERIFY = os.environ.get("ARCHIVE_BOT_VERIFY_PERMALINKS", "false").lower() == "true"
+PERMALINK_VERIFY_INTERVAL_SECONDS = 3600
+
+
+def _verify_permalinks():
+    conn, _ = db_connect(database_path)
+    try:
+        checked, fixed = permalinks.verify_sample(conn, app.client, PERMALINK_BASE_URL)
+        logger.info(f"[PERMALINK] Verified {checked} permalinks, {fixed} corrected")
+    finally:
+        conn.close()
+
+
+if PERMALINK_VERIFY:
+    background.register("permalink_verify", PERMALINK_VERIFY_INTERVAL_SECONDS, _verify_permalinks)
+
+
+# Rollup giornaliere di /stats, aggiornate dai nuovi messaggi (vedi rollups.py)
+ROLLUP_INTERVAL_SECONDS = int(os.environ.get("ARCHIVE_BOT_ROLLUP_INTERVAL_SECONDS", 60))
+
+
+def _run_rollups():
+    conn, _ = db_connect(database_path)
+    try:
+        rollups.run(conn)
+    finally:
+        conn.close()
+
+
+background.register("rollups", ROLLUP_INTERVAL_SECONDS, _run_rollups)
+
+
 def clean_expired_clown_users(conn, cursor):
     """Rimuove gli utenti scaduti dalla lista clown nel database."""
-    now = datetime.now()
-    cursor.execute("SELECT nickname, expiry_date FROM clown_users")
-    current_users = cursor.fetchall()
-    expired = [nickname for nickname, expiry in current_users if _is_clown_expired(expiry, now)]
+    expired = sweep_expired(conn)
     
     if expired:
         logger.info(f"[CLOWN] Cleaning {len(expired)} expired users: {expired}")
-        cursor.executemany("DELETE FROM clown_users WHERE nickname = ?", [(nickname,) for nickname in expired])
-        conn.commit()
         for nickname in expired:
             logger.info(f"[CLOWN] Removed expired clown user: {nickname}")
     
@@ -268,6 +297,7 @@ def is_user_in_clown_list(conn, cursor, nickname_lower):
     if _is_clown_expired(expiry_date):
         logger.info(f"[CLOWN] {nickname_lower} expired at {expiry_date}; removing before reaction")
         cursor.execute("DELETE FROM clown_users WHERE nickname = ?", (nickname_lower,))
+        bump_generation(conn, "clown_users")
         conn.commit()
         return False
 
@@ -293,7 +323,9 @@ def add_clown_user(conn, cursor, nickname_lower, expiry_date, *,
         "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
         (nickname_lower, expiry_str, source, assigned_by, assigned_at, reason, thread_ts, channel),
     )
+    bump_generation(conn, "clown_users")
     conn.commit()
+    CLOWN_INDEX.invalidate()
     logger.info(
         f"[CLOWN] Added {nickname_lower} (source={source}, by={assigned_by}) expires: {expiry_date}"
     )
@@ -302,7 +334,9 @@ def add_clown_user(conn, cursor, nickname_lower, expiry_date, *,
 def remove_clown_user(conn, cursor, nickname_lower):
     """Rimuove un utente dalla lista clown nel database."""
     cursor.execute("DELETE FROM clown_users WHERE nickname = ?", (nickname_lower,))
+    bump_generation(conn, "clown_users")
     conn.commit()
+    CLOWN_INDEX.invalidate()
     logger.info(f"[CLOWN] Removed {nickname_lower} from clown list in DB")
 
 
@@ -446,10 +480,15 @@ def handle_query(event, cursor, say):
                 "INSERT INTO optout (user, timestamp) VALUES (?, CURRENT_TIMESTAMP)",
                 (target_user_id,)
             )
+            touched_threads = archive_index.user_threads(cursor.connection, target_user_id)
+            rollups.mark_user_dirty(cursor.connection, target_user_id)
+            message_entities.forget_user(cursor.connection, target_user_id)
             cursor.execute(
                 'UPDATE messages SET message = "User opted out of archiving. This message has been deleted", user = "USLACKBOT", permalink = "" WHERE user = ?',
                 (target_user_id,)
             )
+            archive_index.refresh_threads(cursor.connection, touched_threads)
+            bump_generation(cursor.connection, auth_context.GENERATION_SCOPE)
             cursor.connection.commit()
             logger.info(f"[OPTOUT] Admin {user_id} executed opt-out for user {target_user_id} ({target_name})")
             say(f"✅ Opt-out eseguito per l'utente {target_name} ({target_user_id}). Tutti i suoi messaggi sono stati anonimizzati.")
@@ -495,15 +534,19 @@ def get_permalink_and_save(res):
         logger.debug(res)
         conn, cursor = db_connect(database_path)
 
-        permalink = app.client.chat_getPermalink(channel=newres[3], message_ts=newres[2])
-        logger.debug(permalink["permalink"])
+        # newres punta alla prima risposta se res è un root (vedi get_first_reply_in_thread)
+        permalink = permalinks.build_permalink(
+            PERMALINK_BASE_URL, newres[3], newres[2], res[2] if newres[2] != res[2] else None
+        )
+        logger.debug(permalink)
         res = res[:-1]
-        res = res + (permalink["permalink"],)
+        res = res + (permalink,)
 
         cursor.execute(
             "UPDATE messages SET permalink = ? WHERE user = ? AND channel = ? AND timestamp = ?",
-            (permalink["permalink"], res[1], res[3], res[2]),
+            (permalink, res[1], res[3], res[2]),
         )
+        archive_versions.bump_channel(conn, res[3])
         conn.commit()
     else:
         logger.debug("Permalink already in database, skipping get_permalink_and_save")
@@ -595,22 +638,17 @@ def check_and_store_links(message, permalink_dict, say):
     try:
         # Ottieni il permalink del messaggio corrente
         current_permalink = permalink_dict.get("permalink", "")
-        # Se non c'è permalink, prova a ottenerlo
+        # Se non c'è permalink (messaggio root), calcolalo localmente
         if not current_permalink and message.get("ts"):
-            try:
-                current_permalink = app.client.chat_getPermalink(
-                    channel=message["channel"], 
-                    message_ts=message["ts"]
-                )["permalink"]
-            except Exception as e:
-                logger.warning(f"Could not get permalink for message: {e}")
+            current_permalink = permalinks.build_permalink(
+                PERMALINK_BASE_URL, message["channel"], message["ts"], message.get("thread_ts")
+            )
         
         # Ottieni il nome utente per la risposta
         user_name = message.get("user", "")
         try:
-            user_info = app.client.users_info(user=user_name)
-            user_display_name = user_info["user"]["profile"].get("display_name") or user_info["user"]["profile"].get("real_name", "utente")
-        except:
+            user_display_name = USER_DIRECTORY.display_name(user_name)
+        except Exception:
             user_display_name = "utente"
         
         for original_url in urls:
@@ -757,14 +795,10 @@ def handle_join(event):
             channel_id, channel_name, channel_is_private, members = get_channel_info(
                 event["channel"]
             )
-            cursor.execute(
-                "INSERT INTO channels(name, id, is_private) VALUES(?,?,?)",
-                (channel_name, channel_id, channel_is_private),
-            )
-            cursor.executemany("INSERT INTO members(channel, user) VALUES(?,?)", members)
+            channel_directory.write_channel(conn, channel_id, channel_name, channel_is_private, members)
         else:
             cursor.execute(
-                "INSERT INTO members(channel, user) VALUES(?,?)",
+                "INSERT OR IGNORE INTO members(channel, user) VALUES(?,?)",
                 (event["channel"], event["user"]),
             )
         conn.commit()
@@ -792,6 +826,7 @@ def handle_rename(event):
         cursor.execute(
             "UPDATE channels SET name = ? WHERE id = ?", (channel["name"], channel["id"])
         )
+        archive_versions.bump_channels(conn)
         conn.commit()
     finally:
         conn.close()
@@ -821,17 +856,60 @@ def handle_channel_name():
 
 @app.event("user_change")
 def handle_user_change(event):
-    user_id = event["user"]["id"]
-    new_username = event["user"]["profile"]["display_name"]
-    if not new_username:
-        new_username = event["user"]["profile"]["real_name"]
+    USER_DIRECTORY.apply_user_change(event["user"])
 
-    conn, cursor = db_connect(database_path)
+
+def archive_incoming_message(conn, cursor, message):
+    """Archivia un messaggio in arrivo, rispettando l'opt-out. Ritorna il permalink.
+
+    Con l'opt-out testo e utente di `message` vengono sostituiti.
+    """
+    # get the permalink only if the message is not the main post (slack bug), otherwise leave it empty
+    if message.get("thread_ts"):
+        permalink = {'permalink': permalinks.build_permalink(
+            PERMALINK_BASE_URL, message["channel"], message["ts"], message["thread_ts"]
+        )}
+    else:
+        permalink = {'permalink': ''}
+
+    # Check if user opted out
+    cursor.execute("SELECT user, timestamp FROM optout WHERE user = ?", (message["user"],))
+    row = cursor.fetchone()
+
+    if row is not None:
+        message["text"] = "User opted out of archiving. This message has been deleted"
+        message["user"] = "USLACKBOT"
+        message["permalink"] = ""
+
+    logger.debug(permalink["permalink"])
+    archive_context.archive_message(
+        conn,
+        message["channel"],
+        message["ts"],
+        message["thread_ts"] if "thread_ts" in message else message["ts"],
+        message["user"],
+        message["text"],
+        permalink["permalink"],
+        create_embeddings(message["text"]),
+    )
+    return permalink
+
+
+def archive_mention(message):
+    """Archivia una mention del bot prima di rispondere: è una domanda che deve
+    restare nel contesto letto dal DB (archive_context) delle richieste successive."""
+    if message.get("channel_type") == "im" or not message.get("user"):
+        return
+    conn = None
     try:
-        cursor.execute("UPDATE users SET name = ? WHERE id = ?", (new_username, user_id))
-        conn.commit()
+        conn, cursor = db_connect(database_path)
+        archive_incoming_message(conn, cursor, dict(message))
+    except Exception as e:
+        logger.error(f"[AI] Error archiving mention: {e}")
+        logger.error(traceback.format_exc())
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
 
 def handle_message(message, say):
@@ -860,6 +938,10 @@ def handle_message(message, say):
 
     if bot_user_id and f"<@{bot_user_id}>" in text:
         logger.info(f"[AI] Bot mentioned in message (via handle_message) by user {user_id}")
+        # La mention non passa da maybe_reply_to_engaged_thread: la domanda va
+        # nello stato del thread prima della risposta del bot (save_bot_reply)
+        append_to_thread_state(message)
+        archive_mention(message)
         # @bot /engage ingaggia il thread; una mention normale resta one-shot.
         try:
             if _maybe_handle_engage_command(message, say):
@@ -879,43 +961,12 @@ def handle_message(message, say):
     elif "user" not in message:
         logger.warning("No valid user. Previous event not saved")
     else:  # Otherwise save the message to the archive.
-        # get the permalink only if the message is not the main post (slack bug), otherwise leave it empty
-        if "thread_ts" in message:
-            permalink = app.client.chat_getPermalink(
-                channel=message["channel"], message_ts=message["ts"]
-            )
-        else:
-            permalink = {'permalink': ''}
-
         # Save original message data before opt-out check
         original_text = message.get("text", "")
         original_user = message.get("user", "")
-        
-        # Check if user opted out
-        cursor.execute("SELECT user, timestamp FROM optout WHERE user = ?", (message["user"],))
-        row = cursor.fetchone()
-
         clown_user = message["user"]
 
-        if row is not None:
-            message["text"] = "User opted out of archiving. This message has been deleted"
-            message["user"] = "USLACKBOT"
-            message["permalink"] = ""
-
-        logger.debug(permalink["permalink"])
-        cursor.execute(
-            "INSERT INTO messages VALUES(?, ?, ?, ?, ?, ?, ?)",
-            (
-                message["text"],
-                message["user"],
-                message["channel"],
-                message["ts"],
-                permalink["permalink"],
-                message["thread_ts"] if "thread_ts" in message else message["ts"],
-                create_embeddings(message["text"])
-            ),
-        )
-        conn.commit()
+        permalink = archive_incoming_message(conn, cursor, message)
         conn.close()
 
         # Check for duplicate links and respond if found (using original message data)
@@ -928,17 +979,19 @@ def handle_message(message, say):
         # Post xcancel.com alternatives for any x.com links
         post_xcancel_alternatives(original_message, say)
 
-        # Ensure that the user exists in the DB
+        # Ensure that the user exists in the DB (users_info solo per utenti sconosciuti)
         conn, cursor = db_connect(database_path)
-        cursor.execute("SELECT * FROM users WHERE id = ?", (message["user"],))
-        row = cursor.fetchone()
-        if row is None:
-            update_users(conn, cursor)
+        USER_DIRECTORY.ensure_user(conn, clown_user)
         
-        # Ottieni il nome utente per controllare se è nella lista clown
-        # Controlla name, display_name e real_name per trovare il match
-        cursor.execute("SELECT name, display_name, real_name FROM users WHERE id = ?", (clown_user,))
-        user_row = cursor.fetchone()
+        # Lista clown dall'indice in memoria: con la lista vuota nessuna query
+        CLOWN_INDEX.sync(conn)
+        user_row = None
+        if len(CLOWN_INDEX):
+            # Controlla name, display_name e real_name per trovare il match
+            cursor.execute("SELECT name, display_name, real_name FROM users WHERE id = ?", (clown_user,))
+            user_row = cursor.fetchone()
+            if user_row is None:
+                logger.warning(f"[CLOWN] Could not find user in database for user_id: {clown_user}")
         
         # Controlla se l'utente è nella lista clown e aggiungi la reaction
         if user_row:
@@ -946,11 +999,6 @@ def handle_message(message, say):
             display_name = user_row[1] if user_row[1] else ""
             real_name = user_row[2] if user_row[2] else ""
             
-            logger.debug(f"[CLOWN] User data from DB - name: '{name}', display_name: '{display_name}', real_name: '{real_name}'")
-            
-            # Pulisci utenti scaduti e controlla se l'utente è nella lista
-            clean_expired_clown_users(conn, cursor)
-            
             # Controlla tutti i possibili nickname (name, display_name, real_name)
             # in ordine di priorità: display_name > name > real_name
             user_names_to_check = []
@@ -961,22 +1009,9 @@ def handle_message(message, say):
             if real_name and real_name.lower() not in user_names_to_check:
                 user_names_to_check.append(real_name.lower())
             
-            logger.debug(f"[CLOWN] Checking user names (lowercase): {user_names_to_check}")
-            
-            # Controlla se uno dei nickname corrisponde
-            found_in_list = False
-            matched_nickname = None
-            for user_name_lower in user_names_to_check:
-                if is_user_in_clown_list(conn, cursor, user_name_lower):
-                    found_in_list = True
-                    matched_nickname = user_name_lower
-                    break
-            
-            if found_in_list:
-                # Ottieni la data di scadenza per il log
-                cursor.execute("SELECT expiry_date FROM clown_users WHERE nickname = ?", (matched_nickname,))
-                expiry_result = cursor.fetchone()
-                expiry = expiry_result[0] if expiry_result else "unknown"
+            match = CLOWN_INDEX.lookup(user_names_to_check)
+            if match:
+                matched_nickname, expiry = match
                 logger.info(f"[CLOWN] User '{matched_nickname}' found in clown list (expires: {expiry})")
                 try:
                     result = app.client.reactions_add(
@@ -993,8 +1028,6 @@ def handle_message(message, say):
                     logger.error(traceback.format_exc())
             else:
                 logger.debug(f"[CLOWN] User not in clown list (checked: {user_names_to_check})")
-        else:
-            logger.warning(f"[CLOWN] Could not find user in database for user_id: {message.get('user', 'unknown')}")
 
         conn.close()
 
@@ -1033,27 +1066,13 @@ def handle_message_default(message, say):
 
 
 def get_thread_messages(channel, thread_ts):
-    """Recupera tutti i messaggi di un thread."""
+    """Recupera tutti i messaggi di un thread (dall'archivio, Slack solo se serve)."""
+    conn = None
     try:
-        cursor = None
-
-        # Usa conversations_replies per recuperare tutti i messaggi del thread
-        response = app.client.conversations_replies(channel=channel, ts=thread_ts)
-        messages = response.get("messages", [])
-
-        # Continua a recuperare se ci sono più pagine
-        while response.get("has_more", False):
-            cursor = response.get("response_metadata", {}).get("next_cursor")
-            if not cursor:
-                break
-            response = app.client.conversations_replies(
-                channel=channel, ts=thread_ts, cursor=cursor
-            )
-            messages.extend(response.get("messages", []))
-
-        # Ordina i messaggi per timestamp
-        messages.sort(key=lambda x: float(x.get("ts", 0)))
-
+        conn, _ = db_connect(database_path)
+        messages = archive_context.thread_messages(
+            conn, app.client, channel, thread_ts, bot_user_id=app._bot_user_id
+        )
         return build_ai_context_messages(messages)
 
     except Exception as e:
@@ -1061,44 +1080,30 @@ def get_thread_messages(channel, thread_ts):
         logger.error(traceback.format_exc())
         return []
 
+    finally:
+        if conn is not None:
+            conn.close()
+
 
 def get_channel_messages(channel, latest_ts=None, limit=CHANNEL_RECAP_MESSAGE_LIMIT):
-    """Recupera gli ultimi N messaggi visibili nel canale."""
+    """Recupera gli ultimi N messaggi visibili nel canale (dall'archivio, Slack solo per i buchi)."""
+    conn = None
     try:
-        all_messages = []
-        cursor = None
-
-        response = app.client.conversations_history(
-            channel=channel,
-            inclusive=True,
-            latest=latest_ts,
-            limit=min(limit, 200),
+        conn, _ = db_connect(database_path)
+        messages = archive_context.channel_messages(
+            conn, app.client, channel, latest_ts=latest_ts, limit=limit, bot_user_id=app._bot_user_id
         )
-        all_messages.extend(response.get("messages", []))
-
-        while response.get("has_more", False) and len(all_messages) < limit:
-            cursor = response.get("response_metadata", {}).get("next_cursor")
-            if not cursor:
-                break
-
-            response = app.client.conversations_history(
-                channel=channel,
-                cursor=cursor,
-                limit=min(limit - len(all_messages), 200),
-            )
-            all_messages.extend(response.get("messages", []))
-
-        # conversations_history restituisce i messaggi dal più recente al meno recente.
-        all_messages = all_messages[:limit]
-        all_messages.sort(key=lambda x: float(x.get("ts", 0)))
-
-        return build_ai_context_messages(all_messages)
+        return build_ai_context_messages(messages)
 
     except Exception as e:
         logger.error(f"Error getting channel messages: {e}")
         logger.error(traceback.format_exc())
         return []
 
+    finally:
+        if conn is not None:
+            conn.close()
+
 
 def build_ai_context_messages(messages):
     """Converte i messaggi Slack in un formato compatto per il prompt AI."""
@@ -1135,6 +1140,22 @@ def build_ai_context_messages(messages):
             conn.close()
 
 
+def save_bot_reply(channel, ts, thread_ts, text):
+    """Archivia una risposta del bot, usata come contesto nelle mention successive."""
+    conn = None
+    try:
+        conn, cursor = db_connect(database_path)
+        bot_user_id = app._bot_user_id
+        archive_context.record_bot_reply(conn, channel, ts, thread_ts, bot_user_id, text)
+        bot_name = get_user_name_map(cursor, [bot_user_id]).get(bot_user_id, get_bot_display_name())
+        thread_state.append(conn, channel, thread_ts, ts, bot_user_id, bot_name, text)
+    except Exception as e:
+        logger.error(f"[AI] Error saving bot reply: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+
 def get_user_name_map(db_cursor, user_ids):
     """Restituisce una mappa user_id -> nome visualizzato."""
     if not user_ids:
@@ -1161,73 +1182,57 @@ def check_ai_throttle(conn, cursor, user_id, channel):
     Ritorna (allowed, message, throttle_info) dove:
     - allowed: True se permesso, False se throttled
     - message: messaggio da inviare se throttled
-    - throttle_info: dict con info sul throttle per logging"""
-    now = datetime.now()
-    # Usa timestamp Unix (numerici) per confronti precisi
-    now_timestamp = now.timestamp()
-    one_minute_ago_timestamp = (now - timedelta(minutes=1)).timestamp()
-    one_hour_ago_timestamp = (now - timedelta(hours=1)).timestamp()
-    
-    # Prima pulisci richieste vecchie (più di 1 ora e 5 minuti) per mantenere il database pulito
-    cleanup_threshold = (now - timedelta(hours=1, minutes=5)).timestamp()
-    cursor.execute("DELETE FROM ai_requests WHERE timestamp < ?", (cleanup_threshold,))
-    deleted_count = cursor.rowcount
-    if deleted_count > 0:
-        logger.debug(f"[AI] Cleaned up {deleted_count} old throttle records")
-    conn.commit()
-    
-    # Conta richieste nell'ultimo minuto (confronto numerico)
-    cursor.execute(
-        "SELECT COUNT(*) FROM ai_requests WHERE timestamp > ? AND user_id = ?",
-        (one_minute_ago_timestamp, user_id)
-    )
-    requests_last_minute = cursor.fetchone()[0]
-    
-    # Conta richieste nell'ultima ora (confronto numerico)
-    cursor.execute(
-        "SELECT COUNT(*) FROM ai_requests WHERE timestamp > ? AND user_id = ?",
-        (one_hour_ago_timestamp, user_id)
-    )
-    requests_last_hour = cursor.fetchone()[0]
-    
+    - throttle_info: dict con info sul throttle (conteggi inclusa la richiesta corrente),
+      usato anche per il footer della risposta"""
+    decision = rate_limiter.check_and_consume(conn, user_id, limits=AI_RATE_LIMITS)
+    requests_last_minute = decision["counts"][60]
+    requests_last_hour = decision["counts"][3600]
+
     throttle_info = {
         "requests_last_minute": requests_last_minute,
         "requests_last_hour": requests_last_hour,
         "limit_per_minute": 2,
         "limit_per_hour": 10,
-        "one_hour_ago_timestamp": one_hour_ago_timestamp,
-        "now_timestamp": now_timestamp
+        "channel": channel,
     }
-    
-    # Controlla limiti
-    if requests_last_minute >= 2:
-        # Calcola quando sarà possibile inviare di nuovo (tra 1 minuto)
-        next_available = (now + timedelta(minutes=1)).strftime("%H:%M:%S")
-        message = f"⏱️ Troppe richieste! Hai già fatto {requests_last_minute} richieste nell'ultimo minuto (limite: 2). Prova di nuovo dopo le {next_available}."
-        logger.warning(f"[AI] Throttle exceeded: {requests_last_minute} requests in last minute (limit: 2)")
-        return False, message, throttle_info
-    
-    if requests_last_hour >= 10:
-        # Calcola quando sarà possibile inviare di nuovo (tra 1 ora)
-        next_available = (now + timedelta(hours=1)).strftime("%H:%M:%S")
-        message = f"⏱️ Troppe richieste! Hai già fatto {requests_last_hour} richieste nell'ultima ora (limite: 10). Prova di nuovo dopo le {next_available}."
-        logger.warning(f"[AI] Throttle exceeded: {requests_last_hour} requests in last hour (limit: 10)")
+
+    if not decision["allowed"]:
+        next_available = (datetime.now() + timedelta(seconds=decision["retry_after"])).strftime("%H:%M:%S")
+        if decision["window"] == 60:
+            message = f"⏱️ Troppe richieste! Hai già fatto {requests_last_minute} richieste nell'ultimo minuto (limite: 2). Prova di nuovo dopo le {next_available}."
+            logger.warning(f"[AI] Throttle exceeded: {requests_last_minute} requests in last minute (limit: 2)")
+        else:
+            message = f"⏱️ Troppe richieste! Hai già fatto {requests_last_hour} richieste nell'ultima ora (limite: 10). Prova di nuovo dopo le {next_available}."
+            logger.warning(f"[AI] Throttle exceeded: {requests_last_hour} requests in last hour (limit: 10)")
         return False, message, throttle_info
-    
-    # Registra la richiesta con timestamp Unix
-    cursor.execute(
-        "INSERT INTO ai_requests (timestamp, user_id, channel) VALUES (?, ?, ?)",
-        (now_timestamp, user_id, channel)
-    )
-    conn.commit()
-    
-    logger.info(f"[AI] Throttle OK: {requests_last_minute}/2 per minuto, {requests_last_hour}/10 per ora (now_ts: {now_timestamp:.2f}, one_hour_ago_ts: {one_hour_ago_timestamp:.2f})")
+
+    logger.info(f"[AI] Throttle OK: {requests_last_minute}/2 per minuto, {requests_last_hour}/10 per ora")
     return True, None, throttle_info
 
 
+def rate_limit_footer(throttle_info):
+    """Riga con i rate limit da aggiungere alla risposta AI."""
+    return (
+        f"\n\n_📊 Rate limit per user: {throttle_info['requests_last_minute']}/2 al minuto, "
+        f"{throttle_info['requests_last_hour']}/10 all'ora_"
+    )
+
+
 def handle_app_mention(event, say):
     """Gestisce le menzioni del bot in una conversazione.
     Può essere chiamata sia dall'evento app_mention che da handle_message."""
+    started_at = time.monotonic()
+    progressive = None
+
+    def reply(text):
+        # Con lo streaming attivo il placeholder diventa la risposta definitiva
+        if progressive is not None:
+            progressive.finish(text)
+            reply_ts = progressive.ts
+        else:
+            reply_ts = say(text, thread_ts=response_thread_ts).get("ts")
+        save_bot_reply(channel, reply_ts, response_thread_ts, text)
+
     try:
         channel = event.get("channel")
         message_ts = event.get("ts")  # Timestamp del messaggio che menziona il bot
@@ -1253,6 +1258,15 @@ def handle_app_mention(event, say):
             return
         
         conn.close()
+
+        if AI_STREAM_REPLIES:
+            progressive = ProgressiveSlackReply(
+                post=lambda text: say(text, thread_ts=response_thread_ts)["ts"],
+                update=lambda ts, text: app.client.chat_update(channel=channel, ts=ts, text=text),
+                placeholder=AI_STREAM_PLACEHOLDER,
+                min_interval=AI_STREAM_UPDATE_INTERVAL,
+            )
+            progressive.start()
         
         # Rimuovi la menzione del bot dal testo
         bot_user_id = app._bot_user_id
@@ -1286,7 +1300,7 @@ def handle_app_mention(event, say):
             )
 
         if not context_messages:
-            say("Non ho trovato messaggi utili in questo contesto.", thread_ts=response_thread_ts)
+            reply("Non ho trovato messaggi utili in questo contesto.")
             return
         
         logger.info(f"[AI] Found {len(context_messages)} messages for {context_scope} context")
@@ -1321,17 +1335,14 @@ def handle_app_mention(event, say):
         )
         
         # Chiama ChatGPT
-        openai_api_key = os.environ.get("OPENAI_API_KEY")
-        if not openai_api_key:
+        if not llm_client.is_configured():
             logger.error("[AI] OPENAI_API_KEY not set")
-            say("Errore: chiave API OpenAI non configurata.", thread_ts=response_thread_ts)
+            reply("Errore: chiave API OpenAI non configurata.")
             return
         
-        client = OpenAI(api_key=openai_api_key)
-        
         logger.info(f"[AI] Sending request to OpenAI with {len(context_messages)} messages")
         
-        response = client.chat.completions.create(
+        completion_args = dict(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -1340,45 +1351,46 @@ def handle_app_mention(event, say):
             max_tokens=2000,
             temperature=0.7,
         )
-        
-        ai_response = response.choices[0].message.content.strip()
+
+        if progressive is not None:
+            stream = llm_client.chat_completion("mention", stream=True, **completion_args)
+            for delta in iter_completion_deltas(stream):
+                progressive.feed(delta)
+            ai_response = progressive.text.strip()
+        else:
+            response = llm_client.chat_completion("mention", **completion_args)
+            ai_response = response.choices[0].message.content.strip()
         
         logger.info(f"[AI] Received response from OpenAI, length: {len(ai_response)}")
         
-        # Recupera le informazioni sul throttle corrente per aggiungerle alla risposta
-        conn_throttle, cursor_throttle = db_connect(database_path)
-        now = datetime.now()
-        one_minute_ago_timestamp = (now - timedelta(minutes=1)).timestamp()
-        one_hour_ago_timestamp = (now - timedelta(hours=1)).timestamp()
-        
-        cursor_throttle.execute(
-            "SELECT COUNT(*) FROM ai_requests WHERE timestamp > ? AND user_id = ?",
-            (one_minute_ago_timestamp, user_id)
-        )
-        current_minute_count = cursor_throttle.fetchone()[0]
-        
-        cursor_throttle.execute(
-            "SELECT COUNT(*) FROM ai_requests WHERE timestamp > ? AND user_id = ?",
-            (one_hour_ago_timestamp, user_id)
-        )
-        current_hour_count = cursor_throttle.fetchone()[0]
-        
-        conn_throttle.close()
-        
-        # Aggiungi la riga con i rate limit alla risposta
-        rate_limit_info = f"\n\n_📊 Rate limit per user: {current_minute_count}/2 al minuto, {current_hour_count}/10 all'ora_"
-        final_response = ai_response + rate_limit_info
-        
-        logger.info(f"[AI] Added rate limit info: {current_minute_count}/2 per minuto, {current_hour_count}/10 per ora")
+        # Footer dai conteggi della stessa decisione di throttle
+        final_response = ai_response + rate_limit_footer(throttle_info)
         
         # Rispondi nel thread
-        say(final_response, thread_ts=response_thread_ts)
+        reply(final_response)
+
+        if progressive is not None:
+            first_text_seconds = progressive.first_text_at - started_at
+            logger.info(
+                f"[AI] Streamed reply: first visible text after {first_text_seconds:.2f}s, "
+                f"{progressive.updates} updates"
+            )
+            metrics.incr("ai.mention.stream_updates", progressive.updates)
+        else:
+            first_text_seconds = time.monotonic() - started_at
+        metrics.observe("ai.mention.first_visible_text_seconds", first_text_seconds)
+        metrics.observe("ai.mention.total_seconds", time.monotonic() - started_at)
         
     except Exception as e:
         logger.error(f"[AI] Error handling app mention: {e}")
         logger.error(traceback.format_exc())
+        metrics.incr("ai.mention.errors")
         try:
-            say("Mi dispiace, c'è stato un errore nel processare la tua richiesta.", thread_ts=event.get("thread_ts", event.get("ts")))
+            error_text = "Mi dispiace, c'è stato un errore nel processare la tua richiesta."
+            if progressive is not None and progressive.ts:
+                progressive.finish(error_text)
+            else:
+                say(error_text, thread_ts=event.get("thread_ts", event.get("ts")))
         except:
             pass
 
@@ -1484,7 +1496,7 @@ def _save_trash_engage_decision(
         )
 
 
-def _decide_engage(thread_messages, openai_client):
+def _decide_engage(thread_messages):
     """LLM-call: decide se il bot deve inserirsi nel thread #trash. Ritorna (engage: bool, reply: str)."""
     thread_text = _format_thread_for_llm(thread_messages)
     system = (
@@ -1502,7 +1514,8 @@ def _decide_engage(thread_messages, openai_client):
         "Se engage=false, reply può essere stringa vuota."
     )
     user_msg = f"Thread fino ad ora:\n{thread_text}\n\nDecidi se inserirti."
-    resp = openai_client.chat.completions.create(
+    resp = llm_client.chat_completion(
+        "auto_engage",
         model=AUTO_ENGAGE_DECISION_MODEL,
         messages=[
             {"role": "system", "content": system},
@@ -1517,7 +1530,7 @@ def _decide_engage(thread_messages, openai_client):
     return bool(data.get("engage")), _strip_bot_self_prefix((data.get("reply") or "").strip())
 
 
-def _decide_clown(thread_messages, openai_client):
+def _decide_clown(thread_messages):
     """LLM-call: decide se qualcuno nel thread merita il clown. Ritorna (user_name: str|None, reason: str|None)."""
     thread_text = _format_thread_for_llm(thread_messages)
     system = (
@@ -1540,7 +1553,8 @@ def _decide_clown(thread_messages, openai_client):
         "Il campo clown_user, se non null, deve essere ESATTAMENTE il nome utente come appare nel thread."
     )
     user_msg = f"Thread:\n{thread_text}\n\nChi (se qualcuno) è clown?"
-    resp = openai_client.chat.completions.create(
+    resp = llm_client.chat_completion(
+        "auto_engage",
         model=AUTO_ENGAGE_DECISION_MODEL,
         messages=[
             {"role": "system", "content": system},
@@ -1565,7 +1579,7 @@ def _strip_bot_self_prefix(text):
     name del bot che alias generici."""
     if not text:
         return text
-    bot_name = (app._bot_display_name or "").strip().lower()
+    bot_name = (get_bot_display_name() or "").strip().lower()
     pattern_parts = ["slack-archive-bot", "bot", "assistant"]
     if bot_name and bot_name not in pattern_parts:
         pattern_parts.append(re.escape(bot_name))
@@ -1628,11 +1642,12 @@ def _engaged_stop_button_blocks(reply, channel, thread_ts):
 
 def _say_engaged_thread_reply(say, reply, channel, thread_ts):
     """Posta una risposta in un thread ingaggiato con fallback testuale e bottone stop."""
-    say(
+    response = say(
         text=reply + _engaged_stop_text_fallback(),
         blocks=_engaged_stop_button_blocks(reply, channel, thread_ts),
         thread_ts=thread_ts,
     )
+    save_bot_reply(channel, response.get("ts") if response else None, thread_ts, reply)
 
 
 def _trash_stop_text_fallback():
@@ -1664,7 +1679,7 @@ def _normalize_trash_stop_text(text):
 
 def _bot_text_aliases():
     aliases = ["slack-archive-bot"]
-    bot_name = (app._bot_display_name or "").strip()
+    bot_name = (get_bot_display_name() or "").strip()
     if bot_name and bot_name.lower() not in {a.lower() for a in aliases}:
         aliases.append(bot_name)
     return aliases
@@ -1741,7 +1756,7 @@ def _should_reply_now(thread_messages, bot_user_id):
     return replies_since_last_bot >= n_required, user_replies_count, replies_since_last_bot, n_required
 
 
-def _auto_reply_in_thread(channel, thread_ts, thread_messages, openai_client, say):
+def _auto_reply_in_thread(channel, thread_ts, thread_messages, say):
     """Risposta del bot in un thread già engaged. Usa SFERAIT_SYSTEM_PROMPT.
     Costruisce la sequenza messaggi role-based (assistant per i propri reply)
     per evitare che il modello si auto-citi prefissando con il proprio nome."""
@@ -1771,7 +1786,8 @@ def _auto_reply_in_thread(channel, thread_ts, thread_messages, openai_client, sa
         ),
     })
 
-    resp = openai_client.chat.completions.create(
+    resp = llm_client.chat_completion(
+        "engaged_reply",
         model="gpt-4o",
         messages=chat_messages,
         max_tokens=800,
@@ -1841,6 +1857,8 @@ def _maybe_handle_engage_command(message, say):
             (thread_ts, channel, now_ts, user_id, message_ts),
         )
         conn.commit()
+        # Riparte da uno stato fresco: durante lo stop i messaggi non venivano tracciati
+        thread_state.drop(conn, channel, thread_ts)
 
         logger.info(
             f"[ENGAGE] Thread {thread_ts} engaged in channel {channel} by user {user_id}"
@@ -1888,6 +1906,7 @@ def _maybe_handle_engaged_stop(message, say):
             (thread_ts, channel),
         )
         conn.commit()
+        thread_state.drop(conn, channel, thread_ts)
         logger.info(f"[ENGAGE] Thread {thread_ts} stopped by user request")
         try:
             app.client.reactions_add(channel=channel, timestamp=ts, name="zipper_mouth_face")
@@ -1940,6 +1959,7 @@ def handle_engaged_stop_button(ack, body, client):
             (thread_ts, channel),
         )
         conn.commit()
+        thread_state.drop(conn, channel, thread_ts)
         logger.info(f"[ENGAGE] Thread {thread_ts} stopped by button from user {user_id}")
 
         if message_ts:
@@ -1964,6 +1984,22 @@ def handle_engaged_stop_button(ack, body, client):
         conn.close()
 
 
+def append_to_thread_state(message):
+    """Aggiunge il messaggio allo stato incrementale del suo thread, se inizializzato."""
+    conn = None
+    try:
+        conn, cursor = db_connect(database_path)
+        if thread_state.append_event(
+            conn, message, lambda user: get_user_name_map(cursor, [user]).get(user, "Unknown")
+        ):
+            metrics.incr("thread_state.appends")
+    except Exception as e:
+        logger.error(f"[ENGAGE] Error appending to thread state: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+
 def maybe_reply_to_engaged_thread(message, say):
     """Risponde a ogni nuovo messaggio utente nei thread ingaggiati con @bot /engage."""
     try:
@@ -1987,35 +2023,78 @@ def maybe_reply_to_engaged_thread(message, say):
             row = cursor.fetchone()
             if not row or not row[0] or row[1]:
                 return
+
+            # Stato incrementale: inizializzato una volta dall'archivio, poi solo append
+            if thread_state.is_seeded(conn, channel, thread_ts):
+                thread_state.append_event(
+                    conn, message, lambda user: get_user_name_map(cursor, [user]).get(user, "Unknown")
+                )
+                metrics.incr("thread_state.appends")
+            else:
+                thread_state.seed(conn, channel, thread_ts, get_thread_messages(channel, thread_ts))
+                metrics.incr("thread_state.seeds")
         finally:
             conn.close()
 
-        openai_api_key = os.environ.get("OPENAI_API_KEY")
-        if not openai_api_key:
+        if not llm_client.is_configured():
             logger.warning("[ENGAGE] OPENAI_API_KEY non configurata, skip engaged reply")
             return
 
-        thread_messages = get_thread_messages(channel, thread_ts)
-        if not thread_messages:
-            return
-
-        client = OpenAI(api_key=openai_api_key)
-        _auto_reply_in_thread(channel, thread_ts, thread_messages, client, say)
-
-        conn, cursor = db_connect(database_path)
-        try:
-            cursor.execute(
-                "UPDATE engaged_threads SET last_reply_ts = ? WHERE thread_ts = ? AND channel = ?",
-                (ts, thread_ts, channel),
-            )
-            conn.commit()
-        finally:
-            conn.close()
+        _coalesced_engaged_reply(channel, thread_ts, say)
     except Exception as e:
         logger.error(f"[ENGAGE] Errore engaged reply: {e}")
         logger.error(traceback.format_exc())
 
 
+def _coalesced_engaged_reply(channel, thread_ts, say):
+    """Una sola generazione per thread alla volta, che copre tutti i messaggi
+    arrivati durante la finestra di debounce (vedi thread_coalescer)."""
+    owner = uuid.uuid4().hex
+    conn, cursor = db_connect(database_path)
+    try:
+        if not thread_coalescer.try_acquire(conn, channel, thread_ts, owner):
+            logger.info(f"[ENGAGE] Thread {thread_ts}: reply already in flight, message coalesced")
+            metrics.incr("engage.coalesced_messages")
+            return
+
+        try:
+            while True:
+                thread_coalescer.wait_for_quiet(conn, channel, thread_ts)
+
+                # Lo stop può arrivare durante la finestra di attesa
+                cursor.execute(
+                    "SELECT engaged, stopped FROM engaged_threads WHERE thread_ts = ? AND channel = ?",
+                    (thread_ts, channel),
+                )
+                row = cursor.fetchone()
+                if not row or not row[0] or row[1]:
+                    thread_coalescer.release(conn, channel, thread_ts, owner)
+                    return
+
+                covered = thread_coalescer.begin_generation(conn, channel, thread_ts, owner)
+                thread_messages = thread_state.load(conn, channel, thread_ts)
+                if thread_messages:
+                    _auto_reply_in_thread(channel, thread_ts, thread_messages, say)
+                    cursor.execute(
+                        "UPDATE engaged_threads SET last_reply_ts = ? WHERE thread_ts = ? AND channel = ?",
+                        (thread_messages[-1]["ts"], thread_ts, channel),
+                    )
+                    conn.commit()
+
+                metrics.incr("engage.generations")
+                if covered > 1:
+                    logger.info(f"[ENGAGE] Thread {thread_ts}: one reply for {covered} messages")
+                    metrics.incr("engage.llm_calls_saved", covered - 1)
+
+                if not thread_coalescer.complete(conn, channel, thread_ts, owner):
+                    return
+        except Exception:
+            thread_coalescer.release(conn, channel, thread_ts, owner)
+            raise
+    finally:
+        conn.close()
+
+
 def maybe_auto_engage_trash(message, say):
     """Orchestra auto-engagement e auto-clown su thread di #trash.
     Chiamato da handle_message per ogni messaggio (solo i reply in thread fanno qualcosa)."""
@@ -2069,11 +2148,9 @@ def maybe_auto_engage_trash(message, say):
                 logger.info(f"[TRASH] Thread {thread_ts} stoppato dall'utente, skip")
                 return
 
-            openai_api_key = os.environ.get("OPENAI_API_KEY")
-            if not openai_api_key:
+            if not llm_client.is_configured():
                 logger.warning("[TRASH] OPENAI_API_KEY non configurata, skip auto-engage")
                 return
-            client = OpenAI(api_key=openai_api_key)
 
             now_ts = datetime.now().timestamp()
 
@@ -2110,7 +2187,7 @@ def maybe_auto_engage_trash(message, say):
                     return
 
                 logger.info(f"[TRASH] Decisione engage per thread {thread_ts} ({user_reply_count} reply)")
-                engage, reply = _decide_engage(thread_messages, client)
+                engage, reply = _decide_engage(thread_messages)
                 _save_trash_engage_decision(
                     cursor,
                     thread_ts,
@@ -2142,7 +2219,7 @@ def maybe_auto_engage_trash(message, say):
                     f"should_reply={should_reply}"
                 )
                 if should_reply:
-                    _auto_reply_in_thread(channel, thread_ts, thread_messages, client, say)
+                    _auto_reply_in_thread(channel, thread_ts, thread_messages, say)
                 cursor.execute(
                     "UPDATE trash_engaged_threads SET last_reply_ts = ? "
                     "WHERE thread_ts = ? AND channel = ?",
@@ -2162,7 +2239,7 @@ def maybe_auto_engage_trash(message, say):
                         f"[TRASH] Valuto clown su thread {thread_ts} "
                         f"({user_reply_total} reply utenti, {len(thread_messages)} msg totali)"
                     )
-                    clown_name, reason = _decide_clown(thread_messages, client)
+                    clown_name, reason = _decide_clown(thread_messages)
                     if clown_name:
                         nickname_lower = clown_name.lower()
                         expiry = datetime.now() + timedelta(hours=24)
@@ -2201,6 +2278,7 @@ def maybe_auto_engage_trash(message, say):
 def handle_app_mention_event(event, say):
     """Handler per l'evento app_mention da Slack."""
     logger.info(f"[AI] Received app_mention event: {event}")
+    append_to_thread_state(event)
     if _maybe_handle_engage_command(event, say):
         return
     handle_app_mention(event, say)
@@ -2231,7 +2309,13 @@ def handle_message_changed(event):
             "UPDATE messages SET message = ? WHERE user = ? AND channel = ? AND timestamp = ?",
             (message["text"], message["user"], event["channel"], message["ts"]),
         )
+        # Nessuna riga per i messaggi anonimizzati (opt-out): niente entità
+        if cursor.rowcount:
+            archive_versions.bump_channel(conn, event["channel"])
+            message_entities.record(conn, event["channel"], message["ts"], message["text"])
+            rollups.mark_dirty(conn, [rollups.day_of(message["ts"])])
         conn.commit()
+        thread_state.update_text(conn, event["channel"], message["ts"], message["text"])
     finally:
         conn.close()
 
@@ -2310,6 +2394,9 @@ def handle_message_deleted_logic(deleted_ts, channel):
             cursor.execute("DELETE FROM duplicate_alerts WHERE parent_message_ts = ?", (deleted_ts,))
             conn.commit()
 
+        if channel:
+            thread_state.remove(conn, channel, deleted_ts)
+
     except Exception as e:
         logger.error(f"Error handling message deletion for ts={deleted_ts}: {e}")
         conn.rollback()
@@ -2342,19 +2429,22 @@ def init():
     migrate_db(conn, cursor)
     logger.info("Database migrated")
 
-    # Update the users and channels in the DB and in the local memory mapping
-    try:
-        update_users(conn, cursor)
-        update_channels(conn, cursor)
-    except Exception as e:
-        logger.error("Error updating users and channels: %s" % e)
-    
+    # Gli eventi persi durante il downtime vanno recuperati da Slack alla prima richiesta
+    gaps = archive_context.open_restart_gaps(conn)
+    logger.info(f"[CONTEXT] Opened {gaps} ingest gaps since last shutdown")
+
+    # Utenti e canali si servono dallo snapshot nel DB: il refresh è `warm_up`, in background
+    channels, members = channel_directory.snapshot_counts(conn)
+    logger.info(f"[STARTUP] Serving {channels} channels and {members} members from the DB snapshot")
+    conn.close()
+
     # Log stato iniziale della lista clown
     logger.info(f"[CLOWN] Bot initialized. Clown list is empty (will be populated via DM commands)")
         
         
 def main():
     init()
+    background.start()
 
     # Start the development server
     app.start(port=port)
@@ -2364,4 +2454,4 @@ if __name__ == "__main__":
     main()
 
 # Make sure this function is accessible when imported
-__all__ = ['update_users', 'app']
+__all__ = ['update_users', 'app', 'USER_DIRECTORY']
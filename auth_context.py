@@ -0,0 +1,111 @@
+"""Contesto di autenticazione delle richieste Flask, da una query sola e in cache.
+
+Per ogni richiesta servono id e nome dell'utente e i due flag di opt-out: prima
+erano quattro SELECT su due connessioni (più una terza in `optin_required`).
+`load()` li legge con una sola query su `users` e `AuthContextCache` li tiene per
+`ttl` secondi per utente. Chi modifica `optout` o `optout_ai` chiama
+`invalidate()`, che svuota la voce locale e incrementa la generazione
+`auth_context` in `cache_generations`: gli altri worker la controllano al
+massimo ogni `check_interval` secondi e in quel caso svuotano tutta la cache.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from utils import bump_generation, get_generation
+
+GENERATION_SCOPE = "auth_context"
+DEFAULT_TTL_SECONDS = 30.0
+DEFAULT_CHECK_INTERVAL = 2.0
+DEFAULT_MAX_ENTRIES = 2048
+
+
+def load(conn, user_id):
+    """Contesto dell'utente come dict, o None se non è in `users`."""
+    row = conn.execute(
+        """
+        SELECT
+            users.id,
+            users.name,
+            EXISTS(SELECT 1 FROM optout WHERE optout.user = users.id),
+            EXISTS(SELECT 1 FROM optout_ai WHERE optout_ai.user = users.id)
+        FROM users
+        WHERE users.id = ?
+        """,
+        (user_id,),
+    ).fetchone()
+    if not row:
+        return None
+    return {
+        "user_id": row[0],
+        "username": row[1],
+        "opted_out": bool(row[2]),
+        "opted_out_ai": bool(row[3]),
+    }
+
+
+class AuthContextCache:
+    def __init__(
+        self,
+        ttl=DEFAULT_TTL_SECONDS,
+        check_interval=DEFAULT_CHECK_INTERVAL,
+        max_entries=DEFAULT_MAX_ENTRIES,
+        clock=time.monotonic,
+    ):
+        self._ttl = ttl
+        self._check_interval = check_interval
+        self._max_entries = max_entries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = None
+        self._checked_at = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _sync(self, conn, now):
+        if self._checked_at is not None and now - self._checked_at < self._check_interval:
+            return
+        generation = get_generation(conn, GENERATION_SCOPE)
+        with self._lock:
+            self._checked_at = now
+            if generation != self._generation:
+                self._entries.clear()
+                self._generation = generation
+
+    def get(self, connect, user_id):
+        """Contesto dell'utente; `connect()` apre una connessione solo se serve."""
+        now = self._clock()
+        conn = None
+        try:
+            if self._checked_at is None or now - self._checked_at >= self._check_interval:
+                conn = connect()
+                self._sync(conn, now)
+            with self._lock:
+                entry = self._entries.get(user_id)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(user_id)
+                    return entry[1]
+            if conn is None:
+                conn = connect()
+            context = load(conn, user_id)
+        finally:
+            if conn is not None:
+                conn.close()
+        # Gli utenti sconosciuti non vengono messi in cache: il sync li può aggiungere
+        if context is not None:
+            with self._lock:
+                self._entries[user_id] = (now + self._ttl, context)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+        return context
+
+    def invalidate(self, conn, user_id):
+        """Da chiamare dopo aver modificato optout/optout_ai dell'utente (non fa commit)."""
+        bump_generation(conn, GENERATION_SCOPE)
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._checked_at = None
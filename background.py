@@ -0,0 +1,62 @@
+"""Job periodici in thread daemon, uno per processo.
+
+Vanno avviati dopo il fork dei worker Gunicorn (`post_worker_init` in
+`gunicorn_conf.py`) o da `main()` in sviluppo: i thread avviati nel master
+non sopravvivono al fork.
+"""
+
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_jobs = []
+_startup_jobs = []
+_started_pid = None
+
+
+def register(name, interval, fn):
+    """Registra `fn()` da eseguire ogni `interval` secondi."""
+    _jobs.append((name, interval, fn))
+
+
+def register_startup(name, fn):
+    """Registra `fn()` da eseguire una sola volta, in background, all'avvio del processo."""
+    _startup_jobs.append((name, fn))
+
+
+def _run_once(name, fn):
+    try:
+        fn()
+    except Exception as e:
+        logger.error(f"[BACKGROUND] Startup job {name} failed: {e}")
+
+
+def _run(name, interval, fn, stop_event):
+    while not stop_event.wait(interval):
+        try:
+            fn()
+        except Exception as e:
+            logger.error(f"[BACKGROUND] Job {name} failed: {e}")
+
+
+def start(stop_event=None):
+    """Avvia i job registrati nel processo corrente (idempotente per pid)."""
+    global _started_pid
+    with _lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+        stop_event = stop_event or threading.Event()
+        for name, interval, fn in _jobs:
+            thread = threading.Thread(
+                target=_run, args=(name, interval, fn, stop_event), name=f"bg-{name}", daemon=True
+            )
+            thread.start()
+            logger.info(f"[BACKGROUND] Started job {name} every {interval}s (pid {_started_pid})")
+        for name, fn in _startup_jobs:
+            threading.Thread(target=_run_once, args=(name, fn), name=f"bg-{name}", daemon=True).start()
+            logger.info(f"[BACKGROUND] Started startup job {name} (pid {_started_pid})")
+    return stop_event
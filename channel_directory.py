@@ -0,0 +1,157 @@
+"""Snapshot di canali e membri (tabelle `channels` e `members`).
+
+Le tabelle nel DB sono lo snapshot servito alle richieste: all'avvio non si
+aspetta Slack, il refresh gira in background dopo che il server accetta già
+eventi. `refresh()` legge i canali di cui il bot è membro e ne scarica info e
+membri su un pool di thread limitato (le chiamate passano comunque dai bucket
+di `slack_api`); è single-flight tra worker (lease in `sync_state`) e viene
+saltato se lo snapshot è più recente di `sync_ttl`. Su `members` (chiave
+primaria (channel, user)) si applicano solo gli ingressi e le uscite.
+"""
+
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import archive_versions
+import metrics
+from utils import acquire_sync_lease, db_connect, last_synced_at, release_sync_lease
+
+logger = logging.getLogger(__name__)
+
+SYNC_NAME = "channels"
+SYNC_TTL_SECONDS = 30 * 60
+SYNC_LEASE_SECONDS = 600
+REFRESH_WORKERS = int(os.environ.get("ARCHIVE_BOT_CHANNEL_REFRESH_WORKERS", 4))
+CHANNEL_TYPES = "public_channel,private_channel"
+PAGE_SIZE = 200
+MEMBERS_PAGE_SIZE = 1000
+
+
+def fetch_channel(client, channel_id):
+    """(id, nome, privato, [(canale, utente)]) con i membri paginati."""
+    channel = client.conversations_info(channel=channel_id)["channel"]
+
+    members, cursor = [], None
+    while True:
+        kwargs = {"channel": channel["id"], "limit": MEMBERS_PAGE_SIZE}
+        if cursor:
+            kwargs["cursor"] = cursor
+        response = client.conversations_members(**kwargs)
+        members += response["members"]
+        cursor = (response.get("response_metadata") or {}).get("next_cursor")
+        if not cursor:
+            break
+
+    return (
+        channel["id"],
+        channel["name"],
+        channel["is_private"],
+        [(channel["id"], m) for m in members],
+    )
+
+
+def list_member_channels(client):
+    """Canali (non archiviati) di cui il bot è membro, tutte le pagine."""
+    channels, cursor = [], None
+    while True:
+        kwargs = {"types": CHANNEL_TYPES, "exclude_archived": True, "limit": PAGE_SIZE}
+        if cursor:
+            kwargs["cursor"] = cursor
+        response = client.conversations_list(**kwargs)
+        channels += [c for c in response["channels"] if c.get("is_member")]
+        cursor = (response.get("response_metadata") or {}).get("next_cursor")
+        if not cursor:
+            break
+    return channels
+
+
+def write_channel(conn, channel_id, name, is_private, members):
+    """Aggiorna lo snapshot di un canale applicando solo ingressi e uscite (non fa commit).
+
+    Ritorna (entrati, usciti).
+    """
+    current_row = conn.execute("SELECT name, is_private FROM channels WHERE id = ?", (channel_id,)).fetchone()
+    if current_row is None or (current_row[0], bool(current_row[1])) != (name, bool(is_private)):
+        conn.execute(
+            "INSERT INTO channels(name, id, is_private) VALUES(?,?,?)",
+            (name, channel_id, is_private),
+        )
+        archive_versions.bump_channels(conn)
+    current = {row[0] for row in conn.execute("SELECT user FROM members WHERE channel = ?", (channel_id,))}
+    wanted = {user for _, user in members}
+    joined = wanted - current
+    left = current - wanted
+    conn.executemany(
+        "INSERT OR IGNORE INTO members(channel, user) VALUES(?,?)",
+        [(channel_id, user) for user in sorted(joined)],
+    )
+    conn.executemany(
+        "DELETE FROM members WHERE channel = ? AND user = ?",
+        [(channel_id, user) for user in sorted(left)],
+    )
+    return len(joined), len(left)
+
+
+def snapshot_counts(conn):
+    channels = conn.execute("SELECT COUNT(*) FROM channels").fetchone()[0]
+    members = conn.execute("SELECT COUNT(*) FROM members").fetchone()[0]
+    return channels, members
+
+
+def refresh(client, database_path, max_workers=REFRESH_WORKERS, sync_ttl=SYNC_TTL_SECONDS,
+            force=False, clock=time.time):
+    """Aggiorna lo snapshot. Ritorna le statistiche o None se saltato."""
+    conn, _ = db_connect(database_path)
+    owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+    try:
+        now = clock()
+        synced_at = last_synced_at(conn, SYNC_NAME)
+        if not force and synced_at is not None and now - synced_at < sync_ttl:
+            logger.info("[CHANNELS] Snapshot is fresh, skipping refresh")
+            return None
+        if not acquire_sync_lease(conn, SYNC_NAME, owner, now, SYNC_LEASE_SECONDS):
+            logger.info("[CHANNELS] Refresh already running in another worker, skipping")
+            return None
+
+        started = time.monotonic()
+        try:
+            channels = list_member_channels(client)
+            refreshed = failed = joined = left = 0
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="channels") as executor:
+                futures = [executor.submit(fetch_channel, client, c["id"]) for c in channels]
+                for channel, future in zip(channels, futures):
+                    try:
+                        channel_id, name, is_private, members = future.result()
+                    except Exception as e:
+                        # Resta lo snapshot precedente di questo canale
+                        failed += 1
+                        logger.warning(f"[CHANNELS] Refresh failed for {channel['id']}: {e}")
+                        continue
+                    channel_joined, channel_left = write_channel(conn, channel_id, name, is_private, members)
+                    conn.commit()
+                    refreshed += 1
+                    joined += channel_joined
+                    left += channel_left
+            release_sync_lease(conn, SYNC_NAME, owner, synced_at=clock() if not failed else None)
+        except Exception:
+            release_sync_lease(conn, SYNC_NAME, owner)
+            raise
+
+        elapsed = time.monotonic() - started
+        metrics.observe("startup.channels_refresh_seconds", elapsed)
+        metrics.incr("members.joined", joined)
+        metrics.incr("members.left", left)
+        stats = {
+            "channels": refreshed,
+            "failed": failed,
+            "joined": joined,
+            "left": left,
+            "seconds": round(elapsed, 3),
+        }
+        logger.info(f"[CHANNELS] Refresh done: {stats}")
+        return stats
+    finally:
+        conn.close()
@@ -0,0 +1,111 @@
+"""Indice in memoria della lista clown, per il controllo su ogni messaggio.
+
+La fonte di verità resta la tabella `clown_users`; ogni worker ne tiene una
+copia (dict nickname -> scadenza più un heap delle scadenze) e la ricarica
+solo quando cambia la generazione `clown_users` in `cache_generations`,
+controllata al massimo ogni `check_interval` secondi. Le righe scadute
+vengono cancellate dal DB da uno sweep periodico (`sweep_expired`).
+"""
+
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime
+
+from utils import bump_generation, get_generation
+
+logger = logging.getLogger(__name__)
+
+GENERATION_SCOPE = "clown_users"
+
+
+def parse_expiry(expiry_date):
+    """Parsing robusto della scadenza clown.
+
+    Non ci fidiamo del confronto lessicografico su TEXT: se in futuro il formato
+    cambia leggermente, un clown può restare attivo per sempre. Qui convertiamo
+    sempre a datetime e, se il valore è illeggibile, lo consideriamo scaduto.
+    """
+    if not expiry_date:
+        return None
+    try:
+        return datetime.fromisoformat(str(expiry_date))
+    except Exception:
+        try:
+            return datetime.strptime(str(expiry_date), "%Y-%m-%d %H:%M:%S")
+        except Exception:
+            logger.warning(f"[CLOWN] expiry_date non parsabile, considero scaduto: {expiry_date}")
+            return None
+
+
+def sweep_expired(conn, now=None):
+    """Cancella dal DB i clown scaduti. Ritorna i nickname rimossi."""
+    now = now or datetime.now()
+    rows = conn.execute("SELECT nickname, expiry_date FROM clown_users").fetchall()
+    expired = []
+    for nickname, expiry_date in rows:
+        expiry = parse_expiry(expiry_date)
+        if expiry is None or expiry <= now:
+            expired.append(nickname)
+    if expired:
+        conn.executemany("DELETE FROM clown_users WHERE nickname = ?", [(nickname,) for nickname in expired])
+        bump_generation(conn, GENERATION_SCOPE)
+        conn.commit()
+    return expired
+
+
+class ClownIndex:
+    def __init__(self, check_interval=2.0, clock=time.monotonic):
+        self._check_interval = check_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._heap = []
+        self._generation = None
+        self._checked_at = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def sync(self, conn):
+        """Ricarica l'indice se un altro worker (o questo) ha modificato la lista."""
+        now = self._clock()
+        if self._checked_at is not None and now - self._checked_at < self._check_interval:
+            return
+        generation = get_generation(conn, GENERATION_SCOPE)
+        with self._lock:
+            self._checked_at = now
+            if generation == self._generation:
+                return
+            entries = {}
+            for nickname, expiry_date in conn.execute("SELECT nickname, expiry_date FROM clown_users").fetchall():
+                expiry = parse_expiry(expiry_date)
+                if expiry is not None:
+                    entries[nickname] = expiry
+            self._entries = entries
+            self._heap = [(expiry, nickname) for nickname, expiry in entries.items()]
+            heapq.heapify(self._heap)
+            self._generation = generation
+        logger.info(f"[CLOWN] Clown index reloaded: {len(entries)} active (generation {generation})")
+
+    def invalidate(self):
+        """Forza il controllo della generazione alla prossima `sync`."""
+        self._checked_at = None
+
+    def _purge_expired(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            expiry, nickname = heapq.heappop(self._heap)
+            if self._entries.get(nickname) == expiry:
+                del self._entries[nickname]
+
+    def lookup(self, nicknames, now=None):
+        """Primo nickname (in ordine di priorità) nella lista e non scaduto: (nickname, scadenza) o None."""
+        now = now or datetime.now()
+        with self._lock:
+            self._purge_expired(now)
+            for nickname in nicknames:
+                expiry = self._entries.get(nickname)
+                if expiry is not None:
+                    return nickname, expiry
+        return None
@@ -0,0 +1,52 @@
+"""Modello SentenceTransformer condiviso dal processo, caricato al primo uso.
+
+`sentence_transformers` (e quindi torch) pesa secondi di import e centinaia di
+MB: i worker che gestiscono solo eventi o endpoint JSON non devono pagarlo.
+Con `ARCHIVE_BOT_WARM_EMBEDDINGS=true` il modello viene caricato in background
+subito dopo l'avvio del worker (`warm_up`), così la prima ricerca non aspetta.
+"""
+
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "paraphrase-MiniLM-L6-v2"
+WARM_UP = os.environ.get("ARCHIVE_BOT_WARM_EMBEDDINGS", "false").lower() == "true"
+
+_lock = threading.Lock()
+_model = None
+
+
+def get_model():
+    """Modello condiviso (lazy, thread-safe)."""
+    global _model
+    if _model is not None:
+        return _model
+    with _lock:
+        if _model is None:
+            started = time.monotonic()
+            logger.info("Loading SentenceTransformer model (one-time initialization)...")
+            from sentence_transformers import SentenceTransformer
+
+            _model = SentenceTransformer(MODEL_NAME)
+            elapsed = time.monotonic() - started
+            metrics.observe("startup.embeddings_model_seconds", elapsed)
+            logger.info(f"SentenceTransformer model loaded in {elapsed:.2f}s")
+    return _model
+
+
+def encode(text):
+    return get_model().encode(text)
+
+
+def is_loaded():
+    return _model is not None
+
+
+def warm_up():
+    get_model()
@@ -5,28 +5,39 @@ import requests
 from dotenv import load_dotenv
 import jwt
 from slack_bolt.adapter.flask import SlackRequestHandler
-from archivebot import app, update_users
+from archivebot import PERMALINK_BASE_URL, USER_DIRECTORY, app
 handler = SlackRequestHandler(app)
 import datetime
 import logging
 import uuid
+import time
 
 logger = logging.getLogger(__name__)
-from sentence_transformers import SentenceTransformer
-import numpy as np
-import openai
 from datetime import timedelta
 import re
 from functools import wraps
 from flask import g, redirect, url_for
 import csv
 from io import StringIO
-import openai
-from pydub import AudioSegment
 import io
-from openai import OpenAI
 from pathlib import Path
 from flask import send_file
+from flask import Response, stream_with_context
+
+from ai_stream import sse_event, stream_completion_events, wants_event_stream
+import archive_context
+import auth_context
+import archive_index
+import archive_versions
+import embeddings
+import json_stream
+import llm_cache
+import llm_client
+import message_entities
+import metrics
+import permalinks
+import rollups
+import route_limits
 
 # Sposta l'array degli amministratori in una variabile globale
 ADMIN_USERS = [
@@ -42,23 +53,52 @@ ADMIN_USERS = [
 
 DEFAULT_OPENAI_MODEL = "gpt-4o"
 
+DIGEST_DETAILS_SYSTEM_PROMPT = "Sei un assistente che fornisce dettagli sulle conversazioni di un workspace Slack in base a specifiche richieste."
+DIGEST_DETAILS_USER_PROMPT = """Dati i seguenti post originali, fornisci dettagli specifici in risposta alla query dell'utente. 
+            Usa i post originali per fornire informazioni precise e dettagliate.
+
+            Post originali:
+            {posts}
+
+            Query dell'utente: {query}
+
+            Fornisci una risposta dettagliata, in italiano e in formato markdown."""
+DIGEST_DETAILS_MAX_TOKENS = 4096
+DIGEST_DETAILS_TEMPERATURE = 0.7
+
+# Contesto utente di auth_required, condiviso dal worker (vedi auth_context.py)
+AUTH_CONTEXT = auth_context.AuthContextCache(
+    ttl=float(os.getenv('AUTH_CONTEXT_TTL_SECONDS', auth_context.DEFAULT_TTL_SECONDS))
+)
+
+# Redirect di /getlink già risolti (vedi permalinks.LinkCache)
+LINK_CACHE = permalinks.LinkCache(max_entries=int(os.getenv('GETLINK_CACHE_MAX_ENTRIES', 1024)))
+
+# Cache delle risposte di /digest_details (tabella llm_cache)
+LLM_CACHE_TTL_SECONDS = int(os.getenv('LLM_CACHE_TTL_SECONDS', llm_cache.DEFAULT_TTL_SECONDS))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', llm_cache.DEFAULT_MAX_ENTRIES))
+
+# Richieste LLM in corso per worker (vedi route_limits.py)
+ROUTE_LIMITER = route_limits.RouteLimiter(route_limits.LIMITS)
+
 def auth_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
         headers = get_slack_headers()
         g.headers = headers
-        user_info = verify_token_and_get_user(headers)
-        if not headers or not user_info:
+        token = decode_token(headers) if headers else False
+        if not token:
             return redirect(url_for('login'))
-        
-        g.user_id = user_info['user_id']
-        g.username = get_username(g.user_id)
-        
-        conn = get_db_connection()
-        g.opted_out = conn.execute('SELECT * FROM optout WHERE user = ?', (g.user_id,)).fetchone() is not None
-        g.opted_out_ai = conn.execute('SELECT * FROM optout_ai WHERE user = ?', (g.user_id,)).fetchone() is not None
-        conn.close()
-        
+        context = AUTH_CONTEXT.get(get_db_connection, token['user_id'])
+        if not context:
+            return redirect(url_for('login'))
+
+        g.user_id = context['user_id']
+        g.username = context['username']
+        g.opted_out = context['opted_out']
+        g.opted_out_ai = context['opted_out_ai']
+        g.slack_token = token['slack_token']
+
         return f(*args, **kwargs)
     return decorated_function
 
@@ -67,11 +107,80 @@ def optin_required(f):
     def decorated_function(*args, **kwargs):
         if g.user_id in ADMIN_USERS:
             return f(*args, **kwargs)
-        if check_optout(g.user_id):
+        if g.opted_out:
             return redirect(url_for('login'))
         return f(*args, **kwargs)
     return decorated_function
 
+def conditional_get(validator):
+    """GET condizionale con ETag/Last-Modified presi da `validator(conn, **kwargs)`.
+
+    Il validator ritorna (generazione, updated_at) da archive_versions: se il
+    client ha già quella versione risponde 304 senza eseguire l'endpoint.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            conn = get_db_connection()
+            try:
+                generation, updated_at = validator(conn, **kwargs)
+            finally:
+                conn.close()
+            etag = f"{request.endpoint}-{generation}"
+            last_modified = None
+            if updated_at:
+                last_modified = datetime.datetime.strptime(updated_at, '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+
+            if is_not_modified(etag, last_modified):
+                metrics.incr('http.not_modified.' + request.endpoint)
+                response = Response(status=304)
+            else:
+                response = flask_app.make_response(f(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            # updated_at ha la risoluzione del secondo: un Last-Modified del
+            # secondo corrente potrebbe perdere una scrittura successiva
+            now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+            if last_modified and last_modified < now:
+                response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
+
+def concurrency_limit(group):
+    """Al più `route_limits.LIMITS[group]` richieste in corso, altrimenti 503 subito.
+
+    Il posto viene liberato quando la risposta è stata inviata del tutto,
+    quindi anche uno stream SSE lo tiene occupato finché non finisce.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not ROUTE_LIMITER.try_acquire(group):
+                response = get_response({'error': 'Too many concurrent requests, retry later'})
+                response.status_code = 503
+                response.headers['Retry-After'] = str(route_limits.RETRY_AFTER_SECONDS)
+                return response
+            try:
+                response = flask_app.make_response(f(*args, **kwargs))
+            except Exception:
+                ROUTE_LIMITER.release(group)
+                raise
+            response.call_on_close(lambda: ROUTE_LIMITER.release(group))
+            return response
+        return decorated_function
+    return decorator
+
+def is_not_modified(etag, last_modified):
+    # If-None-Match ha la precedenza su If-Modified-Since (RFC 9110)
+    if 'If-None-Match' in request.headers:
+        return request.if_none_match.contains_weak(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
 
 load_dotenv()
 
@@ -97,7 +206,8 @@ def slack_events():
 def apply_cors_headers(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Methods', 'GET, POST, OPTIONS, PUT, DELETE')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type, Authorization, If-None-Match, If-Modified-Since')
+    response.headers.add('Access-Control-Expose-Headers', 'X-Next-Before-Ts, X-Next-After-Ts, ETag, Last-Modified')
     return response
 
 
@@ -106,6 +216,30 @@ def get_response(data):
     return response
 
 
+def stream_json_response(rows, conn):
+    """Array JSON in streaming dal cursore `rows`, compresso se il client lo accetta.
+
+    Chiude `conn` a fine stream e registra righe e byte (JSON e inviati) in /metrics.
+    """
+    encoding = json_stream.choose_encoding(request.headers.get('Accept-Encoding'))
+    name = request.endpoint
+    stats = {}
+
+    def generate():
+        try:
+            yield from json_stream.iter_json_array(rows, encoding, stats)
+        finally:
+            conn.close()
+            metrics.observe(f'http.{name}.rows', stats.get('rows', 0))
+            metrics.observe(f'http.{name}.raw_bytes', stats.get('raw_bytes', 0))
+            metrics.observe(f'http.{name}.sent_bytes', stats.get('sent_bytes', 0))
+
+    headers = {'Vary': 'Accept-Encoding'}
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(generate(), mimetype='application/json', headers=headers)
+
+
 def log_and_return_error(e: Exception, status_code: int = 500):
     """Log exception with error ID and return generic error response."""
     error_id = uuid.uuid4().hex[:8]
@@ -114,6 +248,11 @@ def log_and_return_error(e: Exception, status_code: int = 500):
     return get_response({'error': f'Internal error [{error_id}] at {timestamp}'}), status_code
 
 
+def ts_days_ago(days):
+    """Timestamp Slack di `days` giorni fa, confrontabile come stringa con quelli archiviati."""
+    return archive_context.format_ts(time.time() - days * 86400)
+
+
 def get_db_connection():
     cur_dir = os.path.dirname(__file__)
     db_path = os.getenv('DB_PATH', '/data/slack.sqlite')
@@ -170,7 +309,7 @@ def get_slack_headers():
 @flask_app.route('/emoji', methods=['GET'])
 @auth_required
 def get_emoji():
-    slack_token = verify_token_and_get_user(g.headers)['slack_token']
+    slack_token = g.slack_token
         
     response = requests.get('https://slack.com/api/emoji.list', headers={'Authorization': 'Bearer ' + slack_token})
     data = response.json()
@@ -181,34 +320,21 @@ def get_emoji():
     return get_response(data)
 
 
-def verify_token_and_get_user(headers):
+def decode_token(headers):
+    """JWT della richiesta decodificato ({'user_id', 'slack_token'}) o False se non valido."""
     token = headers['Authorization']
     # remove Bearer
-    token = token.split('Bearer ')[1]
+    token = token.split('Bearer ')[-1]
 
     try:
         decoded = jwt.decode(token, flask_app.secret_key, algorithms=['HS256'], options={'verify_exp': True})
-        user_id = decoded['user_id']
-        # check if user_id exists in the database
-        conn = get_db_connection()
-        user = conn.execute('SELECT * FROM users WHERE id = ?', (user_id,)).fetchone()
-        conn.close()
-        if not user:
-            return False
-        else:
-            return {'user_id': decoded['user_id'], 'slack_token': decoded['slack_token']}
+        return {'user_id': decoded['user_id'], 'slack_token': decoded['slack_token']}
     except jwt.ExpiredSignatureError:
         return False
     except jwt.InvalidTokenError:
         return False
-    return False
-
-
-def get_username(user):
-    conn = get_db_connection()
-    user = conn.execute('SELECT name FROM users WHERE id = ?', (user,)).fetchone()
-    conn.close()
-    return user['name']
+    except KeyError:
+        return False
 
 
 @flask_app.route('/channels', methods=['OPTIONS'])
@@ -224,14 +350,7 @@ def whoami():
     opted_out_ai = g.opted_out_ai
     is_admin = user in ADMIN_USERS
 
-    conn = get_db_connection()
-    status = conn.execute('SELECT * FROM optout WHERE user = ?', (user,)).fetchone()
-
-    conn.close()
-
-    if status:
-        return get_response({'user_id': user, 'username': username, 'opted_out': True, 'opted_out_ai': opted_out_ai, 'is_admin': is_admin})
-    return get_response({'user_id': user, 'username': username, 'opted_out': False, 'opted_out_ai': opted_out_ai, 'is_admin': is_admin})
+    return get_response({'user_id': user, 'username': username, 'opted_out': g.opted_out, 'opted_out_ai': opted_out_ai, 'is_admin': is_admin})
 
 
 def notify_admins(text):
@@ -252,7 +371,12 @@ def optout():
     try:
         cursor = conn.cursor()
         cursor.execute('INSERT INTO optout (user, timestamp) VALUES (?, CURRENT_TIMESTAMP)', (user,))
+        touched_threads = archive_index.user_threads(conn, user)
+        rollups.mark_user_dirty(conn, user)
+        message_entities.forget_user(conn, user)
         cursor.execute('UPDATE messages SET message = "User opted out of archiving. This message has been deleted", user = "USLACKBOT", permalink = "" WHERE user = ?', (user,))
+        archive_index.refresh_threads(conn, touched_threads)
+        AUTH_CONTEXT.invalidate(conn, user)
         conn.commit()
 
         notify_admins(
@@ -275,14 +399,14 @@ def optout():
 @flask_app.route('/channels', methods=['GET'])
 @auth_required
 @optin_required
+@conditional_get(lambda conn: archive_versions.version(conn, [archive_versions.CHANNELS_SCOPE], all_channels=True))
 def get_channels():
     conn = get_db_connection()
     channels = conn.execute('''
-        SELECT c.*, MAX(m.timestamp) as last_message_timestamp
+        SELECT c.*, s.last_message_ts as last_message_timestamp
         FROM channels c
-        LEFT JOIN messages m ON c.id = m.channel
+        LEFT JOIN channel_stats s ON s.channel = c.id
         WHERE c.is_private = 0
-        GROUP BY c.id
         ORDER BY last_message_timestamp DESC, c.name
     ''').fetchall()
     conn.close()
@@ -292,64 +416,60 @@ def get_channels():
 @flask_app.route('/users', methods=['GET'])
 @auth_required
 @optin_required
-def get_users():    
-    conn = get_db_connection()
-    users = conn.execute('SELECT * FROM users').fetchall()
-    conn.close()
-    return get_response([dict(ix) for ix in users])
-
-
-def check_optout(user):
+@conditional_get(lambda conn: archive_versions.version(conn, [archive_versions.USERS_SCOPE]))
+def get_users():
     conn = get_db_connection()
-    status = conn.execute('SELECT * FROM optout WHERE user = ?', (user,)).fetchone()
-    conn.close()
-    if status:
-        return True
-    return False
+    return stream_json_response(conn.execute('SELECT * FROM users'), conn)
 
 
 @flask_app.route('/messages/<channel_id>', methods=['GET'])
 @auth_required
 @optin_required
+@conditional_get(lambda conn, channel_id: archive_versions.version(
+    conn, [archive_versions.USERS_SCOPE, archive_versions.channel_scope(channel_id)]
+))
 def get_messages(channel_id):
     conn = get_db_connection()
-    offset = request.args.get('offset', 0)
-    limit = request.args.get('limit', 20)
-    
-    messages = conn.execute('''
-        SELECT 
-            m.message,
-            m.user,
-            m.channel,
-            m.timestamp,
-            m.permalink,
-            m.thread_ts, 
-            u.name as user_name,
-            (SELECT COUNT(*) 
-             FROM messages thread 
-             WHERE thread.thread_ts = m.timestamp 
-               AND thread.channel = m.channel
-               AND thread.user NOT IN (SELECT user FROM optout)) as thread_count
-        FROM messages m
-        JOIN users u ON m.user = u.id
-        WHERE m.channel = ?
-          AND (m.thread_ts IS NULL OR m.thread_ts = m.timestamp)
-          AND m.user NOT IN (SELECT user FROM optout)
-        ORDER BY m.timestamp DESC
-        LIMIT ? OFFSET ?
-    ''', (channel_id, limit, offset)).fetchall()
-    
+    limit = request.args.get('limit', 20, type=int)
+    before_ts = request.args.get('before_ts')
+    after_ts = request.args.get('after_ts')
+    offset = request.args.get('offset', 0, type=int)
+
+    if offset and not (before_ts or after_ts):
+        # Compatibilità con i client che paginano ancora per offset: saltiamo
+        # le righe precedenti leggendo solo i timestamp dall'indice
+        row = conn.execute('''
+            SELECT timestamp FROM messages INDEXED BY idx_messages_channel_roots
+            WHERE channel = ? AND (thread_ts IS NULL OR thread_ts = timestamp)
+              AND user NOT IN (SELECT user FROM optout)
+            ORDER BY timestamp DESC LIMIT 1 OFFSET ?
+        ''', (channel_id, offset - 1)).fetchone()
+        if row is None:
+            conn.close()
+            return get_response([])
+        before_ts = row['timestamp']
+
+    messages = archive_index.channel_page(conn, channel_id, limit, before_ts=before_ts, after_ts=after_ts)
     conn.close()
-    
-    # Convert row objects to dictionaries
-    messages = [dict(msg) for msg in messages]
-        
-    return get_response([dict(ix) for ix in messages])
+
+    response = get_response([dict(msg) for msg in messages])
+    # Cursori per la pagina successiva (più vecchia) e precedente (più recente)
+    if messages:
+        response.headers['X-Next-Before-Ts'] = messages[-1]['timestamp']
+        response.headers['X-Next-After-Ts'] = messages[0]['timestamp']
+    return response
+
+
+def thread_version(conn, message_id):
+    scopes = archive_versions.thread_scopes(conn, message_id)
+    # message_id può essere una risposta: senza riga in threads guardiamo tutti i canali
+    return archive_versions.version(conn, [archive_versions.USERS_SCOPE] + scopes, all_channels=not scopes)
 
 
 @flask_app.route('/thread/<message_id>', methods=['GET'])
 @auth_required
 @optin_required
+@conditional_get(lambda conn, message_id: thread_version(conn, message_id))
 def get_thread(message_id):
     conn = get_db_connection()
     thread = conn.execute('''
@@ -366,9 +486,25 @@ def get_thread(message_id):
         WHERE ( messages.timestamp = ? OR messages.thread_ts = ? )
         AND user NOT IN (SELECT user FROM optout)                  
         ''', 
-        (message_id, message_id)).fetchall()
-    conn.close()
-    return get_response([dict(ix) for ix in thread])
+        (message_id, message_id))
+    return stream_json_response(thread, conn)
+
+
+def search_entity_filters(args):
+    """(kind, value) dei filtri `emoji`, `mention`, `channel_ref`, `domain` e `has_file` di /searchV2."""
+    filters = []
+    if args.get('emoji'):
+        filters.append((message_entities.EMOJI, args['emoji'].strip(':')))
+    if args.get('mention'):
+        filters.append((message_entities.USER, args['mention']))
+    if args.get('channel_ref'):
+        filters.append((message_entities.CHANNEL, args['channel_ref']))
+    if args.get('domain'):
+        domain = args['domain'].lower()
+        filters.append((message_entities.DOMAIN, domain[4:] if domain.startswith('www.') else domain))
+    if args.get('has_file') in ('1', 'true'):
+        filters.append((message_entities.FILE, 'media'))
+    return filters
 
 
 @flask_app.route('/searchV2', methods=['GET'])
@@ -386,7 +522,7 @@ def search_messages_V2():
     
     # Build the SQL query
     sql = '''
-    SELECT DISTINCT
+    SELECT
     messages.message,
     messages.user,
     messages.channel,
@@ -398,7 +534,6 @@ def search_messages_V2():
     FROM messages
     JOIN users ON messages.user = users.id
     JOIN channels ON messages.channel = channels.id
-    LEFT JOIN members ON messages.channel = members.channel
     WHERE 1=1
     '''
     params = []
@@ -423,6 +558,11 @@ def search_messages_V2():
     if channel_name:
         sql += ' AND channels.name LIKE ?'
         params.append('%' + channel_name + '%')
+
+    # Filtri sulle entità (message_entities): lookup sull'indice (kind, value)
+    for kind, value in search_entity_filters(request.args):
+        sql += ' AND (messages.channel, messages.timestamp) IN (SELECT channel, timestamp FROM message_entities WHERE kind = ? AND value = ?)'
+        params += [kind, value]
     
     if start_time:
         start_timestamp = datetime.datetime.fromisoformat(start_time.replace('Z', '+00:00')).timestamp()
@@ -436,10 +576,7 @@ def search_messages_V2():
 
     sql += ' ORDER BY messages.timestamp DESC LIMIT 2000'
 
-    messages = conn.execute(sql, params).fetchall()
-    conn.close()
-
-    return get_response([dict(ix) for ix in messages])
+    return stream_json_response(conn.execute(sql, params), conn)
 
 
 @flask_app.route('/searchEmbeddings', methods=['GET'])
@@ -457,7 +594,7 @@ def search_messages_embeddings():
     
     # Build the SQL query
     sql = '''
-    SELECT DISTINCT 
+    SELECT
     messages.message,
     messages.user,
     messages.channel,
@@ -469,7 +606,6 @@ def search_messages_embeddings():
     FROM messages
     JOIN users ON messages.user = users.id
     JOIN channels ON messages.channel = channels.id
-    LEFT JOIN members ON messages.channel = members.channel
     WHERE messages.embeddings IS NOT NULL
     '''
     params = []
@@ -496,11 +632,11 @@ def search_messages_embeddings():
 
     messages = conn.execute(sql, params).fetchall()
 
-    # Inizializza il modello SentenceTransformer
-    model = SentenceTransformer('paraphrase-MiniLM-L6-v2')
+    # numpy e il modello (condiviso dal processo) si caricano solo qui
+    import numpy as np
 
     # Genera l'embedding per la frase di query
-    query_embedding = model.encode(query)
+    query_embedding = embeddings.encode(query)
 
     # copy messages into an array of dictionaries
     messages = [dict(ix) for ix in messages]
@@ -533,13 +669,15 @@ def search_messages_embeddings():
     return get_response(distances)
 
 def generate_podcast_audio(podcast_content):
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    from pydub import AudioSegment
+
     max_length = 4000  # Lasciamo un po' di margine
     segments = [podcast_content[i:i+max_length] for i in range(0, len(podcast_content), max_length)]
     
     audio_segments = []
     for segment in segments:
-        response = client.audio.speech.create(
+        response = llm_client.speech(
+            "podcast_audio",
             model="tts-1",
             voice="alloy",
             input=segment
@@ -563,8 +701,8 @@ def generate_podcast_audio(podcast_content):
 
 # Aggiungi questa funzione per generare il contenuto del podcast
 def generate_podcast_content(formatted_messages):
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-    response = client.chat.completions.create(
+    response = llm_client.chat_completion(
+        "podcast_content",
         model=DEFAULT_OPENAI_MODEL,
         messages=[
             {"role": "system", "content": "Sei un membro della Community Sfera IT che crea contenuti per podcast basati sulle conversazioni della community. Il tuo compito è creare un riassunto scorrevole e coinvolgente, adatto all'ascolto, come se stessi parlando con altri membri della community."},
@@ -597,6 +735,7 @@ def generate_podcast_content(formatted_messages):
 @flask_app.route('/generate_digest', methods=['POST'])
 @auth_required
 @optin_required
+@concurrency_limit('digest')
 def generate_digest():
     conn = get_db_connection()
 
@@ -621,34 +760,32 @@ def generate_digest():
         })
     
     # If no existing digest, continue with the original logic to generate a new one
-    messages = conn.execute(f'''
+    # Thread con attività nell'ultimo giorno, dalla tabella threads (indici su first_ts e last_reply_ts)
+    since_ts = ts_days_ago(1)
+    messages = conn.execute('''
+    WITH active_threads AS (
+        SELECT channel, thread_ts FROM threads WHERE first_ts >= ?
+        UNION
+        SELECT channel, thread_ts FROM threads WHERE last_reply_ts >= ?
+    )
     SELECT 
-        message,
+        messages.message,
         users.name as username,
         channels.name as channel_name,
-        timestamp,
-        CASE 
-            WHEN thread_ts IS NULL THEN timestamp 
-            ELSE thread_ts 
-        END AS thread_ts
-    FROM messages
+        messages.timestamp,
+        messages.thread_ts
+    FROM active_threads
+    INNER JOIN messages on messages.channel = active_threads.channel AND messages.thread_ts = active_threads.thread_ts
     INNER JOIN users on users.id = messages.user
     INNER JOIN channels on channels.id = messages.channel
     WHERE 
-        thread_ts in (
-            SELECT DISTINCT thread_ts
-            FROM messages
-            WHERE datetime(timestamp, 'unixepoch') >= datetime('now', '-1 days')
-            AND thread_ts IS NOT NULL
-        )
-        AND
-        user != 'USLACKBOT'
+        messages.user != 'USLACKBOT'
         AND 
-        user NOT IN (SELECT user FROM optout_ai)
+        messages.user NOT IN (SELECT user FROM optout_ai)
         AND
         channels.id != 'C07F6RUTVQW'
-    ORDER BY channel_name ASC, thread_ts ASC, timestamp ASC;
-    ''').fetchall()
+    ORDER BY channel_name ASC, messages.thread_ts ASC, messages.timestamp ASC;
+    ''', (since_ts, since_ts)).fetchall()
 
     # Format the messages for the OpenAI prompt, including all the columns
     formatted_messages = ""
@@ -677,8 +814,8 @@ def generate_digest():
     
     
     # Generate summary using OpenAI
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-    response = client.chat.completions.create(
+    response = llm_client.chat_completion(
+        "digest",
         model=DEFAULT_OPENAI_MODEL,
         messages=[
             {"role": "system", "content": "Sei un assistente che riassume le conversazioni di un workspace di Slack. Fornirai riassunti molto dettagliati, usando almeno 3000 parole, e sempre in italiano."},
@@ -749,6 +886,7 @@ def generate_digest():
 @flask_app.route('/digest_details', methods=['POST'])
 @auth_required
 @optin_required
+@concurrency_limit('llm')
 def digest_details():
     user = g.user_id
 
@@ -775,29 +913,91 @@ def digest_details():
     posts = latest_digest['posts']
     digest_timestamp = latest_digest['timestamp']
 
-    # Generate details using OpenAI
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-    response = client.chat.completions.create(
-        model=DEFAULT_OPENAI_MODEL,
-        messages=[
-            {"role": "system", "content": "Sei un assistente che fornisce dettagli sulle conversazioni di un workspace Slack in base a specifiche richieste."},
-            {"role": "user", "content": f"""Dati i seguenti post originali, fornisci dettagli specifici in risposta alla query dell'utente. 
-            Usa i post originali per fornire informazioni precise e dettagliate.
+    # I post del digest sono immutabili: domande equivalenti riusano la risposta in cache
+    cache_key = llm_cache.make_cache_key(
+        DEFAULT_OPENAI_MODEL,
+        llm_cache.prompt_hash(
+            DIGEST_DETAILS_SYSTEM_PROMPT, DIGEST_DETAILS_USER_PROMPT,
+            DIGEST_DETAILS_MAX_TOKENS, DIGEST_DETAILS_TEMPERATURE,
+        ),
+        digest_timestamp,
+        query,
+    )
+    use_cache = not wants_cache_bypass(data, request.headers.get('Cache-Control'))
+    cached_details = None
+    if use_cache:
+        cached_details = llm_cache.get_cached_response(conn, cache_key, LLM_CACHE_TTL_SECONDS)
+    conn.close()
+    metrics.incr('llm_cache.digest_details.' + ('hit' if cached_details is not None else 'miss'))
 
-            Post originali:
-            {posts}
+    streaming = wants_event_stream(data, request.headers.get('Accept'))
 
-            Query dell'utente: {query}
+    if cached_details is not None:
+        save_digest_details(user, query, cached_details, digest_timestamp)
+        payload = {'status': 'success', 'details': cached_details, 'cached': True}
+        if streaming:
+            return event_stream_response(iter([
+                sse_event({'delta': cached_details}, event='token'),
+                sse_event(payload, event='done'),
+            ]))
+        return get_response(payload)
+
+    def on_details(details):
+        save_digest_details(user, query, details, digest_timestamp)
+        cache_digest_details(cache_key, digest_timestamp, query, details)
 
-            Fornisci una risposta dettagliata, in italiano e in formato markdown."""}
+    # Generate details using OpenAI
+    completion_args = dict(
+        model=DEFAULT_OPENAI_MODEL,
+        messages=[
+            {"role": "system", "content": DIGEST_DETAILS_SYSTEM_PROMPT},
+            {"role": "user", "content": DIGEST_DETAILS_USER_PROMPT.format(posts=posts, query=query)}
         ],
-        max_tokens=4096,
-        temperature=0.7,
+        max_tokens=DIGEST_DETAILS_MAX_TOKENS,
+        temperature=DIGEST_DETAILS_TEMPERATURE,
     )
-    
+
+    if streaming:
+        stream = llm_client.chat_completion('digest_details', stream=True, **completion_args)
+        return event_stream_response(stream_completion_events(
+            stream,
+            on_complete=on_details,
+            done_payload=lambda details: {'status': 'success', 'details': details, 'cached': False},
+        ))
+
+    response = llm_client.chat_completion('digest_details', **completion_args)
     details = response.choices[0].message.content
+    on_details(details)
+
+    return get_response({'status': 'success', 'details': details, 'cached': False})
+
+
+def wants_cache_bypass(data, cache_control):
+    """True se la richiesta chiede di ignorare la cache LLM."""
+    if isinstance(data, dict) and data.get('no_cache') is True:
+        return True
+    return 'no-cache' in (cache_control or '').lower()
 
-    # Salva i dettagli generati nel database
+
+def cache_digest_details(cache_key, digest_timestamp, query, details):
+    if not details:
+        return
+    conn = get_db_connection()
+    try:
+        llm_cache.store_response(
+            conn, cache_key, DEFAULT_OPENAI_MODEL, digest_timestamp, query, details,
+            ttl_seconds=LLM_CACHE_TTL_SECONDS, max_entries=LLM_CACHE_MAX_ENTRIES,
+        )
+    except Exception as e:
+        logger.warning(f"Error caching digest details: {e}")
+    finally:
+        conn.close()
+
+
+def save_digest_details(user, query, details, digest_timestamp):
+    """Salva i dettagli generati nel database."""
+    conn = get_db_connection()
+    cursor = None
     try:
         cursor = conn.cursor()
         cursor.execute('''
@@ -807,13 +1007,20 @@ def digest_details():
         conn.commit()
     except Exception as e:
         conn.rollback()
-        pass
+        logger.warning(f"Error saving digest details: {e}")
     finally:
-        cursor.close()
+        if cursor:
+            cursor.close()
+        conn.close()
 
-    conn.close()
 
-    return get_response({'status': 'success', 'details': details})
+def event_stream_response(events):
+    """Risposta Server-Sent Events senza buffering intermedio."""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
 
 
 @flask_app.route('/optout_ai', methods=['GET'])
@@ -833,7 +1040,7 @@ def optout_ai():
         else:
             cursor.execute('INSERT INTO optout_ai (user, timestamp) VALUES (?, CURRENT_TIMESTAMP)', (user,))
             ret = True
-        
+        AUTH_CONTEXT.invalidate(conn, user)
         conn.commit()
 
     except Exception as e:
@@ -855,11 +1062,18 @@ def get_link():
     if not timestamp:
         return jsonify({'error': 'No timestamp provided'}), 400
 
+    timestamp = timestamp.strip()
+    link = LINK_CACHE.get(timestamp)
+    if link:
+        metrics.incr('getlink.cache_hits')
+        return redirect(link)
+
     conn = get_db_connection()
     try:
-        message = conn.execute('SELECT permalink FROM messages WHERE thread_ts LIKE ? and permalink != "" order by timestamp', ('%'+timestamp+'%',)).fetchone()
-        if message and message['permalink']:
-            return redirect(message['permalink'])
+        link = permalinks.resolve_link(conn, timestamp, PERMALINK_BASE_URL)
+        if link:
+            LINK_CACHE.put(timestamp, link)
+            return redirect(link)
         else:
             return jsonify({'error': 'Message not found'}), 404
     except Exception as e:
@@ -899,6 +1113,7 @@ def convert_markdown_to_slack(text):
 @flask_app.route('/chat', methods=['POST'])
 @auth_required
 @optin_required
+@concurrency_limit('llm')
 def chat():
     user = g.user_id
     data = request.get_json()
@@ -914,8 +1129,7 @@ def chat():
     prompt = f"Context:\n{context_text}\n\nConversation:\n{conversation_text}\n\nUser: {message}\nAI:"
 
     # Call OpenAI
-    client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
-    response = client.chat.completions.create(
+    completion_args = dict(
         model=DEFAULT_OPENAI_MODEL,
         messages=[
             {"role": "system", "content": "Sei un assistente che risponde alle domande relative alle conversazioni di un workspace di Slack. Ti verranno passate delle conversazioni e una serie di domande a cui dovrai rispondere con precisione."},
@@ -925,14 +1139,20 @@ def chat():
         temperature=0.7,
     )
 
-    ai_response = response.choices[0].message.content.strip()
-    conversation.append({
-        'user_name': 'AI',
-        'message': ai_response,
-        'timestamp': datetime.datetime.utcnow().timestamp()
-    })
+    def append_ai_response(ai_response):
+        conversation.append({
+            'user_name': 'AI',
+            'message': ai_response.strip(),
+            'timestamp': datetime.datetime.utcnow().timestamp()
+        })
+        return {'status': 'success', 'conversation': conversation}
 
-    return jsonify({'status': 'success', 'conversation': conversation})
+    if wants_event_stream(data, request.headers.get('Accept')):
+        stream = llm_client.chat_completion('chat', stream=True, **completion_args)
+        return event_stream_response(stream_completion_events(stream, done_payload=append_ai_response))
+
+    response = llm_client.chat_completion('chat', **completion_args)
+    return jsonify(append_ai_response(response.choices[0].message.content))
 
 
 
@@ -944,76 +1164,75 @@ def get_stats():
     days = request.args.get('days', 30, type=int)
 
     conn = get_db_connection()
+    since_ts = ts_days_ago(days)
 
-    # update the users table
-    update_users(conn, conn.cursor())
+    # aggiorna la tabella users in background se è vecchia
+    USER_DIRECTORY.refresh_async()
 
     stats = {}
 
+    # Le statistiche sui messaggi si leggono dalle rollup giornaliere (rollups.py):
+    # al più days+1 righe per chiave, qualunque sia la dimensione dell'archivio
+    since_day = rollups.since_day(days)
+
     # 1. User activity ranking (excluding deleted users)
     user_activity = conn.execute('''
-        SELECT users.name, COUNT(*) as post_count
-        FROM messages
-        JOIN users ON messages.user = users.id
-        WHERE datetime(messages.timestamp, 'unixepoch') > datetime('now', ?)
+        SELECT users.name, SUM(r.messages) as post_count
+        FROM rollup_user_day r
+        JOIN users ON r.user = users.id
+        WHERE r.day >= ?
         AND users.is_deleted = FALSE
         GROUP BY users.id
         ORDER BY post_count DESC
-    ''', (f'-{days} days',)).fetchall()
+    ''', (since_day,)).fetchall()
     stats['user_activity'] = [dict(row) for row in user_activity]
 
     # 2. Top 5 active channels
     top_channels = conn.execute('''
-        SELECT channels.name, COUNT(*) as message_count
-        FROM messages
-        JOIN channels ON messages.channel = channels.id
-        WHERE datetime(messages.timestamp, 'unixepoch') > datetime('now', ?)
+        SELECT channels.name, SUM(r.messages) as message_count
+        FROM rollup_channel_day r
+        JOIN channels ON r.channel = channels.id
+        WHERE r.day >= ?
         GROUP BY channels.id
         ORDER BY message_count DESC
         LIMIT 5
-    ''', (f'-{days} days',)).fetchall()
+    ''', (since_day,)).fetchall()
     stats['top_channels'] = [dict(row) for row in top_channels]
 
     # 4. Most active hours
     active_hours = conn.execute('''
-        SELECT 
-            CAST(strftime('%H', datetime(timestamp, 'unixepoch')) AS INTEGER) as hour,
-            COUNT(*) as message_count
-        FROM messages
-        WHERE datetime(timestamp, 'unixepoch') > datetime('now', ?)
+        SELECT hour, SUM(messages) as message_count
+        FROM rollup_hour_day
+        WHERE day >= ?
         GROUP BY hour
         ORDER BY message_count DESC
-    ''', (f'-{days} days',)).fetchall()
+    ''', (since_day,)).fetchall()
     stats['active_hours'] = [dict(row) for row in active_hours]
 
     # 5. Emoji usage
     emoji_usage = conn.execute('''
-        SELECT 
-            substr(message, instr(message, ':') + 1, 
-                   instr(substr(message, instr(message, ':') + 1), ':') - 1) as emoji,
-            COUNT(*) as usage_count
-        FROM messages
-        WHERE message LIKE '%:%:%'
-        AND datetime(timestamp, 'unixepoch') > datetime('now', ?)
+        SELECT emoji, SUM(uses) as usage_count
+        FROM rollup_emoji_day
+        WHERE day >= ?
         GROUP BY emoji
         ORDER BY usage_count DESC
         LIMIT 10
-    ''', (f'-{days} days',)).fetchall()
+    ''', (since_day,)).fetchall()
     stats['emoji_usage'] = [dict(row) for row in emoji_usage]
 
     # immagini postate per autore - si identificano perchè nel testo c'è scritto "Il messaggio conteneva un media ma non è stato possibile salvarlo"
     images_by_author = conn.execute('''
         SELECT 
             users.name,
-            COUNT(*) as image_count
-        FROM messages
-        JOIN users ON messages.user = users.id
-        WHERE messages.message LIKE '%Il messaggio conteneva un media ma non è stato possibile salvarlo%'
-        AND datetime(messages.timestamp, 'unixepoch') > datetime('now', ?)
+            SUM(r.images) as image_count
+        FROM rollup_user_day r
+        JOIN users ON r.user = users.id
+        WHERE r.day >= ?
+        AND r.images > 0
         GROUP BY users.id
         ORDER BY image_count DESC
         LIMIT 10
-    ''', (f'-{days} days',)).fetchall()
+    ''', (since_day,)).fetchall()
     stats['images_by_author'] = [dict(row) for row in images_by_author]
 
 
@@ -1023,65 +1242,53 @@ def get_stats():
             users.name AS author,
             channels.name AS channel,
             messages.message AS thread_start,
-            datetime(messages.timestamp, 'unixepoch') AS thread_date,
-            COUNT(*) AS reply_count,
-            messages.timestamp as thread_ts
-        FROM messages
-        JOIN users ON messages.user = users.id
-        JOIN channels ON messages.channel = channels.id
-        WHERE messages.thread_ts IS NOT NULL
-        AND datetime(messages.thread_ts, 'unixepoch') > datetime('now', ?)
-        GROUP BY messages.thread_ts
-        ORDER BY reply_count DESC
+            datetime(threads.thread_ts, 'unixepoch') AS thread_date,
+            threads.reply_count,
+            threads.thread_ts
+        FROM threads
+        JOIN messages ON messages.channel = threads.channel AND messages.timestamp = threads.thread_ts
+        JOIN users ON threads.root_user = users.id
+        JOIN channels ON threads.channel = channels.id
+        WHERE threads.first_ts > ?
+        AND threads.reply_count > 0
+        ORDER BY threads.reply_count DESC
         LIMIT 10
-    ''', (f'-{days} days',)).fetchall()
+    ''', (since_ts,)).fetchall()
     stats['engaging_threads'] = [dict(row) for row in engaging_threads]
 
     # 10 autori con i thread più ingaggianti e lunghezza media dei loro thread
     engaging_authors = conn.execute('''
-        WITH thread_stats AS (
-            SELECT 
-                users.name AS author,
-                channels.name AS channel,
-                messages.message AS thread_start,
-                datetime(messages.timestamp, 'unixepoch') AS thread_date,
-                COUNT(*) AS reply_count,
-                messages.thread_ts
-            FROM messages
-            JOIN users ON messages.user = users.id
-            JOIN channels ON messages.channel = channels.id
-            WHERE messages.thread_ts IS NOT NULL
-                AND datetime(messages.thread_ts, 'unixepoch') > datetime('now', ?)
-                AND users.is_deleted = FALSE
-            GROUP BY messages.thread_ts
-            ORDER BY reply_count DESC
-        )
         SELECT 
             COUNT(*) AS number_of_threads, 
-            author,
-            AVG(reply_count) AS avg_replies
-        FROM thread_stats 
-        WHERE author <> 'Slackbot'
-        GROUP BY author
+            users.name AS author,
+            AVG(threads.reply_count) AS avg_replies
+        FROM threads
+        JOIN users ON threads.root_user = users.id
+        JOIN channels ON threads.channel = channels.id
+        WHERE threads.first_ts > ?
+            AND threads.reply_count > 0
+            AND users.is_deleted = FALSE
+            AND users.name <> 'Slackbot'
+        GROUP BY users.name
         ORDER BY avg_replies DESC;
-    ''', (f'-{days} days',)).fetchall()
+    ''', (since_ts,)).fetchall()
     stats['engaging_authors'] = [dict(row) for row in engaging_authors]
 
     # classifica degli utenti più attivi ma basata sul numero totale di parole scritte
     active_users_by_words = conn.execute('''
         SELECT 
             users.name AS author,
-            SUM(LENGTH(messages.message) - LENGTH(REPLACE(messages.message, ' ', '')) + 1) AS total_words,
-            COUNT(*) AS total_messages,
-            AVG(LENGTH(messages.message) - LENGTH(REPLACE(messages.message, ' ', '')) + 1) AS avg_words_per_message
-        FROM messages
-        JOIN users ON messages.user = users.id
-        WHERE datetime(messages.timestamp, 'unixepoch') > datetime('now', ?)
+            SUM(r.words) AS total_words,
+            SUM(r.messages) AS total_messages,
+            CAST(SUM(r.words) AS REAL) / SUM(r.messages) AS avg_words_per_message
+        FROM rollup_user_day r
+        JOIN users ON r.user = users.id
+        WHERE r.day >= ?
         AND users.is_deleted = FALSE
         GROUP BY users.id
         ORDER BY total_words DESC
         LIMIT 10
-    ''', (f'-{days} days',)).fetchall()
+    ''', (since_day,)).fetchall()
     stats['active_users_by_words'] = [dict(row) for row in active_users_by_words]
 
     # Add this new query for inactive users
@@ -1089,13 +1296,12 @@ def get_stats():
         SELECT 
             users.real_name AS real_name,
             users.display_name AS display_name,
-            CAST((julianday('now') - julianday(datetime(MAX(messages.timestamp), 'unixepoch'))) AS INTEGER) AS days_inactive
+            CAST((julianday('now') - julianday(datetime(r.last_ts, 'unixepoch'))) AS INTEGER) AS days_inactive
         FROM users
-        LEFT JOIN messages ON users.id = messages.user
+        JOIN rollup_users r ON r.user = users.id
         WHERE users.name != 'Slackbot'
         AND users.is_deleted = FALSE
-        GROUP BY users.id
-        HAVING days_inactive > 120
+        AND days_inactive > 120
         ORDER BY days_inactive DESC
     ''').fetchall()
     stats['inactive_users'] = [dict(row) for row in inactive_users]
@@ -1110,18 +1316,19 @@ def get_stats():
     stats['deleted_users'] = [dict(row) for row in deleted_users]
 
     # Posts and replies by channel
+    # Le risposte sono attribuite al periodo in cui è iniziato il thread
     posts_replies_by_channel = conn.execute('''
         SELECT 
             channels.name as channel_name,
-            COUNT(CASE WHEN messages.thread_ts = messages.timestamp THEN 1 END) as post_count,
-            COUNT(CASE WHEN messages.thread_ts != messages.timestamp THEN 1 END) as reply_count,
-            COUNT(*) as total_messages
-        FROM messages
-        JOIN channels ON messages.channel = channels.id
-        WHERE datetime(messages.timestamp, 'unixepoch') > datetime('now', ?)
+            COUNT(threads.root_user) as post_count,
+            SUM(threads.reply_count) as reply_count,
+            COUNT(threads.root_user) + SUM(threads.reply_count) as total_messages
+        FROM threads
+        JOIN channels ON threads.channel = channels.id
+        WHERE threads.first_ts > ?
         GROUP BY channels.id, channels.name
         ORDER BY total_messages DESC
-    ''', (f'-{days} days',)).fetchall()
+    ''', (since_ts,)).fetchall()
     stats['posts_replies_by_channel'] = [dict(row) for row in posts_replies_by_channel]
 
     conn.close()
@@ -1139,7 +1346,7 @@ def download_users():
 
     conn = get_db_connection()
 
-    update_users(conn, conn.cursor())
+    USER_DIRECTORY.refresh_async()
 
     users = conn.execute('''
         SELECT 
@@ -1171,6 +1378,14 @@ def download_users():
     })
 
 
+@flask_app.route('/metrics', methods=['GET'])
+@auth_required
+def get_metrics():
+    if g.user_id not in ADMIN_USERS:
+        return get_response({'error': 'Unauthorized'}), 403
+    return get_response({'pid': os.getpid(), **metrics.snapshot()})
+
+
 @flask_app.route('/get_podcast_content', methods=['GET'])
 @auth_required
 @optin_required
@@ -1,11 +1,30 @@
+import logging
 import os
 
-from archivebot import init
+import background
+import route_limits
+from archivebot import init, mark_worker_started
 
 bind = f"0.0.0.0:{os.getenv('ARCHIVE_BOT_PORT', 3333)}"
 workers = os.getenv("WORKERS", 4)
+# Worker a thread: una chiamata LLM lunga occupa un thread, non tutto il worker,
+# e i tetti di route_limits lasciano sempre thread liberi per /slack/events
+worker_class = os.getenv("WORKER_CLASS", "gthread")
+# Con threads > 1 Gunicorn userebbe comunque gthread al posto di sync
+threads = route_limits.THREADS if worker_class == "gthread" else 1
 timeout = 300
 
 
 def on_starting(server):
+    if worker_class == "gthread" and route_limits.reserved_threads() < 1:
+        logging.getLogger(__name__).warning(
+            f"LLM concurrency limits {route_limits.LIMITS} use all {threads} threads per worker: "
+            "/slack/events can be starved"
+        )
     init()
+
+
+def post_worker_init(worker):
+    # I thread dei job periodici vanno avviati in ogni worker, dopo il fork
+    mark_worker_started()
+    background.start()
@@ -0,0 +1,104 @@
+"""Array JSON scritti riga per riga dal cursore, compressi al volo.
+
+Per `/searchV2` (fino a 2000 righe), `/users` e `/thread` la risposta veniva
+costruita tutta in memoria: lista di dict, poi un'unica stringa `jsonify`, poi
+inviata senza compressione. `iter_json_array()` serializza le righe man mano che
+arrivano dal cursore, le accumula in blocchi da `CHUNK_BYTES` e li passa al
+compressore scelto da `choose_encoding()` (brotli se installato, altrimenti
+gzip): in memoria resta al più un blocco. Le statistiche (righe, byte JSON,
+byte inviati) vengono scritte in `stats` a fine stream.
+"""
+
+import json
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:  # dipendenza opzionale: senza, solo gzip
+    brotli = None
+
+CHUNK_BYTES = 16 * 1024
+GZIP_LEVEL = int(os.environ.get("ARCHIVE_BOT_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.environ.get("ARCHIVE_BOT_BROTLI_QUALITY", 4))
+
+
+def supported_encodings():
+    """Codifiche supportate, in ordine di preferenza a parità di qualità."""
+    return (["br"] if brotli is not None else []) + ["gzip"]
+
+
+def choose_encoding(accept_encoding):
+    """Codifica da usare per l'header `Accept-Encoding` dato, o None (identity)."""
+    qualities = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[name] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in supported_encodings():
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _compressor(encoding):
+    if encoding == "gzip":
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress, compressor.flush
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    return None
+
+
+def iter_json_array(rows, encoding=None, stats=None, chunk_bytes=CHUNK_BYTES):
+    """Serializza `rows` (mapping, es. sqlite3.Row) come array JSON, in blocchi di byte.
+
+    L'output decompresso è lo stesso di `jsonify([dict(row) for row in rows])`.
+    """
+    compressor = _compressor(encoding)
+    stats = stats if stats is not None else {}
+    stats.update(rows=0, raw_bytes=0, sent_bytes=0)
+    buffer, buffered = [b"["], 1
+
+    def emit(data):
+        stats["raw_bytes"] += len(data)
+        if compressor is not None:
+            data = compressor[0](data)
+        stats["sent_bytes"] += len(data)
+        return data
+
+    for row in rows:
+        item = json.dumps(dict(row), sort_keys=True, separators=(",", ":")).encode()
+        if stats["rows"]:
+            buffer.append(b",")
+            buffered += 1
+        buffer.append(item)
+        buffered += len(item)
+        stats["rows"] += 1
+        if buffered >= chunk_bytes:
+            data = emit(b"".join(buffer))
+            buffer, buffered = [], 0
+            if data:
+                yield data
+
+    buffer.append(b"]")
+    data = emit(b"".join(buffer))
+    if compressor is not None:
+        tail = compressor[1]()
+        stats["sent_bytes"] += len(tail)
+        data += tail
+    if data:
+        yield data
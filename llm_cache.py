@@ -0,0 +1,85 @@
+"""Cache SQLite delle risposte LLM su contenuti immutabili (es. i digest salvati).
+
+La tabella `llm_cache` è condivisa tra i worker Gunicorn. La chiave combina
+modello, hash del prompt (template + parametri di generazione), timestamp del
+digest e query normalizzata, quindi domande equivalenti sullo stesso digest
+producono un hit.
+"""
+
+import hashlib
+import json
+import re
+import time
+
+DEFAULT_TTL_SECONDS = 3 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 1000
+
+
+def normalize_query(query):
+    """Minuscolo, spazi compattati, punteggiatura finale ignorata."""
+    normalized = re.sub(r"\s+", " ", (query or "").strip().lower())
+    return normalized.rstrip(" ?!.")
+
+
+def prompt_hash(*parts):
+    """Hash stabile del template di prompt e dei parametri di generazione."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def make_cache_key(model, prompt_digest, digest_timestamp, query):
+    raw = json.dumps(
+        [model, prompt_digest, digest_timestamp, normalize_query(query)],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def get_cached_response(conn, cache_key, ttl_seconds=DEFAULT_TTL_SECONDS, now=None):
+    """Ritorna la risposta in cache se presente e non scaduta, altrimenti None."""
+    now = now if now is not None else time.time()
+    row = conn.execute(
+        "SELECT response, created_at FROM llm_cache WHERE cache_key = ?",
+        (cache_key,),
+    ).fetchone()
+    if row is None:
+        return None
+
+    response, created_at = row[0], row[1]
+    if created_at is None or created_at < now - ttl_seconds:
+        conn.execute("DELETE FROM llm_cache WHERE cache_key = ?", (cache_key,))
+        conn.commit()
+        return None
+
+    conn.execute(
+        "UPDATE llm_cache SET hits = hits + 1, last_hit_at = ? WHERE cache_key = ?",
+        (now, cache_key),
+    )
+    conn.commit()
+    return response
+
+
+def store_response(conn, cache_key, model, digest_timestamp, query, response,
+                   ttl_seconds=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES, now=None):
+    """Salva una risposta e applica TTL e limite di dimensione (LRU)."""
+    now = now if now is not None else time.time()
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO llm_cache
+        (cache_key, model, digest_timestamp, query, response, created_at, last_hit_at, hits)
+        VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+        """,
+        (cache_key, model, digest_timestamp, normalize_query(query), response, now, now),
+    )
+    conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - ttl_seconds,))
+    conn.execute(
+        """
+        DELETE FROM llm_cache WHERE cache_key IN (
+            SELECT cache_key FROM llm_cache
+            ORDER BY last_hit_at DESC
+            LIMIT -1 OFFSET ?
+        )
+        """,
+        (max_entries,),
+    )
+    conn.commit()
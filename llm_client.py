@@ -0,0 +1,164 @@
+"""Client OpenAI condiviso dal processo.
+
+Un solo client per processo (ricreato dopo un fork) con pool di connessioni
+keep-alive, una scadenza complessiva per funzionalità, retry limitati con
+backoff esponenziale "full jitter" e istogrammi di latenza per call site
+(`metrics`).
+
+Per i test offline basta puntare `OPENAI_BASE_URL` a `utilities/openai_stub.py`.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Scadenza complessiva (secondi) di una chiamata, retry compresi, per funzionalità.
+# Il timeout httpx di ogni tentativo vale per singola operazione di rete
+# (connect/read/write) ed è limitato al tempo che resta fino alla scadenza;
+# un retry parte solo se restano almeno MIN_ATTEMPT_SECONDS.
+FEATURE_TIMEOUTS = {
+    "mention": 90.0,
+    "engaged_reply": 60.0,
+    "auto_engage": 30.0,
+    "chat": 120.0,
+    "digest": 300.0,
+    "digest_details": 120.0,
+    "podcast_content": 300.0,
+    "podcast_audio": 120.0,
+}
+DEFAULT_TIMEOUT = 60.0
+CONNECT_TIMEOUT = 5.0
+MIN_ATTEMPT_SECONDS = 5.0
+
+MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", 2))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+
+POOL_MAX_CONNECTIONS = int(os.environ.get("OPENAI_POOL_MAX_CONNECTIONS", 20))
+POOL_MAX_KEEPALIVE = int(os.environ.get("OPENAI_POOL_MAX_KEEPALIVE", 10))
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+
+
+def is_configured():
+    return bool(os.environ.get("OPENAI_API_KEY"))
+
+
+def get_client():
+    """Client OpenAI condiviso (lazy, uno per processo)."""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _lock:
+        if _client is None or _client_pid != pid:
+            import httpx
+            from openai import OpenAI
+
+            http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=60.0,
+                ),
+                timeout=httpx.Timeout(DEFAULT_TIMEOUT, connect=CONNECT_TIMEOUT),
+            )
+            # I retry li gestiamo qui sotto, per avere backoff e metriche uniformi
+            _client = OpenAI(
+                api_key=os.environ.get("OPENAI_API_KEY"),
+                http_client=http_client,
+                max_retries=0,
+            )
+            _client_pid = pid
+            logger.info(f"[LLM] OpenAI client initialized (pid {pid})")
+    return _client
+
+
+def timeout_for(feature, remaining=None):
+    """Timeout httpx di un tentativo: quello della funzionalità, al più `remaining` secondi."""
+    import httpx
+
+    timeout = FEATURE_TIMEOUTS.get(feature, DEFAULT_TIMEOUT)
+    if remaining is not None:
+        timeout = max(0.001, min(timeout, remaining))
+    return httpx.Timeout(timeout, connect=min(CONNECT_TIMEOUT, timeout))
+
+
+def backoff_delay(attempt, retry_after=None, rng=random.random):
+    """Attesa prima del retry `attempt` (0-based): full jitter, rispettando Retry-After."""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)) * rng()
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, BACKOFF_MAX_SECONDS))
+    return delay
+
+
+def _retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _call(feature, operation, fn, max_retries=None):
+    from openai import APIConnectionError, InternalServerError, RateLimitError
+
+    # APITimeoutError è una sottoclasse di APIConnectionError: anche i timeout
+    # si ritentano, ma solo entro la scadenza complessiva della funzionalità
+    retryable = (APIConnectionError, InternalServerError, RateLimitError)
+    max_retries = MAX_RETRIES if max_retries is None else max_retries
+    client = get_client()
+    name = f"openai.{feature}.{operation}"
+    deadline = time.monotonic() + FEATURE_TIMEOUTS.get(feature, DEFAULT_TIMEOUT)
+
+    attempt = 0
+    while True:
+        started = time.monotonic()
+        try:
+            result = fn(client.with_options(timeout=timeout_for(feature, deadline - started)))
+        except retryable as e:
+            metrics.observe(f"{name}.latency_seconds", time.monotonic() - started)
+            metrics.incr(f"{name}.errors")
+            if attempt >= max_retries:
+                logger.error(f"[LLM] {name} failed after {attempt + 1} attempts: {e}")
+                raise
+            delay = backoff_delay(attempt, _retry_after_seconds(e))
+            if deadline - time.monotonic() - delay < MIN_ATTEMPT_SECONDS:
+                metrics.incr(f"{name}.deadline_exceeded")
+                logger.error(f"[LLM] {name} failed after {attempt + 1} attempts, no time left before the deadline: {e}")
+                raise
+            logger.warning(f"[LLM] {name} attempt {attempt + 1} failed ({type(e).__name__}), retry in {delay:.2f}s")
+            metrics.incr(f"{name}.retries")
+            attempt += 1
+            time.sleep(delay)
+            continue
+        except Exception:
+            metrics.observe(f"{name}.latency_seconds", time.monotonic() - started)
+            metrics.incr(f"{name}.errors")
+            raise
+
+        # Per gli stream è il tempo fino agli header della risposta
+        metrics.observe(f"{name}.latency_seconds", time.monotonic() - started)
+        metrics.incr(f"{name}.calls")
+        return result
+
+
+def chat_completion(feature, max_retries=None, **kwargs):
+    """`chat.completions.create` tramite il client condiviso."""
+    return _call(feature, "chat", lambda client: client.chat.completions.create(**kwargs), max_retries)
+
+
+def speech(feature, max_retries=None, **kwargs):
+    """`audio.speech.create` tramite il client condiviso."""
+    return _call(feature, "speech", lambda client: client.audio.speech.create(**kwargs), max_retries)
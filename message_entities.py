@@ -0,0 +1,115 @@
+"""Entità estratte dal testo dei messaggi (tabella `message_entities`).
+
+Ogni messaggio viene tokenizzato una volta, in scrittura, in righe
+(channel, timestamp, kind, value, count):
+
+- `emoji`: nome di ogni `:emoji:` (le varianti `skin-tone-N` sono ignorate)
+- `user`: id degli utenti menzionati (`<@U123>`)
+- `channel`: id dei canali citati (`<#C123|nome>`)
+- `domain`: dominio di ogni link, senza `www.`
+- `file`: `media` se il messaggio aveva un file (marcatore di `handle_message_with_file`)
+
+Le statistiche e i filtri diventano GROUP BY e lookup sugli indici
+(kind, value) e (kind, timestamp) invece di LIKE su `messages`.
+`record()` va chiamata dopo ogni scrittura del testo di un messaggio ed è
+idempotente; `forget_user()` prima di anonimizzare i messaggi di un utente.
+L'archivio esistente viene indicizzato una volta da `migrate_db` (`backfill()`).
+"""
+
+import re
+import urllib.parse
+from collections import Counter
+
+EMOJI = "emoji"
+USER = "user"
+CHANNEL = "channel"
+DOMAIN = "domain"
+FILE = "file"
+
+FILE_MARKER = "Il messaggio conteneva un media ma non è stato possibile salvarlo"
+
+_EMOJI_RE = re.compile(r"(?<!\w):([a-z0-9_+'\-]+):")
+_USER_RE = re.compile(r"<@([UW][A-Z0-9]+)(?:\|[^>]*)?>")
+_CHANNEL_RE = re.compile(r"<#(C[A-Z0-9]+)(?:\|[^>]*)?>")
+# Stesso pattern di check_and_store_links in archivebot
+_URL_RE = re.compile(r'https?://[^\s<>":{}|\\^`\[\]]+', re.IGNORECASE)
+
+
+def _domain(url):
+    try:
+        host = urllib.parse.urlsplit(url).hostname or ""
+    except ValueError:
+        return ""
+    return host[4:] if host.startswith("www.") else host
+
+
+def tokenize(text):
+    """Counter {(kind, value): occorrenze} delle entità del testo."""
+    entities = Counter()
+    if not text:
+        return entities
+    for name in _EMOJI_RE.findall(text):
+        if not name.startswith("skin-tone-"):
+            entities[(EMOJI, name)] += 1
+    for user in _USER_RE.findall(text):
+        entities[(USER, user)] += 1
+    for channel in _CHANNEL_RE.findall(text):
+        entities[(CHANNEL, channel)] += 1
+    for url in _URL_RE.findall(text):
+        domain = _domain(url)
+        if domain:
+            entities[(DOMAIN, domain)] += 1
+    if FILE_MARKER in text:
+        entities[(FILE, "media")] = 1
+    return entities
+
+
+def rows(channel, ts, text):
+    return [(channel, ts, kind, value, count) for (kind, value), count in tokenize(text).items()]
+
+
+def record(conn, channel, ts, text):
+    """Sostituisce le entità del messaggio (non fa commit)."""
+    conn.execute("DELETE FROM message_entities WHERE channel = ? AND timestamp = ?", (channel, ts))
+    conn.executemany(
+        "INSERT INTO message_entities (channel, timestamp, kind, value, count) VALUES (?, ?, ?, ?, ?)",
+        rows(channel, ts, text),
+    )
+
+
+def backfill(conn, batch_size=5000):
+    """Indicizza tutti i messaggi archiviati, a blocchi per rowid (non fa commit).
+
+    Ritorna il numero di entità scritte.
+    """
+    entities = 0
+    last_rowid = 0
+    while True:
+        batch = conn.execute(
+            "SELECT rowid, channel, timestamp, message FROM messages WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last_rowid, batch_size),
+        ).fetchall()
+        if not batch:
+            return entities
+        last_rowid = batch[-1][0]
+        conn.executemany(
+            "DELETE FROM message_entities WHERE channel = ? AND timestamp = ?",
+            [(channel, ts) for _, channel, ts, _ in batch],
+        )
+        entity_rows = [row for _, channel, ts, text in batch for row in rows(channel, ts, text)]
+        conn.executemany(
+            "INSERT INTO message_entities (channel, timestamp, kind, value, count) VALUES (?, ?, ?, ?, ?)",
+            entity_rows,
+        )
+        entities += len(entity_rows)
+
+
+def forget_user(conn, user):
+    """Cancella le entità dei messaggi di `user` (non fa commit)."""
+    conn.execute(
+        """
+        DELETE FROM message_entities
+        WHERE (channel, timestamp) IN (SELECT channel, timestamp FROM messages WHERE user = ?)
+        """,
+        (user,),
+    )
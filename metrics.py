@@ -0,0 +1,69 @@
+"""Metriche di processo: contatori e istogrammi di latenza.
+
+Ogni worker Gunicorn ha le sue metriche; `snapshot()` le espone in un formato
+JSON-friendly (endpoint `/metrics` di flask_app).
+"""
+
+import threading
+
+# Limiti superiori (in secondi) dei bucket degli istogrammi
+HISTOGRAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+def incr(name, value=1):
+    """Incrementa un contatore."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, value):
+    """Registra un valore (tipicamente una durata in secondi) in un istogramma."""
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = {
+                "count": 0,
+                "sum": 0.0,
+                "min": None,
+                "max": None,
+                "buckets": [0] * (len(HISTOGRAM_BUCKETS) + 1),
+            }
+            _histograms[name] = hist
+        hist["count"] += 1
+        hist["sum"] += value
+        hist["min"] = value if hist["min"] is None else min(hist["min"], value)
+        hist["max"] = value if hist["max"] is None else max(hist["max"], value)
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if value <= bound:
+                hist["buckets"][i] += 1
+                break
+        else:
+            hist["buckets"][-1] += 1
+
+
+def snapshot():
+    """Copia delle metriche correnti."""
+    with _lock:
+        histograms = {}
+        for name, hist in _histograms.items():
+            labels = [f"le_{bound:g}" for bound in HISTOGRAM_BUCKETS] + ["le_inf"]
+            histograms[name] = {
+                "count": hist["count"],
+                "sum": round(hist["sum"], 6),
+                "avg": round(hist["sum"] / hist["count"], 6) if hist["count"] else None,
+                "min": hist["min"],
+                "max": hist["max"],
+                "buckets": dict(zip(labels, hist["buckets"])),
+            }
+        return {"counters": dict(_counters), "histograms": histograms}
+
+
+def reset():
+    """Azzera tutte le metriche (usato nei test e nei benchmark)."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
@@ -0,0 +1,153 @@
+"""Permalink Slack calcolati localmente.
+
+Il formato è stabile e dipende solo da dominio del workspace, canale e ts:
+    https://<workspace>.slack.com/archives/<channel>/p<ts senza punto>
+e per le risposte in thread si aggiunge `?thread_ts=<thread_ts>&cid=<channel>`,
+esattamente come li restituisce `chat.getPermalink`. Il dominio si ricava una
+volta dall'`url` di `auth.test`.
+
+`resolve_link()` risolve i link `/getlink?timestamp=` dei digest con ricerche
+esatte sugli indici di `threads` e `messages`; `LinkCache` tiene i redirect già
+risolti nel worker.
+"""
+
+import logging
+import random
+import threading
+from collections import OrderedDict
+
+import archive_versions
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def workspace_url(auth_response):
+    """Base URL del workspace (con `/` finale) dalla risposta di `auth.test`."""
+    url = auth_response.get("url") or ""
+    return url if url.endswith("/") else url + "/"
+
+
+def build_permalink(base_url, channel, ts, thread_ts=None):
+    """Permalink di un messaggio; `thread_ts` diverso da `ts` indica una risposta in thread."""
+    if not base_url or not channel or not ts:
+        return ""
+    link = f"{base_url}archives/{channel}/p{ts.replace('.', '')}"
+    if thread_ts and thread_ts != ts:
+        link += f"?thread_ts={thread_ts}&cid={channel}"
+    return link
+
+
+def verify_sample(conn, client, base_url, sample_size=5, recent=1000, rng=random):
+    """Confronta un campione di permalink archiviati con `chat.getPermalink`.
+
+    In caso di differenza salva il valore dell'API. Ritorna (verificati, corretti).
+    """
+    rows = conn.execute(
+        """
+        SELECT channel, timestamp, thread_ts, permalink FROM messages
+        WHERE permalink IS NOT NULL AND permalink != ''
+        ORDER BY rowid DESC LIMIT ?
+        """,
+        (recent,),
+    ).fetchall()
+    if not rows:
+        return 0, 0
+
+    checked = fixed = 0
+    for channel, ts, thread_ts, permalink in rng.sample(rows, min(sample_size, len(rows))):
+        try:
+            expected = client.chat_getPermalink(channel=channel, message_ts=ts)["permalink"]
+        except Exception as e:
+            logger.warning(f"[PERMALINK] Verification failed for {channel}/{ts}: {e}")
+            continue
+        checked += 1
+        metrics.incr("permalinks.verified")
+        if expected != permalink:
+            fixed += 1
+            metrics.incr("permalinks.mismatches")
+            logger.warning(f"[PERMALINK] Mismatch for {channel}/{ts}: stored {permalink}, api {expected}")
+            conn.execute(
+                "UPDATE messages SET permalink = ? WHERE channel = ? AND timestamp = ?",
+                (expected, channel, ts),
+            )
+            archive_versions.bump_channel(conn, channel)
+    conn.commit()
+    return checked, fixed
+
+
+def resolve_link(conn, ts, base_url):
+    """Permalink del thread (o del messaggio) con timestamp `ts`, o None.
+
+    Le radici dei thread hanno il permalink vuoto (in Slack Free non si aprono):
+    per un thread si usa il primo messaggio con un permalink archiviato, con una
+    ricerca esatta su (channel, thread_ts). L'indice è forzato perché senza
+    statistiche il planner sceglierebbe la chiave (channel, timestamp) e
+    scorrerebbe tutto il canale. Altrimenti il messaggio con quel timestamp
+    (idx_messages_timestamp). Se non c'è nessun permalink archiviato lo calcola,
+    preferendo la prima risposta alla radice.
+    """
+    thread = conn.execute(
+        "SELECT channel FROM threads WHERE thread_ts = ? ORDER BY first_ts LIMIT 1",
+        (ts,),
+    ).fetchone()
+    if thread is not None:
+        channel = thread[0]
+        row = conn.execute(
+            """
+            SELECT permalink FROM messages INDEXED BY idx_messages_channel_thread_ts
+            WHERE channel = ? AND thread_ts = ? AND permalink != ''
+            ORDER BY timestamp
+            LIMIT 1
+            """,
+            (channel, ts),
+        ).fetchone()
+        if row is not None:
+            return row[0]
+        row = conn.execute(
+            """
+            SELECT channel, timestamp, thread_ts, permalink FROM messages INDEXED BY idx_messages_channel_thread_ts
+            WHERE channel = ? AND thread_ts = ?
+            ORDER BY timestamp = thread_ts, timestamp
+            LIMIT 1
+            """,
+            (channel, ts),
+        ).fetchone()
+    else:
+        row = conn.execute(
+            "SELECT channel, timestamp, thread_ts, permalink FROM messages WHERE timestamp = ? LIMIT 1",
+            (ts,),
+        ).fetchone()
+    if row is None:
+        return None
+    channel, message_ts, thread_ts, permalink = row
+    if permalink:
+        return permalink
+    metrics.incr("permalinks.synthesized")
+    return build_permalink(base_url, channel, message_ts, thread_ts) or None
+
+
+class LinkCache:
+    """LRU dei link risolti; i permalink non cambiano, quindi niente scadenza."""
+
+    def __init__(self, max_entries=1024):
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, ts):
+        with self._lock:
+            link = self._entries.get(ts)
+            if link is not None:
+                self._entries.move_to_end(ts)
+            return link
+
+    def put(self, ts, link):
+        with self._lock:
+            self._entries[ts] = link
+            self._entries.move_to_end(ts)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
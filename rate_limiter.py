@@ -0,0 +1,61 @@
+"""Rate limiter a finestra scorrevole per utente, condiviso tra i worker via SQLite.
+
+Per ogni utente una sola riga in `ai_rate_limits` con gli ultimi N timestamp
+(N = limite più alto), quindi il controllo costa O(1) a prescindere dal
+traffico. Verifica e consumo avvengono in un'unica transazione `BEGIN
+IMMEDIATE`, così due worker non possono superare il limite insieme.
+"""
+
+import json
+import time
+
+# (finestra in secondi, richieste massime)
+DEFAULT_LIMITS = ((60, 2), (3600, 10))
+
+
+def _window_counts(stamps, limits, now):
+    return {window: sum(1 for stamp in stamps if stamp > now - window) for window, _ in limits}
+
+
+def check_and_consume(conn, key, limits=DEFAULT_LIMITS, now=None):
+    """Verifica i limiti per `key` e, se c'è spazio, registra la richiesta.
+
+    Ritorna un dict con `allowed`, `counts` (richieste per finestra, inclusa
+    quella corrente se consentita), `limits`, e per le richieste rifiutate
+    `window` superata e `retry_after` in secondi.
+    """
+    now = now if now is not None else time.time()
+    ring_size = max(limit for _, limit in limits)
+    longest_window = max(window for window, _ in limits)
+
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT stamps FROM ai_rate_limits WHERE user_id = ?", (key,)).fetchone()
+        stamps = [stamp for stamp in json.loads(row[0]) if stamp > now - longest_window] if row else []
+        counts = _window_counts(stamps, limits, now)
+
+        decision = {"allowed": True, "counts": counts, "limits": dict(limits), "window": None, "retry_after": 0.0}
+        for window, limit in limits:
+            if counts[window] >= limit:
+                # Si libera un posto quando esce dalla finestra la richiesta che lo occupa
+                in_window = sorted(stamp for stamp in stamps if stamp > now - window)
+                decision.update(
+                    allowed=False,
+                    window=window,
+                    retry_after=max(0.0, in_window[-limit] + window - now),
+                )
+                break
+
+        if decision["allowed"]:
+            stamps = (stamps + [now])[-ring_size:]
+            conn.execute(
+                "INSERT OR REPLACE INTO ai_rate_limits (user_id, stamps, updated_at) VALUES (?, ?, ?)",
+                (key, json.dumps(stamps), now),
+            )
+            decision["counts"] = _window_counts(stamps, limits, now)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return decision
@@ -0,0 +1,167 @@
+"""Rollup giornaliere dei messaggi per /stats.
+
+Le statistiche di /stats aggregavano l'intera tabella `messages` a ogni
+chiamata. Qui teniamo conteggi per giorno (UTC) e utente, canale, ora ed emoji,
+più l'ultimo messaggio di ogni utente: /stats?days=N somma al più N+1 righe
+per chiave. Emoji e file si contano da `message_entities`, le statistiche per
+thread usano già `threads` (archive_index).
+
+`run()` segue un watermark sul rowid di `messages`: ogni inserimento, comprese
+le riconsegne che sostituiscono la riga, ha un rowid nuovo. I giorni toccati
+vengono ricalcolati da zero sull'indice `idx_messages_timestamp`, quindi il
+risultato è idempotente. Le scritture che non cambiano il rowid (modifiche del
+testo, opt-out) segnano i giorni in `rollup_dirty_days` con `mark_dirty()` /
+`mark_user_dirty()`.
+"""
+
+import logging
+import time
+from datetime import datetime, timezone
+
+import archive_context
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DAY_SECONDS = 86400
+DAY_EXPR = "date(CAST(timestamp AS INTEGER), 'unixepoch')"
+WORDS_EXPR = "LENGTH(message) - LENGTH(REPLACE(message, ' ', '')) + 1"
+# Messaggi con un file, dalle entità (message_entities.py)
+HAS_FILE_EXPR = """EXISTS (
+    SELECT 1 FROM message_entities e
+    WHERE e.channel = messages.channel AND e.timestamp = messages.timestamp AND e.kind = 'file'
+)"""
+
+ROLLUP_TABLES = ("rollup_user_day", "rollup_channel_day", "rollup_hour_day", "rollup_emoji_day")
+
+_AGGREGATES = (
+    f"""
+    INSERT INTO rollup_user_day (day, user, messages, words, images)
+    SELECT {DAY_EXPR} AS day, user, COUNT(*), COALESCE(SUM({WORDS_EXPR}), 0), SUM({HAS_FILE_EXPR})
+    FROM messages WHERE {{where}} AND user IS NOT NULL
+    GROUP BY day, user
+    """,
+    f"""
+    INSERT INTO rollup_channel_day (day, channel, messages)
+    SELECT {DAY_EXPR} AS day, channel, COUNT(*)
+    FROM messages WHERE {{where}} AND channel IS NOT NULL
+    GROUP BY day, channel
+    """,
+    f"""
+    INSERT INTO rollup_hour_day (day, hour, messages)
+    SELECT {DAY_EXPR} AS day, CAST(strftime('%H', CAST(timestamp AS INTEGER), 'unixepoch') AS INTEGER) AS hour, COUNT(*)
+    FROM messages WHERE {{where}}
+    GROUP BY day, hour
+    """,
+    f"""
+    INSERT INTO rollup_emoji_day (day, emoji, uses)
+    SELECT {DAY_EXPR} AS day, value, SUM(count)
+    FROM message_entities WHERE {{where}} AND kind = 'emoji'
+    GROUP BY day, value
+    """,
+    """
+    INSERT INTO rollup_users (user, last_ts)
+    SELECT user, MAX(timestamp) FROM messages WHERE {where} AND user IS NOT NULL
+    GROUP BY user
+    ON CONFLICT(user) DO UPDATE SET last_ts = MAX(last_ts, excluded.last_ts)
+    """,
+)
+
+
+def day_of(seconds):
+    """Giorno UTC (YYYY-MM-DD) di un istante o di un timestamp Slack."""
+    return datetime.fromtimestamp(int(float(seconds)), tz=timezone.utc).date().isoformat()
+
+
+def since_day(days, now=None):
+    """Primo giorno incluso in una finestra di `days` giorni che finisce adesso."""
+    return day_of((now if now is not None else time.time()) - days * DAY_SECONDS)
+
+
+def _day_bounds(day):
+    start = datetime.fromisoformat(day).replace(tzinfo=timezone.utc).timestamp()
+    return archive_context.format_ts(start), archive_context.format_ts(start + DAY_SECONDS)
+
+
+def mark_dirty(conn, days):
+    """Segna i giorni da ricalcolare al prossimo `run()` (non fa commit)."""
+    conn.executemany("INSERT OR IGNORE INTO rollup_dirty_days (day) VALUES (?)", [(day,) for day in days])
+
+
+def mark_user_dirty(conn, user):
+    """Da chiamare prima di riassegnare i messaggi di `user` (opt-out, non fa commit)."""
+    conn.execute(
+        f"INSERT OR IGNORE INTO rollup_dirty_days (day) SELECT DISTINCT {DAY_EXPR} FROM messages WHERE user = ?",
+        (user,),
+    )
+    conn.execute("DELETE FROM rollup_users WHERE user = ?", (user,))
+
+
+def rebuild_day(conn, day):
+    """Ricalcola le rollup di un giorno dai messaggi di quel giorno (non fa commit)."""
+    for table in ROLLUP_TABLES:
+        conn.execute(f"DELETE FROM {table} WHERE day = ?", (day,))
+    start, end = _day_bounds(day)
+    for sql in _AGGREGATES:
+        conn.execute(sql.format(where="timestamp >= :start AND timestamp < :end"), {"start": start, "end": end})
+
+
+def watermark(conn):
+    row = conn.execute("SELECT last_rowid FROM rollup_watermark WHERE id = 1").fetchone()
+    return row[0] if row else 0
+
+
+def _set_watermark(conn, rowid):
+    conn.execute(
+        """
+        INSERT INTO rollup_watermark (id, last_rowid) VALUES (1, ?)
+        ON CONFLICT(id) DO UPDATE SET last_rowid = excluded.last_rowid
+        """,
+        (rowid,),
+    )
+
+
+def backfill(conn):
+    """Ricostruisce tutte le rollup da `messages` (non fa commit)."""
+    for table in ROLLUP_TABLES + ("rollup_users", "rollup_dirty_days"):
+        conn.execute(f"DELETE FROM {table}")
+    for sql in _AGGREGATES:
+        conn.execute(sql.format(where="timestamp IS NOT NULL"))
+    _set_watermark(conn, conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM messages").fetchone()[0])
+
+
+def run(conn):
+    """Porta le rollup al watermark corrente. Ritorna il numero di giorni ricalcolati.
+
+    Gira in una transazione `BEGIN IMMEDIATE`: due worker non si sovrappongono
+    e un giorno segnato durante il ricalcolo non va perso.
+    """
+    started = time.monotonic()
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        last_rowid = watermark(conn)
+        max_rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM messages").fetchone()[0]
+        days = {
+            row[0]
+            for row in conn.execute(
+                f"SELECT DISTINCT {DAY_EXPR} FROM messages WHERE rowid > ? AND rowid <= ? AND timestamp IS NOT NULL",
+                (last_rowid, max_rowid),
+            )
+        }
+        days.update(row[0] for row in conn.execute("SELECT day FROM rollup_dirty_days"))
+        for day in sorted(days):
+            rebuild_day(conn, day)
+        conn.execute("DELETE FROM rollup_dirty_days")
+        if max_rowid != last_rowid:
+            _set_watermark(conn, max_rowid)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if days:
+        elapsed = time.monotonic() - started
+        metrics.observe("rollups.run_seconds", elapsed)
+        metrics.incr("rollups.days_rebuilt", len(days))
+        logger.info(f"[ROLLUPS] Rebuilt {len(days)} day(s) up to rowid {max_rowid} in {elapsed:.3f}s")
+    return len(days)
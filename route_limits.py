@@ -0,0 +1,59 @@
+"""Limiti di concorrenza per gruppo di route, per worker.
+
+Con i worker `gthread` (gunicorn_conf.py) ogni processo serve fino a `THREADS`
+richieste in parallelo. Le route legate all'LLM restano ferme su OpenAI per
+decine di secondi: senza un tetto potrebbero occupare tutti i thread e lasciare
+`/slack/events` in coda finché Slack non ritenta. Ogni gruppo ha un numero
+massimo di richieste in corso; oltre il tetto la richiesta viene rifiutata
+subito (503 con `Retry-After`) invece di aspettare un thread.
+
+Il tetto totale deve restare sotto `THREADS`, così qualche thread è sempre
+libero per gli eventi Slack e le letture dell'archivio.
+"""
+
+import os
+import threading
+
+import metrics
+
+# Thread per worker gthread (gunicorn_conf.py)
+THREADS = int(os.getenv("THREADS", 8))
+
+# Richieste in corso per gruppo e per worker
+LIMITS = {
+    "llm": int(os.getenv("ARCHIVE_BOT_LLM_CONCURRENCY", 2)),
+    "digest": int(os.getenv("ARCHIVE_BOT_DIGEST_CONCURRENCY", 1)),
+}
+RETRY_AFTER_SECONDS = int(os.getenv("ARCHIVE_BOT_LLM_RETRY_AFTER_SECONDS", 5))
+
+
+def reserved_threads(limits=None):
+    """Thread che restano liberi con tutti i gruppi al tetto."""
+    return THREADS - sum((limits or LIMITS).values())
+
+
+class RouteLimiter:
+    """Contatore di richieste in corso per gruppo, thread-safe."""
+
+    def __init__(self, limits):
+        self.limits = dict(limits)
+        self._lock = threading.Lock()
+        self._in_flight = {group: 0 for group in self.limits}
+
+    def try_acquire(self, group):
+        """Occupa un posto nel gruppo; False se il gruppo è al tetto."""
+        with self._lock:
+            if self._in_flight[group] >= self.limits[group]:
+                metrics.incr(f"route_limits.{group}.rejected")
+                return False
+            self._in_flight[group] += 1
+            metrics.incr(f"route_limits.{group}.accepted")
+            return True
+
+    def release(self, group):
+        with self._lock:
+            self._in_flight[group] = max(0, self._in_flight[group] - 1)
+
+    def in_flight(self, group):
+        with self._lock:
+            return self._in_flight[group]
@@ -0,0 +1,274 @@
+"""Client Slack Web API consapevole dei rate limit.
+
+`RateLimitedSlackClient` è un `WebClient` che passa ogni chiamata da `api_call`:
+- token bucket per metodo secondo il tier di Slack (per canale per `chat.postMessage`);
+- su 429 rispetta `Retry-After`, ferma il bucket del metodo per tutti i thread
+  e riprova fino a `max_retries` volte;
+- le letture idempotenti identiche in volo vengono unite (single-flight) e le
+  risposte restano in cache per pochi secondi (TTL per metodo);
+- metriche per metodo: chiamate, errori, latenza, attese, 429, hit di cache.
+
+Con `SLACK_API_BASE_URL` si può puntare a `utilities/slack_stub.py` per i test.
+I limiti sono per workspace, non per processo: con più worker conviene
+impostare `SLACK_API_RATE_SHARE` (es. 0.5 con due worker).
+"""
+
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Richieste al minuto per tier (https://api.slack.com/apis/rate-limits)
+TIER_PER_MINUTE = {1: 1, 2: 20, 3: 50, 4: 100}
+# chat.postMessage: circa un messaggio al secondo per canale
+POST_MESSAGE_PER_MINUTE = 60
+DEFAULT_TIER = 3
+
+METHOD_TIERS = {
+    "auth.test": 4,
+    "chat.delete": 3,
+    "chat.getPermalink": 4,
+    "chat.update": 3,
+    "conversations.history": 3,
+    "conversations.info": 3,
+    "conversations.join": 3,
+    "conversations.list": 2,
+    "conversations.members": 4,
+    "conversations.replies": 3,
+    "reactions.add": 3,
+    "users.info": 4,
+    "users.list": 2,
+}
+PER_CHANNEL_METHODS = {"chat.postMessage"}
+
+# Letture idempotenti: TTL (secondi) della cache delle risposte
+CACHE_TTLS = {
+    "auth.test": 3600.0,
+    "chat.getPermalink": 3600.0,
+    "conversations.history": 2.0,
+    "conversations.info": 300.0,
+    "conversations.members": 60.0,
+    "conversations.replies": 2.0,
+    "users.info": 300.0,
+}
+# Metodi che cambiano il contenuto di un canale: invalidano le letture in cache di quel canale
+CHANNEL_READS = ("conversations.history", "conversations.replies")
+CACHE_MAX_ENTRIES = 2000
+MAX_RETRIES = 3
+MAX_RETRY_AFTER_SECONDS = 60.0
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst=None, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst or max(1, min(per_minute, 10)))
+        self.tokens = self.capacity
+        self.blocked_until = 0.0
+        self._clock = clock
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Prenota un token e ritorna quanti secondi aspettare prima di usarlo."""
+        with self._lock:
+            now = self._clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.blocked_until - now)
+
+    def block(self, seconds):
+        """Ferma il bucket per `seconds` (Retry-After ricevuto da Slack)."""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, self._clock() + seconds)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _request_key(api_method, params, json_body, data, token=None):
+    args = {}
+    for part in (params, json_body, data):
+        if part:
+            args.update(part)
+    # Il token esplicito uguale a quello del client non distingue le richieste
+    if token and args.get("token") == token:
+        del args["token"]
+    return api_method + "?" + json.dumps(args, sort_keys=True, default=str)
+
+
+def _channel_of(params, json_body, data):
+    for part in (params, json_body, data):
+        if part and part.get("channel"):
+            return part["channel"]
+    return None
+
+
+def _retry_after(error):
+    try:
+        return float(error.response.headers.get("Retry-After", error.response.headers.get("retry-after")))
+    except (AttributeError, TypeError, ValueError):
+        return 1.0
+
+
+class RateLimitedSlackClient(WebClient):
+    def __init__(self, *args, rate_share=None, max_retries=MAX_RETRIES, sleep=time.sleep,
+                 clock=time.monotonic, **kwargs):
+        super().__init__(*args, **kwargs)
+        if rate_share is None:
+            rate_share = float(os.environ.get("SLACK_API_RATE_SHARE", 1.0))
+        self._rate_share = rate_share
+        self._max_retries = max_retries
+        self._sleep = sleep
+        self._clock = clock
+        self._buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._cache = collections.OrderedDict()
+        self._flights = {}
+        self._state_lock = threading.Lock()
+
+    def _bucket(self, api_method, channel):
+        key = f"{api_method}:{channel}" if api_method in PER_CHANNEL_METHODS else api_method
+        with self._buckets_lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if api_method in PER_CHANNEL_METHODS:
+                    per_minute = POST_MESSAGE_PER_MINUTE
+                else:
+                    per_minute = TIER_PER_MINUTE[METHOD_TIERS.get(api_method, DEFAULT_TIER)]
+                bucket = TokenBucket(max(per_minute * self._rate_share, 0.1), clock=self._clock)
+                self._buckets[key] = bucket
+            return bucket
+
+    def clear_cache(self):
+        with self._state_lock:
+            self._cache.clear()
+
+    def _cache_get(self, key):
+        with self._state_lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= self._clock():
+                del self._cache[key]
+                return None
+            return entry[0]
+
+    def _cache_put(self, key, response, ttl):
+        with self._state_lock:
+            self._cache[key] = (response, self._clock() + ttl)
+            self._cache.move_to_end(key)
+            while len(self._cache) > CACHE_MAX_ENTRIES:
+                self._cache.popitem(last=False)
+
+    def _invalidate_channel(self, channel):
+        needle = json.dumps(channel)
+        with self._state_lock:
+            for key in [k for k in self._cache if k.startswith(CHANNEL_READS) and f'"channel": {needle}' in k]:
+                del self._cache[key]
+
+    def api_call(self, api_method, *, http_verb="POST", files=None, data=None, params=None,
+                 json=None, headers=None, auth=None):
+        def call():
+            return self._call_with_limits(
+                api_method, channel,
+                lambda: super(RateLimitedSlackClient, self).api_call(
+                    api_method, http_verb=http_verb, files=files, data=data, params=params,
+                    json=json, headers=headers, auth=auth,
+                ),
+            )
+
+        channel = _channel_of(params, json, data)
+        ttl = CACHE_TTLS.get(api_method)
+        if ttl is None or files:
+            response = call()
+            if channel:
+                self._invalidate_channel(channel)
+            return response
+
+        key = _request_key(api_method, params, json, data, self.token)
+        cached = self._cache_get(key)
+        if cached is not None:
+            metrics.incr(f"slack.{api_method}.cache_hits")
+            return cached
+
+        with self._state_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+        if not leader:
+            metrics.incr(f"slack.{api_method}.coalesced")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = call()
+            self._cache_put(key, flight.result, ttl)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._state_lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _call_with_limits(self, api_method, channel, fn):
+        bucket = self._bucket(api_method, channel)
+        attempt = 0
+        while True:
+            wait = bucket.reserve()
+            if wait > 0:
+                metrics.observe(f"slack.{api_method}.throttle_wait_seconds", wait)
+                if wait > 1:
+                    logger.info(f"[SLACK] Throttling {api_method} for {wait:.1f}s")
+                self._sleep(wait)
+
+            started = time.monotonic()
+            try:
+                response = fn()
+            except SlackApiError as e:
+                metrics.observe(f"slack.{api_method}.latency_seconds", time.monotonic() - started)
+                if getattr(e.response, "status_code", None) != 429 or attempt >= self._max_retries:
+                    metrics.incr(f"slack.{api_method}.errors")
+                    raise
+                retry_after = min(_retry_after(e), MAX_RETRY_AFTER_SECONDS)
+                metrics.incr(f"slack.{api_method}.rate_limited")
+                logger.warning(f"[SLACK] {api_method} rate limited, retrying in {retry_after:.1f}s")
+                bucket.block(retry_after)
+                attempt += 1
+                continue
+            except Exception:
+                metrics.observe(f"slack.{api_method}.latency_seconds", time.monotonic() - started)
+                metrics.incr(f"slack.{api_method}.errors")
+                raise
+            metrics.observe(f"slack.{api_method}.latency_seconds", time.monotonic() - started)
+            metrics.incr(f"slack.{api_method}.calls")
+            return response
+
+
+def create_client(token=None):
+    """Client condiviso del processo; `SLACK_API_BASE_URL` permette di usare uno stub locale."""
+    kwargs = {}
+    base_url = os.environ.get("SLACK_API_BASE_URL")
+    if base_url:
+        kwargs["base_url"] = base_url if base_url.endswith("/") else base_url + "/"
+    return RateLimitedSlackClient(token=token, **kwargs)
@@ -0,0 +1,149 @@
+import json
+import os
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+from ai_stream import (
+    STREAMING_CURSOR,
+    ProgressiveSlackReply,
+    iter_completion_deltas,
+    sse_event,
+    stream_completion_events,
+    wants_event_stream,
+)
+from utilities.openai_stub import start_stub_server
+
+
+def _parse_events(raw_events):
+    parsed = []
+    for raw in raw_events:
+        event, data = None, None
+        for line in raw.strip().split("\n"):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+        parsed.append((event, data))
+    return parsed
+
+
+@pytest.fixture
+def stub_client():
+    openai = pytest.importorskip("openai")
+    server = start_stub_server(reply="uno due tre")
+    client = openai.OpenAI(api_key="stub", base_url=server.base_url)
+    yield client
+    server.shutdown()
+
+
+def test_sse_event_serializes_json_payload():
+    assert sse_event({"delta": "ciao"}, event="token") == 'event: token\ndata: {"delta": "ciao"}\n\n'
+
+
+def test_sse_event_without_event_name():
+    assert sse_event({"a": 1}) == 'data: {"a": 1}\n\n'
+
+
+def test_wants_event_stream_from_body_flag():
+    assert wants_event_stream({"stream": True}, None)
+    assert not wants_event_stream({"stream": "yes"}, "application/json")
+
+
+def test_wants_event_stream_from_accept_header():
+    assert wants_event_stream({}, "text/event-stream")
+
+
+def test_iter_completion_deltas_against_stub(stub_client):
+    stream = stub_client.chat.completions.create(
+        model="gpt-4o", messages=[{"role": "user", "content": "ciao"}], stream=True,
+    )
+    assert "".join(iter_completion_deltas(stream)) == "uno due tre"
+
+
+def test_stream_completion_events_persists_final_text(stub_client):
+    saved = []
+    stream = stub_client.chat.completions.create(
+        model="gpt-4o", messages=[{"role": "user", "content": "ciao"}], stream=True,
+    )
+    events = _parse_events(stream_completion_events(
+        stream,
+        on_complete=saved.append,
+        done_payload=lambda text: {"status": "success", "details": text},
+    ))
+
+    tokens = [data["delta"] for event, data in events if event == "token"]
+    assert "".join(tokens) == "uno due tre"
+    assert events[-1] == ("done", {"status": "success", "details": "uno due tre"})
+    assert saved == ["uno due tre"]
+
+
+def test_stream_completion_events_reports_errors():
+    def broken_stream():
+        raise RuntimeError("connessione persa")
+        yield
+
+    events = _parse_events(stream_completion_events(broken_stream()))
+    assert events == [("error", {"status": "error", "message": "connessione persa"})]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _progressive(clock, min_interval=1.0):
+    calls = []
+    reply = ProgressiveSlackReply(
+        post=lambda text: calls.append(("post", text)) or "111.222",
+        update=lambda ts, text: calls.append(("update", ts, text)),
+        placeholder="...",
+        min_interval=min_interval,
+        clock=clock,
+    )
+    return reply, calls
+
+
+def test_progressive_reply_shows_first_token_immediately():
+    clock = FakeClock()
+    reply, calls = _progressive(clock)
+    reply.start()
+    clock.now = 0.4
+    reply.feed("Ciao")
+
+    assert calls == [("post", "..."), ("update", "111.222", "Ciao" + STREAMING_CURSOR)]
+    assert reply.time_to_first_text == pytest.approx(0.4)
+
+
+def test_progressive_reply_rate_limits_updates():
+    clock = FakeClock()
+    reply, calls = _progressive(clock, min_interval=1.0)
+    reply.start()
+    reply.feed("a")
+    clock.now = 0.5
+    reply.feed("b")
+    clock.now = 1.2
+    reply.feed("c")
+    reply.finish("abc + footer")
+
+    updates = [c[2] for c in calls if c[0] == "update"]
+    assert updates == ["a" + STREAMING_CURSOR, "abc" + STREAMING_CURSOR, "abc + footer"]
+    assert reply.text == "abc"
+
+
+def test_progressive_reply_skips_whitespace_only_updates():
+    clock = FakeClock()
+    reply, calls = _progressive(clock)
+    reply.start()
+    reply.feed("\n")
+
+    assert calls == [("post", "...")]
+    assert reply.first_text_at is None
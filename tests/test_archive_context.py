@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+import archive_context
+from utils import migrate_db
+
+
+class FakeSlackClient:
+    def __init__(self, history=None, replies=None):
+        self.history = history or []
+        self.replies = replies or {}
+        self.calls = []
+
+    def conversations_history(self, channel, limit=200, oldest=None, latest=None, inclusive=True, cursor=None):
+        self.calls.append(("history", oldest, latest))
+        messages = [
+            m for m in sorted(self.history, key=lambda m: m["ts"], reverse=True)
+            if (oldest is None or m["ts"] >= oldest) and (latest is None or m["ts"] <= latest)
+        ]
+        return {"messages": messages[:limit], "has_more": len(messages) > limit,
+                "response_metadata": {"next_cursor": ""}}
+
+    def conversations_replies(self, channel, ts, cursor=None):
+        self.calls.append(("replies", ts))
+        return {"messages": self.replies.get(ts, []), "has_more": False}
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    migrate_db(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+def _archive(conn, channel, ts, user="U1", text="ciao", thread_ts=None):
+    conn.execute(
+        "INSERT INTO messages (message, user, channel, timestamp, permalink, thread_ts) VALUES (?, ?, ?, ?, '', ?)",
+        (text, user, channel, ts, thread_ts or ts),
+    )
+    archive_context.record_ingest(conn, channel, ts)
+
+
+def test_thread_is_served_from_the_archive(conn):
+    _archive(conn, "C1", "1700000000.000100", text="root")
+    _archive(conn, "C1", "1700000001.000100", user="U2", text="reply", thread_ts="1700000000.000100")
+    archive_context.record_bot_reply(conn, "C1", "1700000002.000100", "1700000000.000100", "UBOT", "bot")
+    client = FakeSlackClient()
+
+    messages = archive_context.thread_messages(conn, client, "C1", "1700000000.000100", now_ts="1700000010.000000")
+
+    assert [m["text"] for m in messages] == ["root", "reply", "bot"]
+    assert client.calls == []
+
+
+def test_thread_outside_archive_is_fetched_once(conn):
+    replies = {"1600000000.000100": [
+        {"user": "U1", "text": "vecchio root", "ts": "1600000000.000100"},
+        {"user": "UBOT", "text": "risposta bot", "ts": "1600000001.000100", "thread_ts": "1600000000.000100"},
+    ]}
+    client = FakeSlackClient(replies=replies)
+
+    first = archive_context.thread_messages(conn, client, "C1", "1600000000.000100", bot_user_id="UBOT")
+    assert [m["text"] for m in first] == ["vecchio root", "risposta bot"]
+    assert len(client.calls) == 1
+
+
+def test_restart_gap_forces_thread_refetch_until_filled(conn):
+    _archive(conn, "C1", "1700000000.000100", text="root")
+    archive_context.open_restart_gaps(conn, now_ts="1700000100.000000")
+    client = FakeSlackClient(replies={"1700000000.000100": [
+        {"user": "U1", "text": "root", "ts": "1700000000.000100"},
+        {"user": "U2", "text": "perso", "ts": "1700000050.000100", "thread_ts": "1700000000.000100"},
+    ]})
+
+    messages = archive_context.thread_messages(conn, client, "C1", "1700000000.000100", now_ts="1700000200.000000")
+    assert [m["text"] for m in messages] == ["root", "perso"]
+
+    archive_context.thread_messages(conn, client, "C1", "1700000000.000100", now_ts="1700000300.000000")
+    assert len(client.calls) == 1
+
+
+def test_channel_gap_is_filled_and_closed(conn):
+    for i in range(3):
+        _archive(conn, "C1", f"170000000{i}.000100", text=f"m{i}")
+    archive_context.open_restart_gaps(conn, now_ts="1700000050.000000")
+    client = FakeSlackClient(history=[{"user": "U3", "text": "durante il downtime", "ts": "1700000020.000100"}])
+
+    messages = archive_context.channel_messages(conn, client, "C1", latest_ts="1700000060.000000", limit=4)
+    assert [m["text"] for m in messages] == ["m0", "m1", "m2", "durante il downtime"]
+    assert conn.execute("SELECT COUNT(*) FROM ingest_gaps").fetchone()[0] == 0
+
+    calls = len(client.calls)
+    archive_context.channel_messages(conn, client, "C1", latest_ts="1700000060.000000", limit=4)
+    assert len(client.calls) == calls
+
+
+def test_channel_history_before_watermark_extends_it(conn):
+    _archive(conn, "C1", "1700000005.000100", text="nuovo")
+    client = FakeSlackClient(history=[
+        {"user": "U1", "text": "vecchio", "ts": "1700000001.000100"},
+        {"user": "U1", "text": "join", "ts": "1700000002.000100", "subtype": "channel_join"},
+    ])
+
+    messages = archive_context.channel_messages(conn, client, "C1", latest_ts="1700000010.000000", limit=10)
+    assert [m["text"] for m in messages] == ["vecchio", "nuovo"]
+    assert archive_context.get_watermark(conn, "C1")[0] == "0"
+
+    archive_context.channel_messages(conn, client, "C1", latest_ts="1700000010.000000", limit=10)
+    assert len(client.calls) == 1
+
+
+def test_store_slack_messages_respects_optout(conn):
+    conn.execute("INSERT INTO optout (user, timestamp) VALUES ('U9', CURRENT_TIMESTAMP)")
+    archive_context.store_slack_messages(conn, "C1", [{"user": "U9", "text": "segreto", "ts": "1.000001"}])
+
+    row = conn.execute("SELECT user, message FROM messages").fetchone()
+    assert row[0] == "USLACKBOT"
+    assert "segreto" not in row[1]
+
+
+def test_archived_mention_stays_in_thread_context(conn):
+    root = "1700000000.000100"
+    archive_context.archive_message(conn, "C1", root, root, "U1", "root", "")
+    # Mention del bot nel thread, archiviata prima della risposta
+    archive_context.archive_message(
+        conn, "C1", "1700000001.000100", root, "U2", "<@UBOT> chi ha ragione?", "https://x/p1"
+    )
+    archive_context.record_bot_reply(conn, "C1", "1700000002.000100", root, "UBOT", "risposta")
+    client = FakeSlackClient()
+
+    # Una richiesta successiva legge il contesto dal DB: la domanda c'è ancora
+    messages = archive_context.thread_messages(conn, client, "C1", root, now_ts="1700000010.000000")
+
+    assert [(m["user"], m["text"]) for m in messages] == [
+        ("U1", "root"),
+        ("U2", "<@UBOT> chi ha ragione?"),
+        ("UBOT", "risposta"),
+    ]
+    assert client.calls == []
+    assert conn.execute("SELECT value FROM message_entities WHERE kind = 'user'").fetchall() == [("UBOT",)]
@@ -0,0 +1,179 @@
+import os
+import sqlite3
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import archive_index
+from utils import migrate_db
+
+
+def make_conn():
+    conn = sqlite3.connect(":memory:")
+    migrate_db(conn, conn.cursor())
+    conn.execute("INSERT INTO users (name, id) VALUES ('alice', 'U1'), ('bob', 'U2'), ('slackbot', 'USLACKBOT')")
+    return conn
+
+
+def insert(conn, ts, thread_ts=None, user="U1", channel="C1"):
+    conn.execute(
+        "INSERT INTO messages (message, user, channel, timestamp, permalink, thread_ts) VALUES (?, ?, ?, ?, '', ?)",
+        (f"msg {ts}", user, channel, ts, thread_ts),
+    )
+    archive_index.record_message(conn, channel, ts, thread_ts)
+
+
+def reply_count(conn, thread_ts, channel="C1"):
+    row = conn.execute(
+        "SELECT reply_count FROM threads WHERE channel = ? AND thread_ts = ?", (channel, thread_ts)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def test_reply_counts_are_maintained_and_idempotent():
+    conn = make_conn()
+    insert(conn, "100.000001", "100.000001")
+    insert(conn, "101.000001", "100.000001", user="U2")
+    insert(conn, "102.000001", "100.000001")
+    # Slack riconsegna lo stesso evento: la riga viene sostituita, il conteggio non cambia
+    insert(conn, "102.000001", "100.000001")
+    insert(conn, "101.000001", "100.000001", channel="C2")
+
+    assert reply_count(conn, "100.000001") == 2
+    assert reply_count(conn, "100.000001", channel="C2") == 1
+
+
+def test_backfill_matches_incremental_counts():
+    conn = make_conn()
+    for i in range(5):
+        insert(conn, f"{200 + i}.000001", "200.000001")
+    conn.execute("DELETE FROM threads")
+
+    assert archive_index.backfill(conn) == 1
+    assert reply_count(conn, "200.000001") == 4
+
+
+def test_channel_page_uses_cursors():
+    conn = make_conn()
+    roots = [f"17000001{i:02d}.000001" for i in range(10)]
+    for ts in roots:
+        insert(conn, ts, ts)
+        insert(conn, ts.replace(".000001", ".500000"), ts, user="U2")
+    # Root legacy senza thread_ts e messaggio di un utente in opt-out
+    insert(conn, "1700000000.000001", None)
+    insert(conn, "1700000200.000001", "1700000200.000001", user="U2")
+    conn.execute("INSERT INTO optout (user, timestamp) VALUES ('U2', CURRENT_TIMESTAMP)")
+
+    first = archive_index.channel_page(conn, "C1", 4)
+    assert [row[3] for row in first] == roots[9:5:-1]
+    assert [row[7] for row in first] == [2, 2, 2, 2]
+    assert first[0][6] == "alice"
+
+    second = archive_index.channel_page(conn, "C1", 4, before_ts=first[-1][3])
+    assert [row[3] for row in second] == roots[5:1:-1]
+
+    last = archive_index.channel_page(conn, "C1", 4, before_ts=second[-1][3])
+    assert [(row[3], row[7]) for row in last] == [(roots[1], 2), (roots[0], 2), ("1700000000.000001", 0)]
+
+    newer = archive_index.channel_page(conn, "C1", 2, after_ts=second[0][3])
+    assert [row[3] for row in newer] == [roots[7], roots[6]]
+
+
+def thread_row(conn, thread_ts, channel="C1"):
+    return conn.execute(
+        "SELECT root_user, reply_count, participant_count, first_ts, last_reply_ts FROM threads WHERE channel = ? AND thread_ts = ?",
+        (channel, thread_ts),
+    ).fetchone()
+
+
+def test_thread_facts_are_maintained():
+    conn = make_conn()
+    insert(conn, "1700000000.000001", "1700000000.000001")
+    assert thread_row(conn, "1700000000.000001") == ("U1", 0, 1, "1700000000.000001", None)
+
+    insert(conn, "1700000001.000001", "1700000000.000001", user="U2")
+    insert(conn, "1700000002.000001", "1700000000.000001", user="U1")
+    assert thread_row(conn, "1700000000.000001") == ("U1", 2, 2, "1700000000.000001", "1700000002.000001")
+
+    # Root legacy con thread_ts NULL e risposta arrivata prima del root
+    insert(conn, "1700000011.000001", "1700000010.000001", user="U2")
+    assert thread_row(conn, "1700000010.000001") == (None, 1, 1, "1700000011.000001", "1700000011.000001")
+    insert(conn, "1700000010.000001", None)
+    assert thread_row(conn, "1700000010.000001") == ("U1", 1, 2, "1700000010.000001", "1700000011.000001")
+
+
+def test_refresh_after_user_is_anonymized():
+    conn = make_conn()
+    insert(conn, "1700000000.000001", "1700000000.000001", user="U2")
+    insert(conn, "1700000001.000001", "1700000000.000001", user="U1")
+    touched = archive_index.user_threads(conn, "U2")
+    conn.execute("UPDATE messages SET user = 'USLACKBOT' WHERE user = 'U2'")
+    archive_index.refresh_threads(conn, touched)
+
+    assert thread_row(conn, "1700000000.000001")[:3] == ("USLACKBOT", 1, 2)
+
+
+def test_migration_adds_columns_and_backfills_legacy_threads():
+    conn = sqlite3.connect(":memory:")
+    conn.execute(
+        "CREATE TABLE messages (message TEXT, user TEXT, channel TEXT, timestamp TEXT, permalink TEXT, thread_ts TEXT, "
+        "UNIQUE(channel, timestamp) ON CONFLICT REPLACE)"
+    )
+    conn.executemany(
+        "INSERT INTO messages VALUES ('x', ?, 'C1', ?, '', ?)",
+        [
+            ("U1", "1700000000.000001", "1700000000.000001"),
+            ("U2", "1700000001.000001", "1700000000.000001"),
+            ("U3", "1700000005.000001", None),
+        ],
+    )
+    # Tabella threads nella forma precedente (solo reply_count)
+    conn.execute(
+        "CREATE TABLE threads (channel TEXT NOT NULL, thread_ts TEXT NOT NULL, reply_count INTEGER NOT NULL DEFAULT 0, "
+        "PRIMARY KEY (channel, thread_ts)) WITHOUT ROWID"
+    )
+    conn.commit()
+    migrate_db(conn, conn.cursor())
+
+    assert thread_row(conn, "1700000000.000001") == ("U1", 1, 2, "1700000000.000001", "1700000001.000001")
+    assert thread_row(conn, "1700000005.000001") == ("U3", 0, 1, "1700000005.000001", None)
+
+
+def channel_stats(conn):
+    return conn.execute(
+        "SELECT channel, last_message_ts, message_count, reply_count FROM channel_stats ORDER BY channel"
+    ).fetchall()
+
+
+def test_channel_stats_are_maintained_incrementally():
+    conn = make_conn()
+    # Risposte arrivate prima del root, riconsegne e un messaggio senza thread_ts
+    insert(conn, "1700000001.000100", "1700000000.000100")
+    insert(conn, "1700000000.000100", "1700000000.000100")
+    insert(conn, "1700000002.000100", "1700000000.000100", user="U2")
+    insert(conn, "1700000002.000100", "1700000000.000100", user="U2")
+    insert(conn, "1700000003.000100")
+    insert(conn, "1700000005.000100", "1700000005.000100", channel="C2")
+
+    assert channel_stats(conn) == [
+        ("C1", "1700000003.000100", 4, 2),
+        ("C2", "1700000005.000100", 1, 0),
+    ]
+    incremental = channel_stats(conn)
+    archive_index.backfill(conn)
+    assert channel_stats(conn) == incremental
+
+
+def test_channel_stats_unchanged_by_anonymization():
+    conn = make_conn()
+    insert(conn, "1700000000.000100", "1700000000.000100")
+    insert(conn, "1700000001.000100", "1700000000.000100", user="U2")
+    before = channel_stats(conn)
+
+    touched = archive_index.user_threads(conn, "U2")
+    conn.execute("UPDATE messages SET user = 'USLACKBOT' WHERE user = 'U2'")
+    archive_index.refresh_threads(conn, touched)
+    assert channel_stats(conn) == before
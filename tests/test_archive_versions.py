@@ -0,0 +1,79 @@
+import os
+import sqlite3
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+import archive_index
+import archive_versions
+from channel_directory import write_channel
+from user_directory import upsert_users
+from utils import migrate_db
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    migrate_db(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+def _add_message(conn, channel, ts, thread_ts=None):
+    conn.execute(
+        "INSERT INTO messages (message, user, channel, timestamp, permalink, thread_ts) VALUES ('x', 'U1', ?, ?, '', ?)",
+        (channel, ts, thread_ts or ts),
+    )
+    archive_index.record_message(conn, channel, ts, thread_ts)
+
+
+def test_message_writes_bump_only_their_channel(conn):
+    c1 = [archive_versions.channel_scope("C1")]
+    c2 = [archive_versions.channel_scope("C2")]
+    assert archive_versions.version(conn, c1) == (0, None)
+
+    _add_message(conn, "C1", "1700000000.000100")
+    generation, updated_at = archive_versions.version(conn, c1)
+    assert generation == 1
+    assert updated_at is not None
+    assert archive_versions.version(conn, c2)[0] == 0
+
+    _add_message(conn, "C2", "1700000001.000100")
+    assert archive_versions.version(conn, c1)[0] == 1
+    assert archive_versions.version(conn, [], all_channels=True)[0] == 2
+
+
+def test_all_channels_range_excludes_other_scopes(conn):
+    archive_versions.bump_users(conn)
+    archive_versions.bump_channels(conn)
+    assert archive_versions.version(conn, [], all_channels=True)[0] == 0
+    assert archive_versions.version(conn, [archive_versions.CHANNELS_SCOPE], all_channels=True)[0] == 1
+
+
+def test_thread_scopes(conn):
+    _add_message(conn, "C1", "1700000000.000100")
+    _add_message(conn, "C1", "1700000001.000100", thread_ts="1700000000.000100")
+    assert archive_versions.thread_scopes(conn, "1700000000.000100") == [archive_versions.channel_scope("C1")]
+    assert archive_versions.thread_scopes(conn, "1700000001.000100") == []
+
+
+def test_write_channel_bumps_only_on_change(conn):
+    scope = [archive_versions.CHANNELS_SCOPE]
+    write_channel(conn, "C1", "general", 0, [])
+    assert archive_versions.version(conn, scope)[0] == 1
+    write_channel(conn, "C1", "general", 0, [("C1", "U1")])
+    assert archive_versions.version(conn, scope)[0] == 1
+    write_channel(conn, "C1", "generale", 0, [("C1", "U1")])
+    assert archive_versions.version(conn, scope)[0] == 2
+
+
+def test_upsert_users_bumps_users(conn):
+    upsert_users(conn, [])
+    assert archive_versions.version(conn, [archive_versions.USERS_SCOPE])[0] == 0
+    upsert_users(conn, [("mario", "U1", "", False, "", "", "")])
+    assert archive_versions.version(conn, [archive_versions.USERS_SCOPE])[0] == 1
@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+from auth_context import GENERATION_SCOPE, AuthContextCache, load
+from utils import bump_generation, migrate_db
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Connector:
+    """Apre connessioni sullo stesso file e conta le query eseguite."""
+
+    def __init__(self, path):
+        self.path = path
+        self.queries = 0
+
+    def __call__(self):
+        conn = sqlite3.connect(self.path)
+        conn.set_trace_callback(self._count)
+        return conn
+
+    def _count(self, statement):
+        self.queries += 1
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "auth.sqlite")
+    conn = sqlite3.connect(path)
+    migrate_db(conn, conn.cursor())
+    conn.execute("INSERT INTO users (name, id) VALUES ('mario', 'U1')")
+    conn.execute("INSERT INTO users (name, id) VALUES ('anna', 'U2')")
+    conn.execute("INSERT INTO optout_ai (user, timestamp) VALUES ('U2', CURRENT_TIMESTAMP)")
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_load_reads_user_and_flags(db_path):
+    conn = sqlite3.connect(db_path)
+    assert load(conn, "U1") == {"user_id": "U1", "username": "mario", "opted_out": False, "opted_out_ai": False}
+    assert load(conn, "U2")["opted_out_ai"] is True
+    assert load(conn, "U9") is None
+    conn.close()
+
+
+def test_cache_hit_runs_no_queries(db_path):
+    clock = FakeClock()
+    connect = Connector(db_path)
+    cache = AuthContextCache(ttl=30, check_interval=2, clock=clock)
+
+    assert cache.get(connect, "U1")["username"] == "mario"
+    after_miss = connect.queries
+    clock.now = 1
+    assert cache.get(connect, "U1")["username"] == "mario"
+    assert connect.queries == after_miss
+
+
+def test_entries_expire_after_ttl(db_path):
+    clock = FakeClock()
+    connect = Connector(db_path)
+    cache = AuthContextCache(ttl=30, check_interval=100, clock=clock)
+    cache.get(connect, "U1")
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE users SET name = 'mario2' WHERE id = 'U1'")
+    conn.commit()
+    conn.close()
+
+    clock.now = 10
+    assert cache.get(connect, "U1")["username"] == "mario"
+    clock.now = 31
+    assert cache.get(connect, "U1")["username"] == "mario2"
+
+
+def test_invalidate_reflects_optout_immediately(db_path):
+    clock = FakeClock()
+    connect = Connector(db_path)
+    cache = AuthContextCache(ttl=30, check_interval=2, clock=clock)
+    assert cache.get(connect, "U1")["opted_out"] is False
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO optout (user, timestamp) VALUES ('U1', CURRENT_TIMESTAMP)")
+    cache.invalidate(conn, "U1")
+    conn.commit()
+    conn.close()
+
+    assert cache.get(connect, "U1")["opted_out"] is True
+
+
+def test_other_worker_sees_generation_bump(db_path):
+    clock = FakeClock()
+    connect = Connector(db_path)
+    cache = AuthContextCache(ttl=30, check_interval=2, clock=clock)
+    assert cache.get(connect, "U2")["opted_out_ai"] is True
+
+    # Un altro worker toglie l'opt-out AI
+    conn = sqlite3.connect(db_path)
+    conn.execute("DELETE FROM optout_ai WHERE user = 'U2'")
+    bump_generation(conn, GENERATION_SCOPE)
+    conn.commit()
+    conn.close()
+
+    clock.now = 1
+    assert cache.get(connect, "U2")["opted_out_ai"] is True
+    clock.now = 3
+    assert cache.get(connect, "U2")["opted_out_ai"] is False
+
+
+def test_unknown_users_are_not_cached_and_size_is_bounded(db_path):
+    connect = Connector(db_path)
+    cache = AuthContextCache(max_entries=1, clock=FakeClock())
+    assert cache.get(connect, "U9") is None
+    assert len(cache) == 0
+    cache.get(connect, "U1")
+    cache.get(connect, "U2")
+    assert len(cache) == 1
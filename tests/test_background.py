@@ -0,0 +1,41 @@
+import os
+import sys
+import threading
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import background
+
+
+def test_registered_jobs_run_periodically(monkeypatch):
+    monkeypatch.setattr(background, "_jobs", [])
+    monkeypatch.setattr(background, "_started_pid", None)
+    ran = threading.Event()
+    background.register("test", 0.01, ran.set)
+
+    stop = background.start()
+    try:
+        assert ran.wait(2)
+        assert background.start() is None
+    finally:
+        stop.set()
+
+
+def test_startup_jobs_run_once(monkeypatch):
+    monkeypatch.setattr(background, "_jobs", [])
+    monkeypatch.setattr(background, "_startup_jobs", [])
+    monkeypatch.setattr(background, "_started_pid", None)
+    calls = []
+    done = threading.Event()
+    background.register_startup("warm_up", lambda: (calls.append(1), done.set()))
+
+    stop = background.start()
+    try:
+        assert done.wait(2)
+        background.start()
+        assert calls == [1]
+    finally:
+        stop.set()
@@ -0,0 +1,113 @@
+import os
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import channel_directory
+from utils import db_connect, migrate_db
+
+
+class FakeSlackClient:
+    def __init__(self, members):
+        self.members = members
+        self.failing = set()
+        self.calls = []
+
+    def conversations_list(self, **kwargs):
+        self.calls.append("conversations_list")
+        channels = [{"id": c, "is_member": True} for c in self.members]
+        channels.append({"id": "CNOTMEMBER", "is_member": False})
+        return {"channels": channels, "response_metadata": {"next_cursor": ""}}
+
+    def conversations_info(self, channel):
+        if channel in self.failing:
+            raise RuntimeError("boom")
+        return {"channel": {"id": channel, "name": f"name-{channel}", "is_private": channel.startswith("G")}}
+
+    def conversations_members(self, channel, limit, cursor=None):
+        self.calls.append(("conversations_members", channel, cursor))
+        users = self.members[channel]
+        # Due pagine per canale, per verificare la paginazione
+        if cursor is None:
+            return {"members": users[:1], "response_metadata": {"next_cursor": "next"}}
+        return {"members": users[1:], "response_metadata": {"next_cursor": ""}}
+
+
+def make_db(tmp_path):
+    path = str(tmp_path / "slack.sqlite")
+    conn, cursor = db_connect(path)
+    migrate_db(conn, cursor)
+    conn.close()
+    return path
+
+
+def members(path):
+    conn, _ = db_connect(path)
+    try:
+        return sorted(conn.execute("SELECT channel, user FROM members").fetchall())
+    finally:
+        conn.close()
+
+
+def test_refresh_writes_snapshot_and_replaces_members(tmp_path):
+    path = make_db(tmp_path)
+    client = FakeSlackClient({"C1": ["U1", "U2"], "G2": ["U3"]})
+
+    stats = channel_directory.refresh(client, path, max_workers=2, clock=lambda: 1000.0)
+    assert stats["channels"] == 2 and stats["failed"] == 0
+    assert members(path) == [("C1", "U1"), ("C1", "U2"), ("G2", "U3")]
+
+    client.members["C1"] = ["U2", "U4"]
+    stats = channel_directory.refresh(client, path, force=True, clock=lambda: 1001.0)
+    assert (stats["joined"], stats["left"]) == (1, 1)
+    assert members(path) == [("C1", "U2"), ("C1", "U4"), ("G2", "U3")]
+
+    conn, _ = db_connect(path)
+    assert conn.execute("SELECT is_private FROM channels WHERE id = 'G2'").fetchone()[0] == 1
+    assert channel_directory.snapshot_counts(conn) == (2, 3)
+    conn.close()
+
+
+def test_refresh_is_skipped_while_snapshot_is_fresh(tmp_path):
+    path = make_db(tmp_path)
+    client = FakeSlackClient({"C1": ["U1"]})
+    channel_directory.refresh(client, path, sync_ttl=60, clock=lambda: 1000.0)
+    client.calls.clear()
+
+    assert channel_directory.refresh(client, path, sync_ttl=60, clock=lambda: 1030.0) is None
+    assert client.calls == []
+    assert channel_directory.refresh(client, path, sync_ttl=60, clock=lambda: 1100.0) is not None
+
+
+def test_failed_channel_keeps_previous_snapshot(tmp_path):
+    path = make_db(tmp_path)
+    client = FakeSlackClient({"C1": ["U1"], "C2": ["U2"]})
+    channel_directory.refresh(client, path, clock=lambda: 1000.0)
+
+    client.members["C1"] = ["U9"]
+    client.failing.add("C2")
+    stats = channel_directory.refresh(client, path, force=True, clock=lambda: 1001.0)
+    assert (stats["channels"], stats["failed"], stats["joined"], stats["left"]) == (1, 1, 1, 1)
+    assert members(path) == [("C1", "U9"), ("C2", "U2")]
+
+
+def test_migration_deduplicates_legacy_members(tmp_path):
+    path = str(tmp_path / "legacy.sqlite")
+    conn, cursor = db_connect(path)
+    cursor.execute("CREATE TABLE members (channel TEXT, user TEXT)")
+    cursor.executemany(
+        "INSERT INTO members VALUES (?, ?)",
+        [("C1", "U1"), ("C1", "U1"), ("C1", "U2"), ("C1", "U1"), (None, "U3")],
+    )
+    conn.commit()
+
+    migrate_db(conn, cursor)
+    migrate_db(conn, cursor)
+
+    assert sorted(conn.execute("SELECT channel, user FROM members").fetchall()) == [("C1", "U1"), ("C1", "U2")]
+    conn.execute("INSERT OR IGNORE INTO members VALUES ('C1', 'U1')")
+    assert conn.execute("SELECT COUNT(*) FROM members").fetchone()[0] == 2
+    conn.close()
@@ -0,0 +1,94 @@
+import os
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+from clown_index import GENERATION_SCOPE, ClownIndex, parse_expiry, sweep_expired
+from utils import bump_generation, get_generation, migrate_db
+
+NOW = datetime(2025, 1, 1, 12, 0, 0)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    migrate_db(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+def _add(conn, nickname, expiry):
+    conn.execute("INSERT OR REPLACE INTO clown_users (nickname, expiry_date) VALUES (?, ?)", (nickname, expiry))
+    bump_generation(conn, GENERATION_SCOPE)
+    conn.commit()
+
+
+def test_parse_expiry_formats():
+    assert parse_expiry("2025-01-01T12:00:00") == NOW
+    assert parse_expiry("2025-01-01 12:00:00") == NOW
+    assert parse_expiry("domani") is None
+    assert parse_expiry(None) is None
+
+
+def test_lookup_respects_priority_and_expiry(conn):
+    _add(conn, "mario", (NOW + timedelta(hours=1)).isoformat())
+    _add(conn, "luigi", (NOW + timedelta(hours=2)).isoformat())
+    index = ClownIndex()
+    index.sync(conn)
+
+    assert index.lookup(["luigi", "mario"], now=NOW)[0] == "luigi"
+    assert index.lookup(["peach"], now=NOW) is None
+    assert index.lookup(["mario"], now=NOW + timedelta(hours=1, seconds=1)) is None
+    assert len(index) == 1
+
+
+def test_reload_only_when_generation_changes(conn):
+    clock = FakeClock()
+    index = ClownIndex(check_interval=2.0, clock=clock)
+    index.sync(conn)
+    assert len(index) == 0
+
+    _add(conn, "mario", (NOW + timedelta(hours=1)).isoformat())
+    clock.now = 1.0
+    index.sync(conn)
+    assert len(index) == 0
+
+    clock.now = 2.5
+    index.sync(conn)
+    assert index.lookup(["mario"], now=NOW) is not None
+
+
+def test_rows_changed_without_bump_are_not_seen(conn):
+    index = ClownIndex(check_interval=0)
+    index.sync(conn)
+    conn.execute("INSERT INTO clown_users (nickname, expiry_date) VALUES ('mario', '2099-01-01T00:00:00')")
+    conn.commit()
+    index.sync(conn)
+    assert len(index) == 0
+
+
+def test_sweep_removes_expired_and_bumps_generation(conn):
+    _add(conn, "mario", (NOW - timedelta(minutes=1)).isoformat())
+    _add(conn, "luigi", (NOW + timedelta(hours=1)).isoformat())
+    _add(conn, "rotto", "non una data")
+    generation = get_generation(conn, GENERATION_SCOPE)
+
+    assert sorted(sweep_expired(conn, now=NOW)) == ["mario", "rotto"]
+    assert get_generation(conn, GENERATION_SCOPE) == generation + 1
+    assert sweep_expired(conn, now=NOW) == []
+    assert get_generation(conn, GENERATION_SCOPE) == generation + 1
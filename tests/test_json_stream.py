@@ -0,0 +1,63 @@
+import gzip
+import json
+import os
+import sqlite3
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+import json_stream
+from json_stream import choose_encoding, iter_json_array
+
+
+@pytest.fixture
+def rows():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE t (id INTEGER, name TEXT)")
+    conn.executemany("INSERT INTO t VALUES (?, ?)", [(i, f"nome è {i}") for i in range(500)])
+    yield conn.execute("SELECT * FROM t ORDER BY id")
+    conn.close()
+
+
+def test_identity_output_is_the_json_array(rows):
+    stats = {}
+    body = b"".join(iter_json_array(rows, stats=stats, chunk_bytes=1024))
+    data = json.loads(body)
+    assert data[0] == {"id": 0, "name": "nome è 0"}
+    assert len(data) == 500
+    assert stats["rows"] == 500
+    assert stats["raw_bytes"] == stats["sent_bytes"] == len(body)
+
+
+def test_gzip_output_decompresses_to_the_same_array(rows):
+    stats = {}
+    chunks = list(iter_json_array(rows, encoding="gzip", stats=stats, chunk_bytes=1024))
+    assert len(chunks) > 1
+    body = gzip.decompress(b"".join(chunks))
+    assert len(json.loads(body)) == 500
+    assert stats["raw_bytes"] == len(body)
+    assert stats["sent_bytes"] == sum(len(c) for c in chunks) < stats["raw_bytes"]
+
+
+def test_empty_result_is_an_empty_array():
+    assert b"".join(iter_json_array([])) == b"[]"
+    assert gzip.decompress(b"".join(iter_json_array([], encoding="gzip"))) == b"[]"
+
+
+def test_choose_encoding(monkeypatch):
+    monkeypatch.setattr(json_stream, "brotli", None)
+    assert choose_encoding(None) is None
+    assert choose_encoding("identity") is None
+    assert choose_encoding("gzip, deflate") == "gzip"
+    assert choose_encoding("br;q=1.0, gzip;q=0") is None
+    assert choose_encoding("*") == "gzip"
+
+    monkeypatch.setattr(json_stream, "brotli", object())
+    assert choose_encoding("gzip, deflate, br") == "br"
+    assert choose_encoding("gzip;q=1.0, br;q=0.5") == "gzip"
@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+import llm_cache
+from utils import migrate_db
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    migrate_db(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+def _key(query, digest_timestamp="2024-05-01T08:00:00"):
+    return llm_cache.make_cache_key("gpt-4o", llm_cache.prompt_hash("system", "template"), digest_timestamp, query)
+
+
+def test_normalize_query_ignores_case_spacing_and_trailing_punctuation():
+    assert llm_cache.normalize_query("  Chi ha parlato   di Rust?? ") == "chi ha parlato di rust"
+
+
+def test_equivalent_queries_share_the_same_key():
+    assert _key("Chi ha parlato di Rust?") == _key("chi ha parlato  di rust")
+
+
+def test_key_depends_on_digest_and_prompt():
+    assert _key("rust") != _key("rust", digest_timestamp="2024-05-02T08:00:00")
+    other_prompt = llm_cache.make_cache_key("gpt-4o", llm_cache.prompt_hash("system", "altro"), "2024-05-01T08:00:00", "rust")
+    assert _key("rust") != other_prompt
+
+
+def test_hit_after_store(conn):
+    key = _key("rust")
+    assert llm_cache.get_cached_response(conn, key, now=1000) is None
+
+    llm_cache.store_response(conn, key, "gpt-4o", "2024-05-01T08:00:00", "rust", "risposta", now=1000)
+
+    assert llm_cache.get_cached_response(conn, key, now=1001) == "risposta"
+    assert conn.execute("SELECT hits FROM llm_cache WHERE cache_key = ?", (key,)).fetchone()[0] == 1
+
+
+def test_expired_entries_are_dropped(conn):
+    key = _key("rust")
+    llm_cache.store_response(conn, key, "gpt-4o", "d", "rust", "risposta", ttl_seconds=60, now=1000)
+
+    assert llm_cache.get_cached_response(conn, key, ttl_seconds=60, now=1061) is None
+    assert conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0] == 0
+
+
+def test_size_limit_evicts_least_recently_used(conn):
+    for i, query in enumerate(["a", "b", "c"]):
+        llm_cache.store_response(conn, _key(query), "gpt-4o", "d", query, query.upper(), max_entries=2, now=1000 + i)
+
+    assert llm_cache.get_cached_response(conn, _key("a"), now=1010) is None
+    assert llm_cache.get_cached_response(conn, _key("b"), now=1010) == "B"
+    assert llm_cache.get_cached_response(conn, _key("c"), now=1010) == "C"
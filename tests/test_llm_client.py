@@ -0,0 +1,101 @@
+import os
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+import llm_client
+import metrics
+from utilities.openai_stub import start_stub_server
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    pytest.importorskip("openai")
+    server = start_stub_server(reply="ciao dallo stub")
+    monkeypatch.setenv("OPENAI_API_KEY", "stub")
+    monkeypatch.setenv("OPENAI_BASE_URL", server.base_url)
+    monkeypatch.setattr(llm_client, "_client", None)
+    monkeypatch.setattr(llm_client, "backoff_delay", lambda attempt, retry_after=None: 0)
+    metrics.reset()
+    yield server
+    server.shutdown()
+    llm_client._client = None
+
+
+def test_backoff_delay_grows_and_is_capped():
+    assert llm_client.backoff_delay(0, rng=lambda: 1.0) == llm_client.BACKOFF_BASE_SECONDS
+    assert llm_client.backoff_delay(2, rng=lambda: 1.0) == llm_client.BACKOFF_BASE_SECONDS * 4
+    assert llm_client.backoff_delay(20, rng=lambda: 1.0) == llm_client.BACKOFF_MAX_SECONDS
+    assert llm_client.backoff_delay(3, rng=lambda: 0.0) == 0
+
+
+def test_backoff_delay_honors_retry_after():
+    assert llm_client.backoff_delay(0, retry_after=3, rng=lambda: 0.0) == 3
+    assert llm_client.backoff_delay(0, retry_after=600, rng=lambda: 0.0) == llm_client.BACKOFF_MAX_SECONDS
+
+
+def test_is_configured(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    assert not llm_client.is_configured()
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    assert llm_client.is_configured()
+
+
+def test_client_is_shared(stub):
+    assert llm_client.get_client() is llm_client.get_client()
+
+
+def test_chat_completion_records_latency(stub):
+    response = llm_client.chat_completion(
+        "chat", model="gpt-4o", messages=[{"role": "user", "content": "ciao"}],
+    )
+    assert response.choices[0].message.content == "ciao dallo stub"
+
+    snapshot = metrics.snapshot()
+    assert snapshot["counters"]["openai.chat.chat.calls"] == 1
+    assert snapshot["histograms"]["openai.chat.chat.latency_seconds"]["count"] == 1
+
+
+def test_chat_completion_retries_server_errors(stub):
+    stub.stub_config["error_rate"] = 1.0
+    openai = pytest.importorskip("openai")
+
+    with pytest.raises((openai.RateLimitError, openai.InternalServerError)):
+        llm_client.chat_completion(
+            "mention", max_retries=2, model="gpt-4o", messages=[{"role": "user", "content": "ciao"}],
+        )
+
+    assert len(stub.stub_config["requests"]) == 3
+    counters = metrics.snapshot()["counters"]
+    assert counters["openai.mention.chat.retries"] == 2
+    assert counters["openai.mention.chat.errors"] == 3
+
+
+def test_timeouts_share_the_feature_deadline(stub, monkeypatch):
+    openai = pytest.importorskip("openai")
+    monkeypatch.setitem(llm_client.FEATURE_TIMEOUTS, "mention", 0.3)
+    stub.stub_config["latency"] = 1.0
+
+    with pytest.raises(openai.APITimeoutError):
+        llm_client.chat_completion(
+            "mention", max_retries=2, model="gpt-4o", messages=[{"role": "user", "content": "ciao"}],
+        )
+
+    # Il tentativo scaduto ha consumato la scadenza: niente retry
+    assert len(stub.stub_config["requests"]) == 1
+    counters = metrics.snapshot()["counters"]
+    assert counters["openai.mention.chat.deadline_exceeded"] == 1
+    assert "openai.mention.chat.retries" not in counters
+
+
+def test_timeout_for_is_capped_by_remaining_time():
+    pytest.importorskip("httpx")
+    assert llm_client.timeout_for("digest").read == llm_client.FEATURE_TIMEOUTS["digest"]
+    timeout = llm_client.timeout_for("digest", remaining=2.0)
+    assert timeout.read == 2.0
+    assert timeout.connect == 2.0
@@ -0,0 +1,52 @@
+import os
+import sqlite3
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import message_entities
+from utils import migrate_db
+
+
+def test_tokenize_counts_every_entity():
+    text = (
+        ":smile: ciao <@U123> e <@U456|mario> :smile::thumbsup::skin-tone-3: "
+        "vedi <#C42|generale> https://www.example.com/a?b=1 e http://docs.python.org/3/"
+    )
+    assert message_entities.tokenize(text) == {
+        ("emoji", "smile"): 2,
+        ("emoji", "thumbsup"): 1,
+        ("user", "U123"): 1,
+        ("user", "U456"): 1,
+        ("channel", "C42"): 1,
+        ("domain", "example.com"): 1,
+        ("domain", "docs.python.org"): 1,
+    }
+
+
+def test_tokenize_ignores_times_and_plain_text():
+    assert message_entities.tokenize("ci vediamo alle 10:30:00, ok?") == {}
+    assert message_entities.tokenize("") == {}
+    assert message_entities.tokenize(None) == {}
+
+
+def test_tokenize_marks_files():
+    text = f"guarda qui - {message_entities.FILE_MARKER}."
+    assert message_entities.tokenize(text) == {("file", "media"): 1}
+
+
+def test_record_replaces_and_forget_user_clears():
+    conn = sqlite3.connect(":memory:")
+    migrate_db(conn, conn.cursor())
+    conn.execute(
+        "INSERT INTO messages (message, user, channel, timestamp, permalink) VALUES (':wave: <@U2>', 'U1', 'C1', '1.000001', '')"
+    )
+    message_entities.record(conn, "C1", "1.000001", ":wave: <@U2>")
+    message_entities.record(conn, "C1", "1.000001", ":wave: :wave:")
+    assert conn.execute("SELECT kind, value, count FROM message_entities").fetchall() == [("emoji", "wave", 2)]
+
+    message_entities.forget_user(conn, "U1")
+    assert conn.execute("SELECT COUNT(*) FROM message_entities").fetchone() == (0,)
@@ -0,0 +1,34 @@
+import os
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import metrics
+
+
+def setup_function():
+    metrics.reset()
+
+
+def test_counters_accumulate():
+    metrics.incr("ai.calls")
+    metrics.incr("ai.calls", 2)
+
+    assert metrics.snapshot()["counters"] == {"ai.calls": 3}
+
+
+def test_histogram_buckets_and_summary():
+    metrics.observe("latency", 0.2)
+    metrics.observe("latency", 3.0)
+    metrics.observe("latency", 120.0)
+
+    hist = metrics.snapshot()["histograms"]["latency"]
+    assert hist["count"] == 3
+    assert hist["min"] == 0.2
+    assert hist["max"] == 120.0
+    assert hist["buckets"]["le_0.25"] == 1
+    assert hist["buckets"]["le_5"] == 1
+    assert hist["buckets"]["le_inf"] == 1
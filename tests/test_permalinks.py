@@ -0,0 +1,103 @@
+import os
+import random
+import sqlite3
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import archive_index
+from permalinks import LinkCache, build_permalink, resolve_link, verify_sample, workspace_url
+from utils import migrate_db
+
+BASE = "https://sferait-ws.slack.com/"
+
+
+def test_workspace_url_from_auth_test():
+    assert workspace_url({"url": "https://sferait-ws.slack.com/"}) == BASE
+    assert workspace_url({"url": "https://sferait-ws.slack.com"}) == BASE
+
+
+def test_build_permalink_for_root_and_reply():
+    assert build_permalink(BASE, "C123", "1700000000.000100") == (
+        "https://sferait-ws.slack.com/archives/C123/p1700000000000100"
+    )
+    assert build_permalink(BASE, "C123", "1700000001.000200", "1700000000.000100") == (
+        "https://sferait-ws.slack.com/archives/C123/p1700000001000200"
+        "?thread_ts=1700000000.000100&cid=C123"
+    )
+    assert build_permalink(BASE, "C123", "1700000000.000100", "1700000000.000100").endswith("p1700000000000100")
+    assert build_permalink("", "C123", "1700000000.000100") == ""
+
+
+class FakeSlackClient:
+    def chat_getPermalink(self, channel, message_ts):
+        return {"permalink": build_permalink(BASE, channel, message_ts) + "?fixed=1"}
+
+
+def test_verify_sample_corrects_mismatches():
+    conn = sqlite3.connect(":memory:")
+    migrate_db(conn, conn.cursor())
+    conn.execute(
+        "INSERT INTO messages (message, user, channel, timestamp, permalink, thread_ts) VALUES ('x', 'U1', 'C1', '1.000001', 'vecchio', '1.000001')"
+    )
+    conn.execute(
+        "INSERT INTO messages (message, user, channel, timestamp, permalink, thread_ts) VALUES ('y', 'U1', 'C1', '2.000001', '', '2.000001')"
+    )
+
+    assert verify_sample(conn, FakeSlackClient(), BASE, sample_size=5, rng=random.Random(0)) == (1, 1)
+    assert conn.execute("SELECT permalink FROM messages WHERE timestamp = '1.000001'").fetchone()[0].endswith("?fixed=1")
+
+
+def _add(conn, channel, ts, thread_ts, permalink=""):
+    conn.execute(
+        "INSERT INTO messages (message, user, channel, timestamp, permalink, thread_ts) VALUES ('x', 'U1', ?, ?, ?, ?)",
+        (channel, ts, permalink, thread_ts),
+    )
+    archive_index.record_message(conn, channel, ts, thread_ts)
+
+
+def test_resolve_link_uses_first_reply_of_thread_with_empty_root():
+    conn = sqlite3.connect(":memory:")
+    migrate_db(conn, conn.cursor())
+    # Come in archivebot: la radice ha il permalink vuoto, le risposte no
+    _add(conn, "C1", "1700000000.000100", "1700000000.000100")
+    _add(conn, "C1", "1700000005.000100", "1700000000.000100", permalink="https://archiviato/prima-risposta")
+    _add(conn, "C1", "1700000009.000100", "1700000000.000100", permalink="https://archiviato/seconda-risposta")
+
+    assert resolve_link(conn, "1700000000.000100", BASE) == "https://archiviato/prima-risposta"
+    assert resolve_link(conn, "1700000009.000100", BASE) == "https://archiviato/seconda-risposta"
+    assert resolve_link(conn, "1700000099.000100", BASE) is None
+
+
+def test_resolve_link_synthesizes_reply_link_when_nothing_is_stored():
+    conn = sqlite3.connect(":memory:")
+    migrate_db(conn, conn.cursor())
+    _add(conn, "C1", "1700000000.000100", "1700000000.000100")
+    _add(conn, "C1", "1700000005.000100", "1700000000.000100")
+    # Thread di cui abbiamo solo le risposte
+    _add(conn, "C2", "1700000011.000100", "1700000010.000100")
+
+    assert resolve_link(conn, "1700000000.000100", BASE) == build_permalink(
+        BASE, "C1", "1700000005.000100", "1700000000.000100"
+    )
+    assert resolve_link(conn, "1700000010.000100", BASE) == build_permalink(
+        BASE, "C2", "1700000011.000100", "1700000010.000100"
+    )
+    assert resolve_link(conn, "1700000005.000100", BASE) == build_permalink(
+        BASE, "C1", "1700000005.000100", "1700000000.000100"
+    )
+    assert resolve_link(conn, "1700000005.000100", "") is None
+
+
+def test_link_cache_evicts_least_recently_used():
+    cache = LinkCache(max_entries=2)
+    cache.put("1", "a")
+    cache.put("2", "b")
+    assert cache.get("1") == "a"
+    cache.put("3", "c")
+    assert cache.get("2") is None
+    assert cache.get("1") == "a"
+    assert len(cache) == 2
@@ -0,0 +1,65 @@
+import os
+import sqlite3
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+import rate_limiter
+from utils import migrate_db
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    migrate_db(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+def test_minute_limit_and_retry_after(conn):
+    assert rate_limiter.check_and_consume(conn, "U1", now=1000.0)["allowed"]
+    second = rate_limiter.check_and_consume(conn, "U1", now=1010.0)
+    assert second["allowed"]
+    assert second["counts"] == {60: 2, 3600: 2}
+
+    third = rate_limiter.check_and_consume(conn, "U1", now=1020.0)
+    assert not third["allowed"]
+    assert third["window"] == 60
+    assert third["retry_after"] == pytest.approx(40.0)
+    assert third["counts"] == {60: 2, 3600: 2}
+
+    assert rate_limiter.check_and_consume(conn, "U1", now=1061.0)["allowed"]
+
+
+def test_hour_limit(conn):
+    for i in range(10):
+        assert rate_limiter.check_and_consume(conn, "U1", now=1000.0 + i * 100)["allowed"]
+
+    decision = rate_limiter.check_and_consume(conn, "U1", now=2000.0)
+    assert not decision["allowed"]
+    assert decision["window"] == 3600
+    assert decision["retry_after"] == pytest.approx(2600.0)
+
+
+def test_users_are_independent_and_rows_stay_small(conn):
+    for i in range(50):
+        rate_limiter.check_and_consume(conn, "U1", now=1000.0 + i * 400)
+    assert rate_limiter.check_and_consume(conn, "U2", now=1000.0)["allowed"]
+
+    assert conn.execute("SELECT COUNT(*) FROM ai_rate_limits").fetchone()[0] == 2
+    stamps = conn.execute("SELECT stamps FROM ai_rate_limits WHERE user_id = 'U1'").fetchone()[0]
+    assert len(stamps.split(",")) <= 10
+
+
+def test_rejected_requests_are_not_consumed(conn):
+    rate_limiter.check_and_consume(conn, "U1", now=1000.0)
+    rate_limiter.check_and_consume(conn, "U1", now=1001.0)
+    for i in range(5):
+        rate_limiter.check_and_consume(conn, "U1", now=1002.0 + i)
+
+    assert rate_limiter.check_and_consume(conn, "U1", now=1061.0)["counts"][3600] == 3
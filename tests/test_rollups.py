@@ -0,0 +1,152 @@
+import os
+import sqlite3
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+import message_entities
+import rollups
+from utils import migrate_db
+
+DAY1 = 1700000000  # 2023-11-14 22:13 UTC
+DAY2 = DAY1 + 86400
+
+
+def ts(seconds):
+    return f"{seconds:.6f}"
+
+
+def insert(conn, seconds, text="ciao mondo", user="U1", channel="C1"):
+    conn.execute(
+        "INSERT INTO messages (message, user, channel, timestamp, permalink, thread_ts) VALUES (?, ?, ?, ?, '', NULL)",
+        (text, user, channel, ts(seconds)),
+    )
+    message_entities.record(conn, channel, ts(seconds), text)
+
+
+def snapshot(conn):
+    return {
+        table: conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2").fetchall()
+        for table in rollups.ROLLUP_TABLES + ("rollup_users",)
+    }
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    migrate_db(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+def test_run_follows_the_watermark(conn):
+    insert(conn, DAY1, "uno due tre")
+    insert(conn, DAY1 + 60, ":smile: ciao :wave:", user="U2", channel="C2")
+    assert rollups.run(conn) == 1
+    assert conn.execute("SELECT * FROM rollup_user_day ORDER BY user").fetchall() == [
+        ("2023-11-14", "U1", 1, 3, 0),
+        ("2023-11-14", "U2", 1, 3, 0),
+    ]
+    assert conn.execute("SELECT * FROM rollup_hour_day").fetchall() == [("2023-11-14", 22, 2)]
+    assert conn.execute("SELECT * FROM rollup_emoji_day ORDER BY emoji").fetchall() == [
+        ("2023-11-14", "smile", 1),
+        ("2023-11-14", "wave", 1),
+    ]
+    assert rollups.run(conn) == 0
+
+    insert(conn, DAY2, f" - {message_entities.FILE_MARKER}.")
+    assert rollups.run(conn) == 1
+    assert conn.execute("SELECT images FROM rollup_user_day WHERE day = '2023-11-15'").fetchone() == (1,)
+    assert conn.execute("SELECT last_ts FROM rollup_users WHERE user = 'U1'").fetchone() == (ts(DAY2),)
+
+
+def test_redelivery_does_not_double_count_and_matches_backfill(conn):
+    insert(conn, DAY1)
+    rollups.run(conn)
+    # Slack riconsegna lo stesso messaggio: la riga viene sostituita con un rowid nuovo
+    insert(conn, DAY1)
+    insert(conn, DAY1 + 10, user="U2")
+    rollups.run(conn)
+    assert conn.execute("SELECT SUM(messages) FROM rollup_channel_day").fetchone() == (2,)
+
+    incremental = snapshot(conn)
+    rollups.backfill(conn)
+    assert snapshot(conn) == incremental
+
+
+def test_dirty_days_pick_up_updates(conn):
+    insert(conn, DAY1, "uno")
+    insert(conn, DAY2, "due", user="U2")
+    rollups.run(conn)
+
+    conn.execute("UPDATE messages SET message = 'uno due tre' WHERE timestamp = ?", (ts(DAY1),))
+    rollups.mark_dirty(conn, [rollups.day_of(DAY1)])
+    rollups.mark_user_dirty(conn, "U2")
+    conn.execute("UPDATE messages SET user = 'USLACKBOT' WHERE user = 'U2'")
+    assert rollups.run(conn) == 2
+
+    assert conn.execute("SELECT words FROM rollup_user_day WHERE user = 'U1'").fetchone() == (3,)
+    assert conn.execute("SELECT user FROM rollup_user_day WHERE day = '2023-11-15'").fetchall() == [("USLACKBOT",)]
+    assert conn.execute("SELECT 1 FROM rollup_users WHERE user = 'U2'").fetchone() is None
+    assert conn.execute("SELECT COUNT(*) FROM rollup_dirty_days").fetchone() == (0,)
+
+
+def test_migration_backfills_existing_messages():
+    conn = sqlite3.connect(":memory:")
+    migrate_db(conn, conn.cursor())
+    conn.execute("DROP TABLE rollup_watermark")
+    insert(conn, DAY1)
+    migrate_db(conn, conn.cursor())
+    assert conn.execute("SELECT * FROM rollup_channel_day").fetchall() == [("2023-11-14", "C1", 1)]
+    assert rollups.watermark(conn) == conn.execute("SELECT MAX(rowid) FROM messages").fetchone()[0]
+
+
+def test_since_day():
+    assert rollups.since_day(1, now=DAY2) == "2023-11-14"
+    assert rollups.since_day(0, now=DAY2) == "2023-11-15"
+
+
+@pytest.mark.parametrize("had_rollups", [False, True])
+def test_migration_backfills_entities_for_stats(had_rollups):
+    conn = sqlite3.connect(":memory:")
+    migrate_db(conn, conn.cursor())
+    # Archivio esistente prima di message_entities (con o senza le rollup di /stats)
+    conn.execute("DROP TABLE message_entities")
+    conn.execute("DROP TABLE message_entities_backfill")
+    if not had_rollups:
+        conn.execute("DROP TABLE rollup_watermark")
+    conn.execute(
+        "INSERT INTO messages (message, user, channel, timestamp, permalink) VALUES (?, 'U1', 'C1', ?, '')",
+        (":smile: ciao :smile: :wave:", ts(DAY1)),
+    )
+    conn.execute(
+        "INSERT INTO messages (message, user, channel, timestamp, permalink) VALUES (?, 'U2', 'C1', ?, '')",
+        (f"foto - {message_entities.FILE_MARKER}.", ts(DAY1 + 60)),
+    )
+    if had_rollups:
+        # Conteggi già calcolati dalle rollup senza entità
+        conn.execute("INSERT INTO rollup_emoji_day (day, emoji, uses) VALUES ('2023-11-14', 'smile', 1)")
+        conn.execute("INSERT INTO rollup_user_day (day, user, messages, words, images) VALUES ('2023-11-14', 'U2', 1, 1, 0)")
+    conn.commit()
+
+    migrate_db(conn, conn.cursor())
+
+    # Le query di /stats leggono queste tabelle
+    assert conn.execute("SELECT emoji, SUM(uses) FROM rollup_emoji_day GROUP BY emoji ORDER BY emoji").fetchall() == [
+        ("smile", 2),
+        ("wave", 1),
+    ]
+    assert conn.execute("SELECT user, SUM(images) FROM rollup_user_day GROUP BY user ORDER BY user").fetchall() == [
+        ("U1", 0),
+        ("U2", 1),
+    ]
+
+    # Il backfill è una tantum
+    conn.execute("DELETE FROM message_entities")
+    migrate_db(conn, conn.cursor())
+    assert conn.execute("SELECT COUNT(*) FROM message_entities").fetchone() == (0,)
@@ -0,0 +1,34 @@
+import os
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import route_limits
+
+
+def test_limiter_caps_each_group_independently():
+    limiter = route_limits.RouteLimiter({"llm": 2, "digest": 1})
+    assert limiter.try_acquire("llm")
+    assert limiter.try_acquire("llm")
+    assert not limiter.try_acquire("llm")
+    assert limiter.try_acquire("digest")
+    assert not limiter.try_acquire("digest")
+    assert limiter.in_flight("llm") == 2
+
+    limiter.release("llm")
+    assert limiter.try_acquire("llm")
+
+
+def test_release_never_goes_negative():
+    limiter = route_limits.RouteLimiter({"llm": 1})
+    limiter.release("llm")
+    assert limiter.in_flight("llm") == 0
+    assert limiter.try_acquire("llm")
+    assert not limiter.try_acquire("llm")
+
+
+def test_reserved_threads():
+    assert route_limits.reserved_threads({"llm": 2, "digest": 1}) == route_limits.THREADS - 3
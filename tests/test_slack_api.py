@@ -0,0 +1,110 @@
+import os
+import sys
+import threading
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+pytest.importorskip("slack_sdk")
+
+import metrics
+from slack_api import RateLimitedSlackClient, TokenBucket
+from utilities.slack_stub import start_stub_server
+
+
+@pytest.fixture
+def stub():
+    server = start_stub_server()
+    metrics.reset()
+    yield server
+    server.shutdown()
+
+
+def make_client(server, **kwargs):
+    kwargs.setdefault("sleep", lambda seconds: None)
+    return RateLimitedSlackClient(token="xoxb-stub", base_url=server.base_url, **kwargs)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_allows_burst_then_waits():
+    clock = FakeClock()
+    bucket = TokenBucket(60, burst=2, clock=clock)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(1.0)
+    clock.now = 10.0
+    assert bucket.reserve() == 0
+    bucket.block(5)
+    assert bucket.reserve() == pytest.approx(5.0)
+
+
+def test_idempotent_reads_are_cached(stub):
+    client = make_client(stub)
+    first = client.users_info(user="U1")
+    second = client.users_info(user="U1")
+    client.users_info(user="U2")
+
+    assert first["user"]["id"] == second["user"]["id"] == "U1"
+    assert stub.stub_config["calls"]["users.info"] == 2
+    assert metrics.snapshot()["counters"]["slack.users.info.cache_hits"] == 1
+
+
+def test_writes_invalidate_channel_reads(stub):
+    client = make_client(stub)
+    client.conversations_replies(channel="C1", ts="1.000001")
+    client.conversations_replies(channel="C2", ts="1.000001")
+    client.chat_postMessage(channel="C1", text="ciao")
+    client.conversations_replies(channel="C1", ts="1.000001")
+    client.conversations_replies(channel="C2", ts="1.000001")
+
+    assert stub.stub_config["calls"]["conversations.replies"] == 3
+    assert stub.stub_config["calls"]["chat.postMessage"] == 1
+
+
+def test_identical_in_flight_reads_are_coalesced(stub):
+    stub.stub_config["latency"] = 0.2
+    client = make_client(stub)
+    results = []
+
+    def read():
+        results.append(client.conversations_info(channel="C1")["channel"]["id"])
+
+    threads = [threading.Thread(target=read) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["C1"] * 5
+    assert stub.stub_config["calls"]["conversations.info"] == 1
+
+
+def test_rate_limited_calls_are_retried(stub):
+    from slack_sdk.errors import SlackApiError
+
+    stub.stub_config["error_rate"] = 1.0
+    waits = []
+    client = make_client(stub, sleep=waits.append, max_retries=2)
+    with pytest.raises(SlackApiError):
+        client.reactions_add(channel="C1", timestamp="1.000001", name="eyes")
+
+    assert stub.stub_config["calls"]["reactions.add"] == 3
+    counters = metrics.snapshot()["counters"]
+    assert counters["slack.reactions.add.rate_limited"] == 2
+    assert counters["slack.reactions.add.errors"] == 1
+    assert waits and all(w >= 0.9 for w in waits)
+
+    stub.stub_config["error_rate"] = 0.0
+    assert client.reactions_add(channel="C1", timestamp="1.000001", name="eyes")["ok"]
+    assert metrics.snapshot()["histograms"]["slack.reactions.add.latency_seconds"]["count"] == 4
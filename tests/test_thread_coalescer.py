@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+import thread_coalescer
+from utils import migrate_db
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "slack.sqlite")
+    conn = sqlite3.connect(path)
+    migrate_db(conn, conn.cursor())
+    conn.close()
+    return path
+
+
+def test_only_one_leader_per_thread(db_path):
+    leader = sqlite3.connect(db_path)
+    follower = sqlite3.connect(db_path)
+
+    assert thread_coalescer.try_acquire(leader, "C1", "1.0", "a", now=100.0)
+    assert not thread_coalescer.try_acquire(follower, "C1", "1.0", "b", now=101.0)
+    assert not thread_coalescer.try_acquire(follower, "C1", "1.0", "c", now=101.5)
+    assert thread_coalescer.try_acquire(follower, "C1", "2.0", "b", now=101.0)
+
+    assert thread_coalescer.begin_generation(leader, "C1", "1.0", "a", now=104.0) == 3
+    assert not thread_coalescer.complete(leader, "C1", "1.0", "a")
+    assert thread_coalescer.try_acquire(follower, "C1", "1.0", "b", now=110.0)
+
+
+def test_messages_during_generation_trigger_another_round(db_path):
+    leader = sqlite3.connect(db_path)
+    follower = sqlite3.connect(db_path)
+
+    thread_coalescer.try_acquire(leader, "C1", "1.0", "a", now=100.0)
+    assert thread_coalescer.begin_generation(leader, "C1", "1.0", "a", now=102.0) == 1
+    thread_coalescer.try_acquire(follower, "C1", "1.0", "b", now=103.0)
+
+    assert thread_coalescer.complete(leader, "C1", "1.0", "a")
+    assert thread_coalescer.begin_generation(leader, "C1", "1.0", "a", now=106.0) == 1
+    assert not thread_coalescer.complete(leader, "C1", "1.0", "a")
+
+
+def test_expired_lease_can_be_taken_over(db_path):
+    conn = sqlite3.connect(db_path)
+    thread_coalescer.try_acquire(conn, "C1", "1.0", "dead", now=100.0)
+    assert thread_coalescer.try_acquire(conn, "C1", "1.0", "b", now=100.0 + thread_coalescer.LEASE_SECONDS + 1)
+
+
+def test_wait_for_quiet_extends_on_new_events_up_to_max_wait(db_path):
+    conn = sqlite3.connect(db_path)
+    clock = {"now": 100.0}
+    thread_coalescer.try_acquire(conn, "C1", "1.0", "a", now=100.0)
+
+    def sleep(seconds):
+        clock["now"] += seconds
+        if clock["now"] < 103.0:
+            conn.execute("UPDATE reply_leases SET last_event_at = ?", (clock["now"],))
+            conn.commit()
+
+    thread_coalescer.wait_for_quiet(conn, "C1", "1.0", debounce=2.0, max_wait=10.0,
+                                    clock=lambda: clock["now"], sleep=sleep)
+    assert clock["now"] == pytest.approx(104.0)
+
+    clock["now"] = 200.0
+    conn.execute("UPDATE reply_leases SET last_event_at = 200.0")
+    conn.commit()
+    thread_coalescer.wait_for_quiet(conn, "C1", "1.0", debounce=50.0, max_wait=5.0,
+                                    clock=lambda: clock["now"], sleep=sleep)
+    assert clock["now"] == pytest.approx(205.0)
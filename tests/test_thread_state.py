@@ -0,0 +1,95 @@
+import os
+import sqlite3
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+import thread_state
+from utils import migrate_db
+
+ROOT_TS = "1700000000.000100"
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    migrate_db(conn, conn.cursor())
+    yield conn
+    conn.close()
+
+
+def _msg(ts, user="Alice", user_id="U1", text="ciao"):
+    return {"user": user, "user_id": user_id, "text": text, "ts": ts}
+
+
+def test_append_is_ignored_until_seeded(conn):
+    assert thread_state.load(conn, "C1", ROOT_TS) is None
+    assert not thread_state.append(conn, "C1", ROOT_TS, "1700000001.000100", "U1", "Alice", "ciao")
+
+
+def test_seed_then_append_in_order(conn):
+    thread_state.seed(conn, "C1", ROOT_TS, [_msg(ROOT_TS, text="root")])
+    thread_state.append(conn, "C1", ROOT_TS, "1700000002.000100", "UBOT", "bot", "risposta")
+    thread_state.append(conn, "C1", ROOT_TS, "1700000001.000100", "U2", "Bob", "domanda")
+    thread_state.append(conn, "C1", ROOT_TS, "1700000001.000100", "U2", "Bob", "domanda")
+
+    messages = thread_state.load(conn, "C1", ROOT_TS)
+    assert [m["text"] for m in messages] == ["root", "domanda", "risposta"]
+    assert messages[1] == _msg("1700000001.000100", user="Bob", user_id="U2", text="domanda")
+
+
+def test_window_keeps_root_and_latest_messages(conn):
+    thread_state.seed(conn, "C1", ROOT_TS, [_msg(ROOT_TS, text="root")], window=2)
+    for i in range(1, 5):
+        thread_state.append(conn, "C1", ROOT_TS, f"170000000{i}.000100", "U1", "Alice", f"m{i}", window=2)
+
+    assert [m["text"] for m in thread_state.load(conn, "C1", ROOT_TS)] == ["root", "m3", "m4"]
+
+
+def test_edit_delete_and_drop(conn):
+    thread_state.seed(conn, "C1", ROOT_TS, [_msg(ROOT_TS, text="root"), _msg("1700000001.000100", text="prima")])
+    thread_state.update_text(conn, "C1", "1700000001.000100", "dopo")
+    assert thread_state.load(conn, "C1", ROOT_TS)[1]["text"] == "dopo"
+
+    thread_state.remove(conn, "C1", "1700000001.000100")
+    assert len(thread_state.load(conn, "C1", ROOT_TS)) == 1
+
+    thread_state.drop(conn, "C1", ROOT_TS)
+    assert thread_state.load(conn, "C1", ROOT_TS) is None
+
+
+def test_append_event_keeps_mentions_before_bot_reply(conn):
+    thread_state.seed(conn, "C1", ROOT_TS, [_msg(ROOT_TS, text="root")])
+    mention = {
+        "channel": "C1",
+        "thread_ts": ROOT_TS,
+        "ts": "1700000001.000100",
+        "user": "U2",
+        "text": "<@UBOT> cosa ne pensi?",
+    }
+    assert thread_state.append_event(conn, mention, lambda user: "Bob")
+    # La risposta del bot arriva da save_bot_reply
+    thread_state.append(conn, "C1", ROOT_TS, "1700000002.000100", "UBOT", "bot", "risposta")
+
+    messages = thread_state.load(conn, "C1", ROOT_TS)
+    assert [(m["user"], m["text"]) for m in messages] == [
+        ("Alice", "root"),
+        ("Bob", "<@UBOT> cosa ne pensi?"),
+        ("bot", "risposta"),
+    ]
+
+
+def test_append_event_skips_unseeded_threads_and_roots(conn):
+    def resolve_name(user):
+        raise AssertionError("non serve risolvere il nome")
+
+    message = {"channel": "C1", "thread_ts": ROOT_TS, "ts": "1700000001.000100", "user": "U2", "text": "ciao"}
+    assert not thread_state.append_event(conn, message, resolve_name)
+    thread_state.seed(conn, "C1", ROOT_TS, [_msg(ROOT_TS, text="root")])
+    assert not thread_state.append_event(conn, {**message, "ts": ROOT_TS}, resolve_name)
+    assert not thread_state.append_event(conn, {**message, "user": "USLACKBOT"}, resolve_name)
@@ -0,0 +1,109 @@
+import os
+import sqlite3
+import sys
+
+# Ensure project root is importable
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+import pytest
+
+from user_directory import UserDirectory, user_row
+from utils import migrate_db
+
+
+def _member(user_id, display_name="", real_name="Nome", deleted=False):
+    return {
+        "id": user_id,
+        "deleted": deleted,
+        "profile": {"display_name": display_name, "real_name": real_name, "email": f"{user_id}@example.com"},
+    }
+
+
+class FakeSlackClient:
+    def __init__(self, members, page_size=2):
+        self.members = members
+        self.page_size = page_size
+        self.calls = []
+
+    def users_list(self, limit=200, cursor=None):
+        self.calls.append(("users_list", cursor))
+        start = int(cursor or 0)
+        end = start + self.page_size
+        next_cursor = str(end) if end < len(self.members) else ""
+        return {"members": self.members[start:end], "response_metadata": {"next_cursor": next_cursor}}
+
+    def users_info(self, user):
+        self.calls.append(("users_info", user))
+        for member in self.members:
+            if member["id"] == user:
+                return {"user": member}
+        raise RuntimeError("user_not_found")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "slack.sqlite")
+    conn = sqlite3.connect(path)
+    migrate_db(conn, conn.cursor())
+    conn.close()
+    return path
+
+
+def test_user_row_prefers_display_name():
+    assert user_row(_member("U1", display_name="mario"))[0] == "mario"
+    assert user_row(_member("U1", real_name="Mario Rossi"))[0] == "Mario Rossi"
+
+
+def test_sync_paginates_and_writes_only_diffs(db_path):
+    members = [_member("U1", "a"), _member("U2", "b"), _member("U3", "c")]
+    client = FakeSlackClient(members)
+    clock = FakeClock()
+    directory = UserDirectory(client, db_path, sync_ttl=3600, clock=clock)
+
+    assert directory.sync() == {"pages": 2, "added": 3, "changed": 0, "total": 3}
+
+    members[1] = _member("U2", "b2")
+    clock.now += 10
+    assert directory.sync() is None
+    assert directory.sync(force=True) == {"pages": 2, "added": 0, "changed": 1, "total": 3}
+
+
+def test_sync_is_skipped_while_another_worker_holds_the_lease(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO sync_state (name, owner, lease_until) VALUES ('users', 'other', 99999)")
+    conn.commit()
+    client = FakeSlackClient([_member("U1")])
+
+    assert UserDirectory(client, db_path, clock=FakeClock()).sync(force=True) is None
+    assert client.calls == []
+
+
+def test_ensure_user_and_display_name_cache(db_path):
+    client = FakeSlackClient([_member("U1", display_name="mario")])
+    clock = FakeClock()
+    directory = UserDirectory(client, db_path, name_cache_ttl=60, clock=clock)
+
+    assert directory.display_name("U1") == "mario"
+    assert directory.display_name("U1") == "mario"
+    assert client.calls == [("users_info", "U1")]
+    assert directory.display_name("U404") == "utente"
+
+
+def test_apply_user_change_updates_row_and_cache(db_path):
+    client = FakeSlackClient([_member("U1", display_name="mario")])
+    directory = UserDirectory(client, db_path, clock=FakeClock())
+    directory.display_name("U1")
+
+    directory.apply_user_change(_member("U1", display_name="super mario"))
+
+    assert directory.display_name("U1") == "super mario"
@@ -0,0 +1,115 @@
+"""Single-flight e debounce per thread delle risposte nei thread ingaggiati.
+
+Un solo worker alla volta (il "leader") genera la risposta di un thread: chi
+riceve un messaggio mentre il lease è attivo si limita a incrementare
+`pending` e ritorna. Il leader aspetta una finestra di quiete (nessun nuovo
+messaggio per `debounce` secondi, al massimo `max_wait`), genera una risposta
+che copre tutti i messaggi raccolti e, se nel frattempo ne sono arrivati
+altri, ripete. Lo stato è nella tabella `reply_leases`, condivisa tra i worker.
+"""
+
+import os
+import time
+from contextlib import contextmanager
+
+DEBOUNCE_SECONDS = float(os.environ.get("ENGAGE_COALESCE_WINDOW_SECONDS", 2.0))
+MAX_WAIT_SECONDS = float(os.environ.get("ENGAGE_COALESCE_MAX_WAIT_SECONDS", 8.0))
+# Oltre questo tempo il lease di un leader morto può essere preso da un altro worker
+LEASE_SECONDS = 180.0
+
+
+@contextmanager
+def _immediate(conn):
+    """Transazione con lock di scrittura preso subito (check-and-set atomico tra processi)."""
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except Exception:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def try_acquire(conn, channel, thread_ts, owner, now=None):
+    """True se `owner` diventa leader del thread, False se un altro leader coprirà il messaggio."""
+    now = now if now is not None else time.time()
+    with _immediate(conn):
+        row = conn.execute(
+            "SELECT owner, lease_until FROM reply_leases WHERE channel = ? AND thread_ts = ?",
+            (channel, thread_ts),
+        ).fetchone()
+        if row is not None and row[0] != owner and row[1] > now:
+            conn.execute(
+                "UPDATE reply_leases SET pending = pending + 1, last_event_at = ? WHERE channel = ? AND thread_ts = ?",
+                (now, channel, thread_ts),
+            )
+            return False
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO reply_leases (channel, thread_ts, owner, lease_until, pending, last_event_at)
+            VALUES (?, ?, ?, ?, 1, ?)
+            """,
+            (channel, thread_ts, owner, now + LEASE_SECONDS, now),
+        )
+        return True
+
+
+def wait_for_quiet(conn, channel, thread_ts, debounce=DEBOUNCE_SECONDS, max_wait=MAX_WAIT_SECONDS,
+                   clock=time.time, sleep=time.sleep):
+    """Attende che il thread resti fermo per `debounce` secondi (al massimo `max_wait`)."""
+    deadline = clock() + max_wait
+    while True:
+        row = conn.execute(
+            "SELECT last_event_at FROM reply_leases WHERE channel = ? AND thread_ts = ?",
+            (channel, thread_ts),
+        ).fetchone()
+        conn.commit()
+        if row is None:
+            return
+        now = clock()
+        wake_at = min(row[0] + debounce, deadline)
+        if now >= wake_at:
+            return
+        sleep(wake_at - now)
+
+
+def begin_generation(conn, channel, thread_ts, owner, now=None):
+    """Azzera `pending` e rinnova il lease. Ritorna quanti messaggi copre questa generazione."""
+    now = now if now is not None else time.time()
+    with _immediate(conn):
+        row = conn.execute(
+            "SELECT pending FROM reply_leases WHERE channel = ? AND thread_ts = ? AND owner = ?",
+            (channel, thread_ts, owner),
+        ).fetchone()
+        conn.execute(
+            "UPDATE reply_leases SET pending = 0, lease_until = ? WHERE channel = ? AND thread_ts = ? AND owner = ?",
+            (now + LEASE_SECONDS, channel, thread_ts, owner),
+        )
+    return row[0] if row else 0
+
+
+def complete(conn, channel, thread_ts, owner):
+    """Chiude una generazione: True se sono arrivati messaggi nel frattempo (va rigenerato),
+    altrimenti rilascia il lease e ritorna False."""
+    with _immediate(conn):
+        row = conn.execute(
+            "SELECT pending FROM reply_leases WHERE channel = ? AND thread_ts = ? AND owner = ?",
+            (channel, thread_ts, owner),
+        ).fetchone()
+        if row is not None and row[0] > 0:
+            return True
+        conn.execute(
+            "DELETE FROM reply_leases WHERE channel = ? AND thread_ts = ? AND owner = ?",
+            (channel, thread_ts, owner),
+        )
+        return False
+
+
+def release(conn, channel, thread_ts, owner):
+    """Rilascia il lease (es. dopo un errore), senza rigenerare."""
+    with _immediate(conn):
+        conn.execute(
+            "DELETE FROM reply_leases WHERE channel = ? AND thread_ts = ? AND owner = ?",
+            (channel, thread_ts, owner),
+        )
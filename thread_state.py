@@ -0,0 +1,143 @@
+"""Stato incrementale dei thread ingaggiati, condiviso tra i worker via SQLite.
+
+Alla prima risposta in un thread ingaggiato lo stato viene inizializzato
+dall'archivio; da lì in poi ogni messaggio (utenti e risposte del bot) viene
+aggiunto dagli eventi con il nome utente già risolto, e lo stato è tagliato
+alla finestra usata nel prompt. Una risposta costa quindi O(nuovi messaggi),
+senza chiamate Slack e senza ricostruire la mappa dei nomi.
+"""
+
+THREAD_STATE_WINDOW = 200
+
+
+def is_seeded(conn, channel, thread_ts):
+    row = conn.execute(
+        "SELECT 1 FROM thread_state_threads WHERE channel = ? AND thread_ts = ?",
+        (channel, thread_ts),
+    ).fetchone()
+    return row is not None
+
+
+def load(conn, channel, thread_ts):
+    """Messaggi del thread nel formato di `build_ai_context_messages`, o None se non inizializzato."""
+    if not is_seeded(conn, channel, thread_ts):
+        return None
+    rows = conn.execute(
+        """
+        SELECT user_name, user_id, text, timestamp FROM thread_state
+        WHERE channel = ? AND thread_ts = ?
+        ORDER BY timestamp
+        """,
+        (channel, thread_ts),
+    ).fetchall()
+    return [
+        {"user": user_name, "user_id": user_id, "text": text, "ts": ts}
+        for user_name, user_id, text, ts in rows
+    ]
+
+
+def _trim(conn, channel, thread_ts, window):
+    # Il root resta sempre: è il contesto della conversazione
+    conn.execute(
+        """
+        DELETE FROM thread_state
+        WHERE channel = ? AND thread_ts = ? AND timestamp != thread_ts AND timestamp NOT IN (
+            SELECT timestamp FROM thread_state
+            WHERE channel = ? AND thread_ts = ? AND timestamp != thread_ts
+            ORDER BY timestamp DESC
+            LIMIT ?
+        )
+        """,
+        (channel, thread_ts, channel, thread_ts, window),
+    )
+
+
+def seed(conn, channel, thread_ts, messages, window=THREAD_STATE_WINDOW):
+    """Inizializza lo stato da una lista completa di messaggi (es. `get_thread_messages`)."""
+    conn.execute(
+        "DELETE FROM thread_state WHERE channel = ? AND thread_ts = ?",
+        (channel, thread_ts),
+    )
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO thread_state (channel, thread_ts, timestamp, user_id, user_name, text)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (channel, thread_ts, m.get("ts"), m.get("user_id"), m.get("user"), m.get("text"))
+            for m in messages
+            if m.get("ts")
+        ],
+    )
+    conn.execute(
+        "INSERT OR REPLACE INTO thread_state_threads (channel, thread_ts) VALUES (?, ?)",
+        (channel, thread_ts),
+    )
+    _trim(conn, channel, thread_ts, window)
+    conn.commit()
+
+
+def append(conn, channel, thread_ts, ts, user_id, user_name, text, window=THREAD_STATE_WINDOW):
+    """Aggiunge un messaggio allo stato del thread, se inizializzato. Idempotente su `ts`."""
+    if not ts or not text or not is_seeded(conn, channel, thread_ts):
+        return False
+    conn.execute(
+        """
+        INSERT OR IGNORE INTO thread_state (channel, thread_ts, timestamp, user_id, user_name, text)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        (channel, thread_ts, ts, user_id, user_name, text),
+    )
+    _trim(conn, channel, thread_ts, window)
+    conn.commit()
+    return True
+
+
+def append_event(conn, message, resolve_name):
+    """Aggiunge un messaggio utente da un evento Slack, se il thread è inizializzato.
+
+    Va chiamata per ogni messaggio in thread, comprese le mention che vengono
+    instradate altrove: altrimenti la risposta del bot resterebbe senza la
+    domanda. `resolve_name(user_id)` viene chiamata solo se serve.
+    """
+    channel = message.get("channel")
+    thread_ts = message.get("thread_ts")
+    ts = message.get("ts")
+    user_id = message.get("user")
+    text = (message.get("text") or "").strip()
+    if not thread_ts or thread_ts == ts or not user_id or user_id == "USLACKBOT" or not text:
+        return False
+    if not is_seeded(conn, channel, thread_ts):
+        return False
+    return append(conn, channel, thread_ts, ts, user_id, resolve_name(user_id), text)
+
+
+def update_text(conn, channel, ts, text):
+    """Riflette una modifica del messaggio (message_changed)."""
+    conn.execute(
+        "UPDATE thread_state SET text = ? WHERE channel = ? AND timestamp = ?",
+        (text, channel, ts),
+    )
+    conn.commit()
+
+
+def remove(conn, channel, ts):
+    """Riflette una cancellazione del messaggio."""
+    conn.execute(
+        "DELETE FROM thread_state WHERE channel = ? AND timestamp = ?",
+        (channel, ts),
+    )
+    conn.commit()
+
+
+def drop(conn, channel, thread_ts):
+    """Elimina lo stato del thread (stop o nuovo /engage)."""
+    conn.execute(
+        "DELETE FROM thread_state WHERE channel = ? AND thread_ts = ?",
+        (channel, thread_ts),
+    )
+    conn.execute(
+        "DELETE FROM thread_state_threads WHERE channel = ? AND thread_ts = ?",
+        (channel, thread_ts),
+    )
+    conn.commit()
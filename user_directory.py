@@ -0,0 +1,207 @@
+"""Directory utenti Slack: tabella `users` con sync incrementale e cache TTL.
+
+- `sync()` pagina `users_list` e scrive solo le righe nuove o cambiate;
+  è single-flight sia nel processo (lock) sia tra worker (lease in `sync_state`).
+- `refresh_async()` lancia il sync in un thread solo se l'ultimo è più vecchio
+  di `sync_ttl`: nessuna richiesta aspetta mai un sync completo.
+- `ensure_user()` recupera con `users_info` un singolo utente sconosciuto.
+- `apply_user_change()` applica direttamente gli eventi `user_change`.
+- `display_name()` serve i nomi da una cache in memoria con TTL.
+"""
+
+import logging
+import os
+import threading
+import time
+import uuid
+
+import archive_versions
+from utils import acquire_sync_lease, db_connect, last_synced_at, release_sync_lease
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_AVATAR = "http://fst.slack-edge.com/66f9/img/avatars/ava_0024-32.png"
+SYNC_NAME = "users"
+SYNC_TTL_SECONDS = 6 * 3600
+SYNC_LEASE_SECONDS = 600
+NAME_CACHE_TTL_SECONDS = 600
+PAGE_SIZE = 200
+
+USER_COLUMNS = ("name", "id", "avatar", "is_deleted", "real_name", "display_name", "email")
+
+
+def user_row(member):
+    """Riga della tabella `users` (nell'ordine di USER_COLUMNS) da un oggetto utente Slack."""
+    profile = member.get("profile", {})
+    name = profile.get("display_name")
+    if not name:
+        name = profile.get("real_name")
+    return (
+        name,
+        member["id"],
+        profile.get("image_72", DEFAULT_AVATAR),
+        bool(member.get("deleted", False)),
+        profile.get("real_name", ""),
+        profile.get("display_name", ""),
+        profile.get("email", ""),
+    )
+
+
+def _normalize(row):
+    return tuple(bool(v) if i == 3 else (v if v is not None else "") for i, v in enumerate(row))
+
+
+def upsert_users(conn, rows):
+    conn.executemany(
+        f"INSERT OR REPLACE INTO users({', '.join(USER_COLUMNS)}) VALUES(?,?,?,?,?,?,?)",
+        rows,
+    )
+    if rows:
+        archive_versions.bump_users(conn)
+
+
+def diff_users(conn, rows):
+    """Ritorna (nuove, modificate) rispetto alla tabella `users`."""
+    existing = {
+        row[1]: _normalize(row)
+        for row in conn.execute(f"SELECT {', '.join(USER_COLUMNS)} FROM users").fetchall()
+    }
+    added, changed = [], []
+    for row in rows:
+        current = existing.get(row[1])
+        if current is None:
+            added.append(row)
+        elif current != _normalize(row):
+            changed.append(row)
+    return added, changed
+
+
+class UserDirectory:
+    def __init__(self, client, database_path, sync_ttl=SYNC_TTL_SECONDS,
+                 name_cache_ttl=NAME_CACHE_TTL_SECONDS, clock=time.time):
+        self._client = client
+        self._database_path = database_path
+        self._sync_ttl = sync_ttl
+        self._name_cache_ttl = name_cache_ttl
+        self._clock = clock
+        self._sync_lock = threading.Lock()
+        self._names = {}
+        self._names_lock = threading.Lock()
+
+    def sync(self, force=False):
+        """Sync paginato di `users_list` con diff. Ritorna le statistiche o None se saltato."""
+        if not self._sync_lock.acquire(blocking=False):
+            return None
+        conn, _ = db_connect(self._database_path)
+        owner = f"{os.getpid()}:{uuid.uuid4().hex}"
+        try:
+            now = self._clock()
+            synced_at = last_synced_at(conn, SYNC_NAME)
+            if not force and synced_at is not None and now - synced_at < self._sync_ttl:
+                return None
+            if not acquire_sync_lease(conn, SYNC_NAME, owner, now, SYNC_LEASE_SECONDS):
+                logger.info("[USERS] Sync already running in another worker, skipping")
+                return None
+
+            try:
+                rows, pages, cursor = [], 0, None
+                while True:
+                    kwargs = {"limit": PAGE_SIZE}
+                    if cursor:
+                        kwargs["cursor"] = cursor
+                    response = self._client.users_list(**kwargs)
+                    pages += 1
+                    rows.extend(user_row(m) for m in response.get("members", []))
+                    cursor = (response.get("response_metadata") or {}).get("next_cursor")
+                    if not cursor:
+                        break
+
+                added, changed = diff_users(conn, rows)
+                upsert_users(conn, added + changed)
+                release_sync_lease(conn, SYNC_NAME, owner, synced_at=self._clock())
+            except Exception:
+                release_sync_lease(conn, SYNC_NAME, owner)
+                raise
+
+            with self._names_lock:
+                for row in added + changed:
+                    self._names.pop(row[1], None)
+            stats = {"pages": pages, "added": len(added), "changed": len(changed), "total": len(rows)}
+            logger.info(f"[USERS] Sync done: {stats}")
+            return stats
+        finally:
+            conn.close()
+            self._sync_lock.release()
+
+    def is_stale(self):
+        conn, _ = db_connect(self._database_path)
+        try:
+            synced_at = last_synced_at(conn, SYNC_NAME)
+        finally:
+            conn.close()
+        return synced_at is None or self._clock() - synced_at >= self._sync_ttl
+
+    def refresh_async(self):
+        """Avvia un sync in background se i dati sono vecchi. Non blocca mai."""
+        if self._sync_lock.locked() or not self.is_stale():
+            return False
+        thread = threading.Thread(target=self._sync_quietly, name="users-sync", daemon=True)
+        thread.start()
+        return True
+
+    def _sync_quietly(self):
+        try:
+            self.sync()
+        except Exception as e:
+            logger.error(f"[USERS] Background sync failed: {e}")
+
+    def apply_user_change(self, member):
+        """Applica un evento `user_change` (contiene l'oggetto utente completo)."""
+        row = user_row(member)
+        conn, _ = db_connect(self._database_path)
+        try:
+            upsert_users(conn, [row])
+            conn.commit()
+        finally:
+            conn.close()
+        with self._names_lock:
+            self._names.pop(row[1], None)
+
+    def ensure_user(self, conn, user_id):
+        """Se l'utente non è in `users` lo recupera con `users_info`. True se presente alla fine."""
+        if not user_id or user_id == "USLACKBOT":
+            return False
+        if conn.execute("SELECT 1 FROM users WHERE id = ?", (user_id,)).fetchone():
+            return True
+        try:
+            member = self._client.users_info(user=user_id)["user"]
+        except Exception as e:
+            logger.warning(f"[USERS] users_info failed for {user_id}: {e}")
+            return False
+        upsert_users(conn, [user_row(member)])
+        conn.commit()
+        logger.info(f"[USERS] Added unknown user {user_id}")
+        return True
+
+    def display_name(self, user_id, default="utente"):
+        """Nome visualizzato (display_name, altrimenti real_name) con cache TTL."""
+        now = self._clock()
+        with self._names_lock:
+            cached = self._names.get(user_id)
+        if cached is not None and now - cached[1] < self._name_cache_ttl:
+            return cached[0]
+
+        conn, _ = db_connect(self._database_path)
+        try:
+            self.ensure_user(conn, user_id)
+            row = conn.execute(
+                "SELECT display_name, real_name FROM users WHERE id = ?", (user_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return default
+        name = row[0] or row[1] or default
+        with self._names_lock:
+            self._names[user_id] = (name, now)
+        return name
@@ -0,0 +1,70 @@
+"""Load test offline del percorso AI (`llm_client`) contro lo stub OpenAI locale.
+
+Avvia lo stub in-process (oppure usa `--base-url` per uno già attivo), lancia
+richieste concorrenti tramite il client condiviso e stampa latenze, errori e
+retry raccolti in `metrics`.
+
+Uso:
+    python utilities/ai_load_test.py -n 200 -c 20 --latency 0.1 --error-rate 0.1
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llm_client  # noqa: E402
+import metrics  # noqa: E402
+from ai_stream import iter_completion_deltas  # noqa: E402
+from utilities.openai_stub import start_stub_server  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--requests", type=int, default=100, help="numero di richieste (default = 100)")
+parser.add_argument("-c", "--concurrency", type=int, default=10, help="richieste in parallelo (default = 10)")
+parser.add_argument(
+    "-f", "--feature", default="mention",
+    help=f"funzionalità simulata, una di {', '.join(llm_client.FEATURE_TIMEOUTS)} (default = mention)",
+)
+parser.add_argument("--stream", action="store_true", help="usa stream=True e consuma tutti i token")
+parser.add_argument("--base-url", help="stub già in esecuzione (default: ne avvia uno locale)")
+parser.add_argument("--latency", type=float, default=0.05, help="latenza dello stub locale (default = 0.05)")
+parser.add_argument("--token-delay", type=float, default=0.0, help="ritardo tra token dello stub locale")
+parser.add_argument("--error-rate", type=float, default=0.0, help="frazione di errori 429/500 dello stub locale")
+args = parser.parse_args()
+
+server = None
+if args.base_url:
+    os.environ["OPENAI_BASE_URL"] = args.base_url
+else:
+    server = start_stub_server(latency=args.latency, token_delay=args.token_delay, error_rate=args.error_rate)
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+os.environ.setdefault("OPENAI_API_KEY", "stub")
+
+
+def one_request(i):
+    messages = [{"role": "user", "content": f"richiesta di prova {i}"}]
+    try:
+        if args.stream:
+            stream = llm_client.chat_completion(args.feature, model="gpt-4o", messages=messages, stream=True)
+            return bool("".join(iter_completion_deltas(stream)))
+        response = llm_client.chat_completion(args.feature, model="gpt-4o", messages=messages)
+        return bool(response.choices[0].message.content)
+    except Exception:
+        return False
+
+
+started = time.monotonic()
+with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+    results = list(executor.map(one_request, range(args.requests)))
+elapsed = time.monotonic() - started
+
+ok = sum(results)
+print(f"{ok}/{args.requests} ok in {elapsed:.2f}s ({args.requests / elapsed:.1f} req/s)")
+print(json.dumps(metrics.snapshot(), indent=2))
+
+if server is not None:
+    server.shutdown()
@@ -0,0 +1,93 @@
+"""Ricostruzione di `message_entities` per tutti i messaggi archiviati.
+
+`migrate_db` indicizza l'archivio esistente una volta sola, in un unico
+processo; questo script serve a rifarlo su archivi grandi o dopo una modifica
+di `message_entities.tokenize`. Legge `messages` a blocchi per rowid,
+tokenizza i blocchi in parallelo su un pool di processi (la tokenizzazione è
+puro Python, quindi CPU-bound) e scrive dal processo principale, un commit per
+gruppo di blocchi. Alla fine ricostruisce le rollup di /stats, che contano
+emoji e file dalle entità. Si può rilanciare: le entità di ogni messaggio
+vengono sostituite.
+
+Uso:
+    python utilities/backfill_entities.py -d slack.sqlite
+    python utilities/backfill_entities.py -d slack.sqlite -w 8 -b 5000
+"""
+
+import argparse
+import itertools
+import logging
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import message_entities  # noqa: E402
+import rollups  # noqa: E402
+from utils import db_connect, migrate_db  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-d", "--database-path", default="slack.sqlite", help="path to the SQLite database (default = ./slack.sqlite)")
+parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="processi di tokenizzazione (default = CPU)")
+parser.add_argument("-b", "--batch-size", type=int, default=2000, help="messaggi per blocco (default = 2000)")
+parser.add_argument("-l", "--log-level", default="INFO", help="CRITICAL, ERROR, WARNING, INFO or DEBUG (default = INFO)")
+args = parser.parse_args()
+
+logging.basicConfig(level=getattr(logging, args.log_level.upper()))
+logger = logging.getLogger(__name__)
+
+
+def tokenize_batch(batch):
+    rows = []
+    for channel, ts, text in batch:
+        rows.extend(message_entities.rows(channel, ts, text))
+    return [(channel, ts) for channel, ts, _ in batch], rows
+
+
+def read_batches(conn):
+    last_rowid = 0
+    while True:
+        batch = conn.execute(
+            "SELECT rowid, channel, timestamp, message FROM messages WHERE rowid > ? ORDER BY rowid LIMIT ?",
+            (last_rowid, args.batch_size),
+        ).fetchall()
+        if not batch:
+            return
+        last_rowid = batch[-1][0]
+        yield [row[1:] for row in batch]
+
+
+if __name__ == "__main__":
+    conn, cursor = db_connect(args.database_path)
+    try:
+        migrate_db(conn, cursor)
+        total = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        logger.info(f"Tokenizing {total} messages on {args.workers} workers")
+
+        done = entities = 0
+        started = time.time()
+        batches = read_batches(conn)
+        with Pool(args.workers) as pool:
+            while True:
+                # Pochi blocchi alla volta: la memoria resta limitata anche su archivi grandi
+                window = list(itertools.islice(batches, args.workers * 2))
+                if not window:
+                    break
+                for keys, rows in pool.map(tokenize_batch, window):
+                    conn.executemany("DELETE FROM message_entities WHERE channel = ? AND timestamp = ?", keys)
+                    conn.executemany(
+                        "INSERT INTO message_entities (channel, timestamp, kind, value, count) VALUES (?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                    done += len(keys)
+                    entities += len(rows)
+                conn.commit()
+                logger.info(f"Tokenized {done}/{total} messages, {entities} entities. Elapsed time: {time.time() - started:.2f} seconds")
+
+        rollups.backfill(conn)
+        conn.commit()
+        logger.info(f"Finished. {entities} entities for {done} messages, rollups rebuilt")
+    finally:
+        conn.close()
@@ -0,0 +1,118 @@
+"""Memoria di picco e byte inviati per le risposte di /searchV2, /users e /thread.
+
+Per ciascuna query confronta la serializzazione storica (`fetchall` + lista di
+dict + un'unica stringa JSON) con `json_stream.iter_json_array`, senza
+compressione e con le codifiche disponibili. La memoria di picco è misurata con
+tracemalloc durante la sola serializzazione, i byte sono quelli che
+attraverserebbero la rete.
+
+Uso:
+    python utilities/bench_json.py --messages 50000 --users 3000
+    python utilities/bench_json.py -d slack.sqlite
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive_index  # noqa: E402
+import json_stream  # noqa: E402
+from utils import migrate_db  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-d", "--database-path", help="DB da copiare e misurare (default: DB sintetico)")
+parser.add_argument("--messages", type=int, default=20000, help="messaggi del DB sintetico (default = 20000)")
+parser.add_argument("--users", type=int, default=2000, help="utenti del DB sintetico (default = 2000)")
+parser.add_argument("--thread-replies", type=int, default=500, help="risposte del thread più lungo (default = 500)")
+args = parser.parse_args()
+
+QUERIES = {
+    "searchV2": """
+        SELECT messages.message, messages.user, messages.channel, messages.timestamp, messages.permalink,
+               messages.thread_ts, users.name as user_name, channels.name as channel_name
+        FROM messages
+        JOIN users ON messages.user = users.id
+        JOIN channels ON messages.channel = channels.id
+        ORDER BY messages.timestamp DESC LIMIT 2000
+    """,
+    "users": "SELECT * FROM users",
+    "thread": """
+        SELECT messages.message, messages.user, messages.channel, messages.timestamp, messages.permalink,
+               messages.thread_ts, users.name as user_name
+        FROM messages JOIN users ON messages.user = users.id
+        WHERE messages.thread_ts = (SELECT thread_ts FROM threads ORDER BY reply_count DESC LIMIT 1)
+    """,
+}
+
+
+def build_synthetic(path):
+    conn = sqlite3.connect(path)
+    migrate_db(conn, conn.cursor())
+    rng = random.Random(42)
+    users = [f"U{i:05d}" for i in range(args.users)]
+    conn.executemany(
+        "INSERT INTO users (name, id, avatar, real_name, display_name, email) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (f"utente{u}", u, f"https://avatars.example.com/{u}_72.png", f"Nome {u}", f"utente{u}", f"{u}@example.com")
+            for u in users
+        ],
+    )
+    conn.executemany("INSERT INTO channels (name, id, is_private) VALUES (?, ?, 0)", [(f"canale{c}", f"C{c:04d}") for c in range(20)])
+    words = ["ciao", "python", "slack", "bot", "archivio", "thread", "link", "test", "https://example.com/pagina"]
+    rows = []
+    for i in range(args.messages):
+        ts = f"{1700000000 + i}.000100"
+        thread_ts = "1700000000.000100" if i < args.thread_replies else ts
+        channel = "C0000" if i < args.thread_replies else f"C{rng.randrange(20):04d}"
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(5, 40)))
+        rows.append((text, rng.choice(users), channel, ts, f"https://example.slack.com/archives/{channel}/p{ts.replace('.', '')}", thread_ts))
+    conn.executemany("INSERT INTO messages (message, user, channel, timestamp, permalink, thread_ts) VALUES (?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    archive_index.backfill(conn)
+    conn.commit()
+    return conn
+
+
+def measure(conn, sql, encoding):
+    conn.row_factory = sqlite3.Row
+    tracemalloc.start()
+    if encoding == "legacy":
+        body = json.dumps([dict(row) for row in conn.execute(sql).fetchall()], sort_keys=True, separators=(",", ":")).encode()
+        rows, sent = None, len(body)
+        del body
+    else:
+        stats = {}
+        for _ in json_stream.iter_json_array(conn.execute(sql), None if encoding == "identity" else encoding, stats):
+            pass
+        rows, sent = stats["rows"], stats["sent_bytes"]
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, sent, peak
+
+
+workdir = tempfile.mkdtemp()
+try:
+    path = os.path.join(workdir, "bench.sqlite")
+    if args.database_path:
+        shutil.copyfile(args.database_path, path)
+        conn = sqlite3.connect(path)
+        migrate_db(conn, conn.cursor())
+    else:
+        conn = build_synthetic(path)
+
+    print(f"{'endpoint':<10} {'encoding':<9} {'rows':>6} {'bytes':>10} {'peak':>10}")
+    for name, sql in QUERIES.items():
+        for encoding in ["legacy", "identity"] + json_stream.supported_encodings():
+            rows, sent, peak = measure(conn, sql, encoding)
+            print(f"{name:<10} {encoding:<9} {rows if rows is not None else '-':>6} {sent / 1024:>8.1f}KB {peak / 1024:>8.1f}KB")
+    conn.close()
+finally:
+    shutil.rmtree(workdir)
@@ -0,0 +1,135 @@
+"""Benchmark delle query di /searchV2 prima e dopo la deduplica di `members`.
+
+"Prima" è la query storica con `LEFT JOIN members` + `DISTINCT` sulla tabella
+`members` senza vincoli (righe duplicate a ogni avvio); "dopo" è la query
+attuale, senza join, sulla tabella migrata da `migrate_db`. Per ciascuna stampa
+le righe prodotte dal join prima del DISTINCT, le righe restituite e la
+latenza mediana.
+
+Uso:
+    python utilities/bench_search.py --synthetic --messages 50000 --duplicates 20
+    python utilities/bench_search.py -d slack.sqlite --query ciao
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import migrate_db  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-d", "--database-path", help="DB da copiare e misurare (default: DB sintetico)")
+parser.add_argument("--synthetic", action="store_true", help="genera un DB sintetico con members duplicati")
+parser.add_argument("--messages", type=int, default=20000, help="messaggi del DB sintetico (default = 20000)")
+parser.add_argument("--channels", type=int, default=20, help="canali del DB sintetico (default = 20)")
+parser.add_argument("--members", type=int, default=50, help="membri per canale (default = 50)")
+parser.add_argument("--duplicates", type=int, default=10, help="copie di ogni riga di members (default = 10)")
+parser.add_argument("-q", "--query", default="", help="termine di ricerca (default: nessun filtro)")
+parser.add_argument("-r", "--runs", type=int, default=5, help="ripetizioni per misura (default = 5)")
+args = parser.parse_args()
+
+SELECT = """
+    messages.message, messages.user, messages.channel, messages.timestamp,
+    messages.permalink, messages.thread_ts, users.name as user_name, channels.name as channel_name
+"""
+OLD_FROM = """
+    FROM messages
+    JOIN users ON messages.user = users.id
+    JOIN channels ON messages.channel = channels.id
+    LEFT JOIN members ON messages.channel = members.channel
+    WHERE 1=1
+"""
+NEW_FROM = """
+    FROM messages
+    JOIN users ON messages.user = users.id
+    JOIN channels ON messages.channel = channels.id
+    WHERE 1=1
+"""
+
+
+def build_synthetic(path):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    # Schema storico: members senza vincoli, come prima della migrazione
+    cursor.execute("CREATE TABLE members (channel TEXT, user TEXT)")
+    rng = random.Random(42)
+    users = [f"U{i:05d}" for i in range(args.members * 2)]
+    cursor.executemany("INSERT INTO members VALUES (?, ?)", [
+        (f"C{c:04d}", user)
+        for _ in range(args.duplicates)
+        for c in range(args.channels)
+        for user in users[:args.members]
+    ])
+    conn.commit()
+    cursor.execute("""
+        CREATE TABLE messages (message TEXT, user TEXT, channel TEXT, timestamp TEXT, permalink TEXT, thread_ts TEXT,
+                               UNIQUE(channel, timestamp) ON CONFLICT REPLACE)
+    """)
+    cursor.execute("CREATE TABLE users (name TEXT, id TEXT, avatar TEXT, UNIQUE(id) ON CONFLICT REPLACE)")
+    cursor.execute("""
+        CREATE TABLE channels (name TEXT, id TEXT, is_private BOOLEAN NOT NULL CHECK (is_private IN (0,1)),
+                               UNIQUE(id) ON CONFLICT REPLACE)
+    """)
+    cursor.executemany("INSERT INTO users (name, id) VALUES (?, ?)", [(f"utente{u}", u) for u in users])
+    cursor.executemany(
+        "INSERT INTO channels VALUES (?, ?, 0)", [(f"canale{c}", f"C{c:04d}") for c in range(args.channels)]
+    )
+    words = ["ciao", "python", "slack", "bot", "archivio", "thread", "link", "test"]
+    cursor.executemany(
+        "INSERT INTO messages (message, user, channel, timestamp, permalink) VALUES (?, ?, ?, ?, '')",
+        [
+            (
+                " ".join(rng.choice(words) for _ in range(8)),
+                rng.choice(users),
+                f"C{rng.randrange(args.channels):04d}",
+                f"{1700000000 + i}.000100",
+            )
+            for i in range(args.messages)
+        ],
+    )
+    conn.commit()
+    return conn
+
+
+def measure(conn, label, from_clause, distinct):
+    where, params = "", []
+    if args.query:
+        where = " AND messages.message LIKE ?"
+        params.append(f"%{args.query}%")
+    joined = conn.execute(f"SELECT COUNT(*) {from_clause}{where}", params).fetchone()[0]
+    sql = f"SELECT {'DISTINCT' if distinct else ''} {SELECT} {from_clause}{where} ORDER BY messages.timestamp DESC LIMIT 2000"
+    timings, rows = [], 0
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        rows = len(conn.execute(sql, params).fetchall())
+        timings.append(time.perf_counter() - started)
+    members = conn.execute("SELECT COUNT(*) FROM members").fetchone()[0]
+    print(
+        f"{label:<8} members={members:<8} joined_rows={joined:<10} returned={rows:<6} "
+        f"median={statistics.median(timings) * 1000:.1f}ms"
+    )
+
+
+workdir = tempfile.mkdtemp()
+try:
+    path = os.path.join(workdir, "bench.sqlite")
+    if args.database_path and not args.synthetic:
+        shutil.copyfile(args.database_path, path)
+        conn = sqlite3.connect(path)
+    else:
+        conn = build_synthetic(path)
+
+    measure(conn, "before", OLD_FROM, distinct=True)
+    migrate_db(conn, conn.cursor())
+    measure(conn, "after", NEW_FROM, distinct=False)
+    conn.close()
+finally:
+    shutil.rmtree(workdir)
@@ -0,0 +1,110 @@
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive_versions  # noqa: E402
+from permalinks import build_permalink, workspace_url  # noqa: E402
+from utils import db_connect  # noqa: E402
+
+# Setup argument parser
+parser = argparse.ArgumentParser(
+    description="Calcola in blocco i permalink mancanti in messages.permalink"
+)
+parser.add_argument(
+    "-d",
+    "--database-path",
+    default="slack.sqlite",
+    help="path to the SQLite database. (default = ./slack.sqlite)",
+)
+parser.add_argument(
+    "-w",
+    "--workspace-url",
+    help="es. https://sferait-ws.slack.com/ (default: ricavato da auth.test con SLACK_BOT_TOKEN)",
+)
+parser.add_argument(
+    "--include-roots",
+    action="store_true",
+    help="calcola anche i permalink dei messaggi root, lasciati vuoti per il limite di Slack Free",
+)
+parser.add_argument(
+    "-b",
+    "--batch-size",
+    type=int,
+    default=5000,
+    help="Number of messages to update in each batch (default = 5000)",
+)
+parser.add_argument(
+    "-l",
+    "--log-level",
+    default="INFO",
+    help="CRITICAL, ERROR, WARNING, INFO or DEBUG (default = INFO)",
+)
+args = parser.parse_args()
+
+# Setup logging
+log_level = args.log_level.upper()
+assert log_level in ["CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"]
+logging.basicConfig(
+    level=getattr(logging, log_level),
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def resolve_workspace_url():
+    if args.workspace_url:
+        return args.workspace_url if args.workspace_url.endswith("/") else args.workspace_url + "/"
+    from slack_sdk import WebClient
+
+    return workspace_url(WebClient(token=os.environ["SLACK_BOT_TOKEN"]).auth_test())
+
+
+def fill_permalinks():
+    base_url = resolve_workspace_url()
+    logger.info(f"Workspace URL: {base_url}")
+    conn, cursor = db_connect(args.database_path)
+
+    # Gli opt-out hanno il permalink vuoto di proposito (user = USLACKBOT)
+    where = "(permalink IS NULL OR permalink = '') AND user != 'USLACKBOT'"
+    if not args.include_roots:
+        where += " AND thread_ts IS NOT NULL AND thread_ts != timestamp"
+
+    try:
+        cursor.execute(f"SELECT COUNT(*) FROM messages WHERE {where}")
+        total = cursor.fetchone()[0]
+        logger.info(f"Messages without permalink: {total}")
+
+        updated = 0
+        last_rowid = 0
+        start_time = time.time()
+        while True:
+            cursor.execute(
+                f"SELECT rowid, channel, timestamp, thread_ts FROM messages WHERE {where} AND rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, args.batch_size),
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+
+            cursor.executemany(
+                "UPDATE messages SET permalink = ? WHERE rowid = ?",
+                [(build_permalink(base_url, channel, ts, thread_ts), rowid) for rowid, channel, ts, thread_ts in rows],
+            )
+            for channel in {row[1] for row in rows}:
+                archive_versions.bump_channel(conn, channel)
+            conn.commit()
+            updated += len(rows)
+            logger.info(f"Updated {updated}/{total} permalinks. Elapsed time: {time.time() - start_time:.2f} seconds")
+
+        logger.info(f"Finished. Total permalinks updated: {updated}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    fill_permalinks()
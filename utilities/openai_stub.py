@@ -0,0 +1,177 @@
+"""Server locale compatibile con le API OpenAI, per test e prove offline.
+
+Implementa `POST /v1/chat/completions` (anche con `stream: true`) e
+`POST /v1/audio/speech`, risponde con un testo fisso spezzato in token.
+Latenza e percentuale di errori (429/500) sono configurabili per provare
+timeout e retry di `llm_client`.
+
+Uso:
+    python utilities/openai_stub.py --port 8765 --token-delay 0.05 --latency 0.2 --error-rate 0.1
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub gunicorn ...
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "Risposta di prova generata dallo stub OpenAI locale."
+
+
+class OpenAIStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            body = {}
+
+        path = self.path.rstrip("/")
+        if not path.endswith(("/chat/completions", "/audio/speech")):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        config = self.server.stub_config
+        config["requests"].append(body)
+        time.sleep(config["latency"])
+
+        if random.random() < config["error_rate"]:
+            status = random.choice((429, 500))
+            self.send_response(status)
+            body = json.dumps({"error": {"message": f"stub error {status}", "type": "stub"}}).encode("utf-8")
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if path.endswith("/audio/speech"):
+            audio = b"\xff\xfb\x90\x00" * 256
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header("Content-Length", str(len(audio)))
+            self.end_headers()
+            self.wfile.write(audio)
+            return
+
+        reply = config["reply"]
+        model = body.get("model", "gpt-stub")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        if not body.get("stream"):
+            time.sleep(config["token_delay"] * len(reply.split()))
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def chunk(delta, finish_reason=None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+
+        words = reply.split(" ")
+        events = [chunk({"role": "assistant", "content": ""})]
+        events += [chunk({"content": w if i == 0 else " " + w}) for i, w in enumerate(words)]
+        events.append(chunk({}, finish_reason="stop"))
+        for event in events:
+            time.sleep(config["token_delay"])
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def _stub_config(reply, token_delay, latency, error_rate):
+    return {
+        "reply": reply,
+        "token_delay": token_delay,
+        "latency": latency,
+        "error_rate": error_rate,
+        "requests": deque(maxlen=100),
+    }
+
+
+def start_stub_server(host="127.0.0.1", port=0, reply=DEFAULT_REPLY, token_delay=0.0,
+                      latency=0.0, error_rate=0.0):
+    """Avvia lo stub in un thread daemon. Ritorna il server (`server.base_url`)."""
+    server = ThreadingHTTPServer((host, port), OpenAIStubHandler)
+    server.daemon_threads = True
+    server.stub_config = _stub_config(reply, token_delay, latency, error_rate)
+    server.base_url = f"http://{host}:{server.server_address[1]}/v1"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8765)
+    parser.add_argument("--reply", default=DEFAULT_REPLY, help="testo restituito dallo stub")
+    parser.add_argument(
+        "--token-delay", type=float, default=0.05,
+        help="secondi di attesa tra un token e l'altro (default = 0.05)",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0,
+        help="secondi di attesa prima di rispondere (default = 0)",
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0,
+        help="frazione di richieste che falliscono con 429 o 500 (default = 0)",
+    )
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), OpenAIStubHandler)
+    server.daemon_threads = True
+    server.stub_config = _stub_config(args.reply, args.token_delay, args.latency, args.error_rate)
+    print(f"OpenAI stub listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Load test offline del client Slack (`slack_api`) contro lo stub locale.
+
+Avvia lo stub in-process (oppure usa `--base-url` per uno già attivo), lancia
+chiamate concorrenti con un mix di letture ripetute e scritture e stampa le
+metriche per metodo (chiamate, cache, coalescing, attese, 429) e le richieste
+effettivamente arrivate allo stub.
+
+Uso:
+    python utilities/slack_load_test.py -n 500 -c 20 --limit-per-minute 50 --error-rate 0.05
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+from slack_api import RateLimitedSlackClient  # noqa: E402
+from utilities.slack_stub import start_stub_server  # noqa: E402
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-n", "--requests", type=int, default=200, help="numero di chiamate (default = 200)")
+parser.add_argument("-c", "--concurrency", type=int, default=10, help="chiamate in parallelo (default = 10)")
+parser.add_argument("--channels", type=int, default=5, help="canali distinti simulati (default = 5)")
+parser.add_argument("--base-url", help="stub già in esecuzione (default: ne avvia uno locale)")
+parser.add_argument("--latency", type=float, default=0.02, help="latenza dello stub locale (default = 0.02)")
+parser.add_argument("--limit-per-minute", type=int, default=0, help="limite per metodo dello stub locale")
+parser.add_argument("--error-rate", type=float, default=0.0, help="frazione di 429 dello stub locale")
+args = parser.parse_args()
+
+server = None
+base_url = args.base_url
+if not base_url:
+    server = start_stub_server(
+        latency=args.latency, limit_per_minute=args.limit_per_minute, error_rate=args.error_rate
+    )
+    base_url = server.base_url
+
+client = RateLimitedSlackClient(token="xoxb-stub", base_url=base_url)
+
+
+def one_call(i):
+    channel = f"C{random.randrange(args.channels):04d}"
+    kind = random.random()
+    try:
+        if kind < 0.4:
+            client.conversations_replies(channel=channel, ts="1700000000.000100")
+        elif kind < 0.6:
+            client.users_info(user=f"U{random.randrange(20):04d}")
+        elif kind < 0.8:
+            client.conversations_info(channel=channel)
+        elif kind < 0.9:
+            client.reactions_add(channel=channel, timestamp="1700000000.000100", name="eyes")
+        else:
+            client.chat_postMessage(channel=channel, text=f"prova {i}")
+        return True
+    except Exception:
+        return False
+
+
+started = time.monotonic()
+with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+    results = list(executor.map(one_call, range(args.requests)))
+elapsed = time.monotonic() - started
+
+ok = sum(results)
+print(f"{ok}/{args.requests} ok in {elapsed:.2f}s ({args.requests / elapsed:.1f} req/s)")
+if server is not None:
+    config = server.stub_config
+    print(f"Requests reaching the stub: {sum(config['calls'].values())} {dict(config['calls'])}")
+    print(f"Rate limited by the stub: {dict(config['rate_limited'])}")
+    server.shutdown()
+print(json.dumps(metrics.snapshot(), indent=2))
@@ -0,0 +1,190 @@
+"""Server locale che imita la Slack Web API, per test e prove di carico offline.
+
+Risponde a `/api/<metodo>` (GET o POST, form o JSON) con dati finti ma ben
+formati per i metodi usati dal bot; gli altri metodi rispondono `{"ok": true}`.
+Latenza, limite di richieste al minuto per metodo e percentuale di 429
+(con `Retry-After`) sono configurabili per provare `slack_api`.
+
+Uso:
+    python utilities/slack_stub.py --port 8766 --latency 0.05 --limit-per-minute 50
+    SLACK_API_BASE_URL=http://127.0.0.1:8766/api/ SLACK_BOT_TOKEN=xoxb-stub gunicorn ...
+"""
+
+import argparse
+import collections
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_USER_ID = "UBOTSTUB"
+TEAM_URL = "https://stub-workspace.slack.com/"
+
+
+def _user(user_id):
+    return {
+        "id": user_id,
+        "deleted": False,
+        "profile": {"display_name": f"utente-{user_id}", "real_name": f"Utente {user_id}", "email": ""},
+    }
+
+
+def _messages(channel, thread_ts=None, count=3):
+    base = float(thread_ts or "1700000000.000100")
+    return [
+        {
+            "type": "message",
+            "user": "USTUB",
+            "text": f"messaggio {i} in {channel}",
+            "ts": f"{base + i:.6f}",
+            "thread_ts": thread_ts,
+        }
+        for i in range(count)
+    ]
+
+
+def fake_response(method, args):
+    channel = args.get("channel", "CSTUB")
+    if method == "auth.test":
+        return {"user_id": BOT_USER_ID, "user": "archivebot", "team_id": "TSTUB", "url": TEAM_URL}
+    if method == "users.info":
+        return {"user": _user(args.get("user", "USTUB"))}
+    if method == "users.list":
+        return {"members": [_user(f"U{i:04d}") for i in range(5)], "response_metadata": {"next_cursor": ""}}
+    if method == "conversations.info":
+        return {"channel": {"id": channel, "name": f"canale-{channel.lower()}", "is_private": False, "is_member": True}}
+    if method == "conversations.list":
+        return {
+            "channels": [{"id": "CSTUB", "name": "generale", "is_private": False, "is_member": True}],
+            "response_metadata": {"next_cursor": ""},
+        }
+    if method == "conversations.members":
+        return {"members": ["USTUB", BOT_USER_ID], "response_metadata": {"next_cursor": ""}}
+    if method == "conversations.replies":
+        return {"messages": _messages(channel, args.get("ts")), "has_more": False}
+    if method == "conversations.history":
+        return {"messages": _messages(channel), "has_more": False}
+    if method == "chat.getPermalink":
+        ts = args.get("message_ts", "")
+        return {"permalink": f"{TEAM_URL}archives/{channel}/p{ts.replace('.', '')}"}
+    if method in ("chat.postMessage", "chat.update"):
+        return {"channel": channel, "ts": args.get("ts") or f"{time.time():.6f}"}
+    return {}
+
+
+class SlackStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        args = dict(parse_qsl(url.query))
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        if raw:
+            if (self.headers.get("Content-Type") or "").startswith("application/json"):
+                try:
+                    args.update(json.loads(raw))
+                except ValueError:
+                    pass
+            else:
+                args.update(parse_qsl(raw.decode("utf-8")))
+
+        method = url.path.rstrip("/").rsplit("/", 1)[-1]
+        config = self.server.stub_config
+        time.sleep(config["latency"])
+
+        now = time.monotonic()
+        with config["lock"]:
+            config["calls"][method] += 1
+            window = config["windows"][method]
+            while window and window[0] <= now - 60:
+                window.popleft()
+            limited = bool(config["limit_per_minute"]) and len(window) >= config["limit_per_minute"]
+            if not limited:
+                window.append(now)
+            if limited or random.random() < config["error_rate"]:
+                config["rate_limited"][method] += 1
+                limited = True
+        if limited:
+            self._send_json(429, {"ok": False, "error": "ratelimited"}, {"Retry-After": str(config["retry_after"])})
+            return
+
+        payload = {"ok": True}
+        payload.update(fake_response(method, args))
+        self._send_json(200, payload)
+
+    do_GET = _handle
+    do_POST = _handle
+
+
+def _stub_config(latency, limit_per_minute, error_rate, retry_after):
+    return {
+        "latency": latency,
+        "limit_per_minute": limit_per_minute,
+        "error_rate": error_rate,
+        "retry_after": retry_after,
+        "lock": threading.Lock(),
+        "calls": collections.Counter(),
+        "rate_limited": collections.Counter(),
+        "windows": collections.defaultdict(collections.deque),
+    }
+
+
+def start_stub_server(host="127.0.0.1", port=0, latency=0.0, limit_per_minute=0, error_rate=0.0,
+                      retry_after=1):
+    """Avvia lo stub in un thread daemon. Ritorna il server (`server.base_url`)."""
+    server = ThreadingHTTPServer((host, port), SlackStubHandler)
+    server.daemon_threads = True
+    server.stub_config = _stub_config(latency, limit_per_minute, error_rate, retry_after)
+    server.base_url = f"http://{host}:{server.server_address[1]}/api/"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8766)
+    parser.add_argument(
+        "--latency", type=float, default=0.0,
+        help="secondi di attesa prima di rispondere (default = 0)",
+    )
+    parser.add_argument(
+        "--limit-per-minute", type=int, default=0,
+        help="richieste al minuto per metodo oltre le quali risponde 429 (default = 0, nessun limite)",
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0,
+        help="frazione di richieste che falliscono con 429 (default = 0)",
+    )
+    parser.add_argument("--retry-after", type=int, default=1, help="valore di Retry-After sui 429 (default = 1)")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), SlackStubHandler)
+    server.daemon_threads = True
+    server.stub_config = _stub_config(args.latency, args.limit_per_minute, args.error_rate, args.retry_after)
+    print(f"Slack stub listening on http://{args.host}:{args.port}/api/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Profilo di avvio: tempo di import e RSS per modulo, ognuno in un interprete nuovo.
+
+Serve a verificare che un worker (ri)parta in molto meno di un secondo e che
+le dipendenze pesanti (torch, sentence_transformers, numpy, pydub, openai)
+non vengano importate finché non servono. Per `archivebot` e `flask_app` avvia
+lo stub Slack locale, così `auth.test` non esce dalla macchina.
+
+Uso:
+    python utilities/startup_profile.py
+    python utilities/startup_profile.py -m archivebot flask_app -r 3
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from utilities.slack_stub import start_stub_server  # noqa: E402
+
+DEFAULT_MODULES = [
+    "slack_bolt",
+    "openai",
+    "numpy",
+    "pydub",
+    "sentence_transformers",
+    "archivebot",
+    "flask_app",
+]
+HEAVY_MODULES = ("torch", "sentence_transformers", "numpy", "pydub", "openai")
+TARGET_SECONDS = 1.0
+
+CHILD = r"""
+import importlib, json, resource, sys, time
+
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+name = sys.argv[1]
+before = rss_mb()
+started = time.perf_counter()
+try:
+    importlib.import_module(name)
+    error = None
+except Exception as e:
+    error = f"{type(e).__name__}: {e}"
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    "seconds": elapsed,
+    "rss_mb": rss_mb() - before,
+    "heavy": [m for m in %r if m in sys.modules],
+    "error": error,
+}))
+""" % (HEAVY_MODULES,)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-m", "--modules", nargs="+", default=DEFAULT_MODULES, help="moduli da misurare")
+parser.add_argument("-r", "--runs", type=int, default=1, help="ripetizioni per modulo (default = 1)")
+args = parser.parse_args()
+
+
+def profile(name, env):
+    results = []
+    for _ in range(args.runs):
+        proc = subprocess.run(
+            [sys.executable, "-c", CHILD, name], cwd=ROOT_DIR, env=env, capture_output=True, text=True
+        )
+        lines = proc.stdout.strip().splitlines()
+        if not lines:
+            return {"error": (proc.stderr.strip().splitlines() or ["no output"])[-1]}
+        results.append(json.loads(lines[-1]))
+    result = results[-1]
+    result["seconds"] = statistics.median(r["seconds"] for r in results)
+    return result
+
+
+stub = start_stub_server()
+workdir = tempfile.mkdtemp()
+env = dict(os.environ)
+env.update({
+    "SLACK_API_BASE_URL": stub.base_url,
+    "SLACK_BOT_TOKEN": env.get("SLACK_BOT_TOKEN", "xoxb-stub"),
+    "SLACK_SIGNING_SECRET": env.get("SLACK_SIGNING_SECRET", "stub"),
+    "ARCHIVE_BOT_DATABASE_PATH": os.path.join(workdir, "profile.sqlite"),
+    "ARCHIVE_BOT_LOG_LEVEL": "WARNING",
+})
+
+print(f"{'module':<24} {'import':>9} {'rss':>9}  heavy modules loaded")
+try:
+    for name in args.modules:
+        result = profile(name, env)
+        if result.get("error"):
+            print(f"{name:<24} {'-':>9} {'-':>9}  {result['error']}")
+            continue
+        flag = " (over target)" if name in ("archivebot", "flask_app") and result["seconds"] > TARGET_SECONDS else ""
+        print(
+            f"{name:<24} {result['seconds']:>8.3f}s {result['rss_mb']:>7.1f}MB  "
+            f"{', '.join(result['heavy']) or '-'}{flag}"
+        )
+finally:
+    stub.shutdown()
+    for filename in os.listdir(workdir):
+        os.remove(os.path.join(workdir, filename))
+    os.rmdir(workdir)
@@ -0,0 +1,208 @@
+"""Load test del modello a worker: ack di /slack/events con gli endpoint LLM saturi.
+
+Avvia gli stub Slack e OpenAI in-process (OpenAI con una latenza lunga, come
+una generazione vera), poi Gunicorn con `gunicorn_conf.py` su un database
+temporaneo. Mentre `--llm-clients` client chiamano `/chat` e `/digest_details`
+in loop, invia eventi `/slack/events` firmati e ne misura la latenza di ack.
+Le richieste LLM oltre i tetti di `route_limits` ricevono 503.
+
+Esce con codice 1 se un ack supera `--max-ack` secondi (default 1, il limite
+oltre il quale conviene non arrivare con Slack).
+
+Uso:
+    python utilities/worker_load_test.py
+    python utilities/worker_load_test.py --llm-latency 20 --llm-clients 32 -e 100
+    WORKER_CLASS=sync python utilities/worker_load_test.py   # confronto con i worker sync
+"""
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import jwt
+import requests
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from utilities.openai_stub import start_stub_server as start_openai_stub  # noqa: E402
+from utilities.slack_stub import start_stub_server as start_slack_stub  # noqa: E402
+from utils import db_connect, migrate_db  # noqa: E402
+
+SIGNING_SECRET = "load-test-signing-secret"
+SECRET_KEY = "load-test-secret-key-0123456789abcdef"
+USER_ID = "ULOADTEST"
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-w", "--workers", type=int, default=2, help="worker Gunicorn (default = 2)")
+parser.add_argument("-e", "--events", type=int, default=50, help="eventi Slack da inviare (default = 50)")
+parser.add_argument("--event-interval", type=float, default=0.1, help="secondi tra un evento e l'altro (default = 0.1)")
+parser.add_argument("--llm-clients", type=int, default=16, help="client LLM in parallelo (default = 16)")
+parser.add_argument("--llm-latency", type=float, default=10.0, help="latenza dello stub OpenAI (default = 10)")
+parser.add_argument("--max-ack", type=float, default=1.0, help="ack massimo accettato in secondi (default = 1)")
+args = parser.parse_args()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def prepare_database(path):
+    conn, cursor = db_connect(path)
+    migrate_db(conn, cursor)
+    conn.execute("INSERT OR REPLACE INTO users (name, id) VALUES ('load-test', ?)", (USER_ID,))
+    conn.execute(
+        "INSERT INTO digests (timestamp, digest, posts, period) VALUES (CURRENT_TIMESTAMP, 'digest di prova', 'post di prova', 'day')"
+    )
+    conn.commit()
+    conn.close()
+
+
+def signed_event(i):
+    body = json.dumps({
+        "type": "event_callback",
+        "team_id": "TSTUB",
+        "api_app_id": "ALOADTEST",
+        "event_id": f"Ev{i:08d}",
+        "event_time": int(time.time()),
+        "event": {
+            "type": "message",
+            "channel": "CSTUB",
+            "channel_type": "channel",
+            "user": "USTUB",
+            "text": f"evento di prova {i}",
+            "ts": f"{time.time():.6f}",
+        },
+    })
+    timestamp = str(int(time.time()))
+    signature = hmac.new(SIGNING_SECRET.encode(), f"v0:{timestamp}:{body}".encode(), hashlib.sha256).hexdigest()
+    headers = {
+        "Content-Type": "application/json",
+        "X-Slack-Request-Timestamp": timestamp,
+        "X-Slack-Signature": f"v0={signature}",
+    }
+    return body, headers
+
+
+def wait_until_up(base_url, process, deadline=30):
+    started = time.monotonic()
+    while time.monotonic() - started < deadline:
+        if process.poll() is not None:
+            sys.exit(f"gunicorn exited with code {process.returncode}")
+        try:
+            requests.get(f"{base_url}/getlink", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    sys.exit("gunicorn did not start in time")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+if __name__ == "__main__":
+    slack_stub = start_slack_stub()
+    openai_stub = start_openai_stub(latency=args.llm_latency)
+    workdir = tempfile.mkdtemp(prefix="worker-load-")
+    database_path = os.path.join(workdir, "slack.sqlite")
+    prepare_database(database_path)
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        ARCHIVE_BOT_PORT=str(port),
+        ARCHIVE_BOT_DATABASE_PATH=database_path,
+        ARCHIVE_BOT_LOG_LEVEL="WARNING",
+        DB_PATH=database_path,
+        WORKERS=str(args.workers),
+        SLACK_API_BASE_URL=slack_stub.base_url,
+        SLACK_BOT_TOKEN="xoxb-load-test",
+        SLACK_SIGNING_SECRET=SIGNING_SECRET,
+        SECRET_KEY=SECRET_KEY,
+        OPENAI_BASE_URL=openai_stub.base_url,
+        OPENAI_API_KEY="stub",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "flask_app:flask_app", "-c", "gunicorn_conf.py"],
+        cwd=ROOT_DIR, env=env,
+    )
+    stop = threading.Event()
+    llm_statuses = {}
+    llm_lock = threading.Lock()
+
+    def llm_client_loop(i):
+        token = jwt.encode({"user_id": USER_ID, "slack_token": "xoxp-load-test"}, SECRET_KEY, algorithm="HS256")
+        headers = {"Authorization": f"Bearer {token}"}
+        path, payload = ("/chat", {"message": "ciao"}) if i % 2 else ("/digest_details", {"query": "dettagli", "no_cache": True})
+        while not stop.is_set():
+            try:
+                status = requests.post(base_url + path, json=payload, headers=headers, timeout=args.llm_latency * 3).status_code
+            except requests.RequestException:
+                status = "error"
+            with llm_lock:
+                llm_statuses[status] = llm_statuses.get(status, 0) + 1
+            if status == 503:
+                time.sleep(0.5)
+
+    try:
+        wait_until_up(base_url, server)
+        print(f"gunicorn up on {base_url}, worker class {os.getenv('WORKER_CLASS', 'gthread')}, {args.workers} workers")
+
+        executor = ThreadPoolExecutor(max_workers=args.llm_clients)
+        for i in range(args.llm_clients):
+            executor.submit(llm_client_loop, i)
+        # Lascia che le richieste LLM occupino i posti disponibili
+        time.sleep(1.0)
+
+        acks = []
+        failures = 0
+        session = requests.Session()
+        for i in range(args.events):
+            body, headers = signed_event(i)
+            started = time.monotonic()
+            try:
+                response = session.post(f"{base_url}/slack/events", data=body, headers=headers, timeout=10)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            acks.append(time.monotonic() - started)
+            failures += not ok
+            time.sleep(args.event_interval)
+
+        # Niente nuove richieste LLM; quelle in corso finiscono entro la latenza dello stub
+        stop.set()
+        executor.shutdown(wait=True)
+        slow = sum(ack > args.max_ack for ack in acks)
+        print(
+            f"/slack/events: {len(acks)} acks, {failures} failed, "
+            f"p50 {statistics.median(acks) * 1000:.1f}ms, p95 {percentile(acks, 0.95) * 1000:.1f}ms, "
+            f"max {max(acks) * 1000:.1f}ms, {slow} over {args.max_ack:g}s"
+        )
+        print(f"LLM responses by status: {json.dumps(llm_statuses, sort_keys=True, default=str)}")
+        exit_code = 1 if slow or failures else 0
+    finally:
+        stop.set()
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        slack_stub.shutdown()
+        openai_stub.shutdown()
+
+    sys.exit(exit_code)
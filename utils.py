@@ -1,5 +1,9 @@
 import sqlite3
 
+import archive_index
+import message_entities
+import rollups
+
 
 def migrate_db(conn, cursor):
     cursor.execute(
@@ -433,6 +437,495 @@ def migrate_db(conn, cursor):
         # Se la migrazione fallisce, continua (potrebbe essere già migrata o non esistere)
         pass
 
+    # Cache delle risposte LLM (es. /digest_details), condivisa tra worker
+    try:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                cache_key TEXT NOT NULL PRIMARY KEY,
+                model TEXT NOT NULL,
+                digest_timestamp TEXT,
+                query TEXT,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_hit_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_llm_cache_last_hit_at ON llm_cache(last_hit_at)
+        """
+        )
+        conn.commit()
+    except:
+        pass
+
+    # Watermark di ingestione per canale e buchi noti (contesto AI dal DB)
+    try:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingest_watermarks (
+                channel TEXT NOT NULL PRIMARY KEY,
+                first_ts TEXT NOT NULL,
+                last_ts TEXT NOT NULL,
+                updated_at REAL
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingest_gaps (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                start_ts TEXT NOT NULL,
+                end_ts TEXT NOT NULL,
+                UNIQUE(channel, start_ts)
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS thread_fills (
+                channel TEXT NOT NULL,
+                thread_ts TEXT NOT NULL,
+                filled_until TEXT NOT NULL,
+                PRIMARY KEY (channel, thread_ts)
+            )
+        """
+        )
+        # Primo avvio: l'archivio esistente è considerato continuo da MIN a MAX
+        cursor.execute("SELECT COUNT(*) FROM ingest_watermarks")
+        if cursor.fetchone()[0] == 0:
+            cursor.execute(
+                """
+                INSERT INTO ingest_watermarks (channel, first_ts, last_ts, updated_at)
+                SELECT channel, MIN(timestamp), MAX(timestamp), strftime('%s', 'now')
+                FROM messages WHERE channel IS NOT NULL AND timestamp IS NOT NULL
+                GROUP BY channel
+            """
+            )
+        conn.commit()
+    except:
+        pass
+
+    # Risposte del bot (non archiviate in messages) e indice per i thread
+    try:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS bot_replies (
+                channel TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                thread_ts TEXT NOT NULL,
+                user TEXT,
+                text TEXT,
+                PRIMARY KEY (channel, timestamp)
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_bot_replies_thread ON bot_replies(channel, thread_ts)
+        """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_messages_channel_thread_ts ON messages(channel, thread_ts)
+        """
+        )
+        conn.commit()
+    except:
+        pass
+
+    # Stato incrementale dei thread ingaggiati (finestra del prompt)
+    try:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS thread_state (
+                channel TEXT NOT NULL,
+                thread_ts TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                user_id TEXT,
+                user_name TEXT,
+                text TEXT,
+                PRIMARY KEY (channel, thread_ts, timestamp)
+            )
+        """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_thread_state_channel_timestamp ON thread_state(channel, timestamp)
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS thread_state_threads (
+                channel TEXT NOT NULL,
+                thread_ts TEXT NOT NULL,
+                PRIMARY KEY (channel, thread_ts)
+            )
+        """
+        )
+        conn.commit()
+    except:
+        pass
+
+    # Lease single-flight per le risposte nei thread ingaggiati
+    try:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reply_leases (
+                channel TEXT NOT NULL,
+                thread_ts TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                lease_until REAL NOT NULL,
+                pending INTEGER NOT NULL DEFAULT 0,
+                last_event_at REAL NOT NULL,
+                PRIMARY KEY (channel, thread_ts)
+            )
+        """
+        )
+        conn.commit()
+    except:
+        pass
+
+    # Rate limit AI: una riga per utente con gli ultimi timestamp (sostituisce ai_requests)
+    try:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ai_rate_limits (
+                user_id TEXT NOT NULL PRIMARY KEY,
+                stamps TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """
+        )
+        conn.commit()
+    except:
+        pass
+
+    # Stato dei sync periodici (lease single-flight tra worker)
+    try:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sync_state (
+                name TEXT NOT NULL PRIMARY KEY,
+                owner TEXT,
+                lease_until REAL,
+                last_synced_at REAL
+            )
+        """
+        )
+        conn.commit()
+    except:
+        pass
+
+    # Contatori di generazione per invalidare le cache in-process tra i worker
+    try:
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache_generations (
+                scope TEXT NOT NULL PRIMARY KEY,
+                generation INTEGER NOT NULL DEFAULT 0
+            )
+        """
+        )
+        conn.commit()
+    except:
+        pass
+
+    # Migrazione: members senza vincolo di unicità cresceva a ogni avvio.
+    # Deduplica le righe e ricrea la tabella con PRIMARY KEY (channel, user).
+    try:
+        cursor.execute("PRAGMA table_info(members)")
+        has_primary_key = any(col[5] for col in cursor.fetchall())
+        if not has_primary_key:
+            cursor.execute("DROP TABLE IF EXISTS members_new")
+            cursor.execute("""
+                CREATE TABLE members_new (
+                    channel TEXT NOT NULL,
+                    user TEXT NOT NULL,
+                    PRIMARY KEY (channel, user),
+                    FOREIGN KEY (channel) REFERENCES channels(id),
+                    FOREIGN KEY (user) REFERENCES users(id)
+                ) WITHOUT ROWID
+            """)
+            cursor.execute("""
+                INSERT OR IGNORE INTO members_new (channel, user)
+                SELECT channel, user FROM members
+                WHERE channel IS NOT NULL AND user IS NOT NULL
+            """)
+            cursor.execute("DROP TABLE members")
+            cursor.execute("ALTER TABLE members_new RENAME TO members")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_members_user ON members(user)")
+            conn.commit()
+    except Exception:
+        conn.rollback()
+
+    # Ultimo messaggio e conteggi per canale, mantenuti in scrittura da
+    # archive_index (prima di `threads`: il suo backfill li ricalcola)
+    try:
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'channel_stats'"
+        ).fetchone()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS channel_stats (
+                channel TEXT NOT NULL PRIMARY KEY,
+                last_message_ts TEXT,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                reply_count INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        """
+        )
+        if not exists:
+            archive_index.backfill_channel_stats(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+
+    # Conteggi dei thread mantenuti in scrittura (archive_index) e indice parziale
+    # sui messaggi root per la paginazione a cursore di /messages/<channel_id>
+    try:
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'threads'"
+        ).fetchone()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS threads (
+                channel TEXT NOT NULL,
+                thread_ts TEXT NOT NULL,
+                reply_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (channel, thread_ts)
+            ) WITHOUT ROWID
+        """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS idx_messages_channel_roots ON messages(channel, timestamp)
+            WHERE thread_ts IS NULL OR thread_ts = timestamp
+        """
+        )
+        if not exists:
+            # Backfill una tantum dai messaggi già archiviati
+            cursor.execute(
+                """
+                INSERT INTO threads (channel, thread_ts, reply_count)
+                SELECT channel, thread_ts, COUNT(*) FROM messages
+                WHERE thread_ts IS NOT NULL AND thread_ts != timestamp
+                GROUP BY channel, thread_ts
+            """
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+
+    # Colonne di thread denormalizzate (utente del root, partecipanti, primo e
+    # ultimo messaggio) e backfill una tantum, anche dei root senza risposte
+    try:
+        cursor.execute("PRAGMA table_info(threads)")
+        columns = {col[1] for col in cursor.fetchall()}
+        if "root_user" not in columns:
+            cursor.execute("ALTER TABLE threads ADD COLUMN root_user TEXT")
+            cursor.execute("ALTER TABLE threads ADD COLUMN participant_count INTEGER NOT NULL DEFAULT 0")
+            cursor.execute("ALTER TABLE threads ADD COLUMN first_ts TEXT")
+            cursor.execute("ALTER TABLE threads ADD COLUMN last_reply_ts TEXT")
+            archive_index.backfill(conn)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_threads_first_ts ON threads(first_ts)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_threads_last_reply_ts ON threads(last_reply_ts)")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+
+    # Versioni dell'archivio per le GET condizionali (archive_versions): data
+    # dell'ultima modifica di ogni generazione e thread cercati per timestamp
+    try:
+        cursor.execute("PRAGMA table_info(cache_generations)")
+        columns = {col[1] for col in cursor.fetchall()}
+        if "updated_at" not in columns:
+            cursor.execute("ALTER TABLE cache_generations ADD COLUMN updated_at TEXT")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_threads_thread_ts ON threads(thread_ts)")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+
+    # /getlink cerca anche per timestamp senza canale (permalinks.resolve_link)
+    try:
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp)")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+
+    # Entità dei messaggi (message_entities.py), con backfill una tantum
+    # dell'archivio esistente. Il marcatore viene creato nella stessa
+    # transazione del backfill: se si interrompe, riparte al prossimo avvio.
+    entities_backfilled = False
+    try:
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_entities_backfill'"
+        ).fetchone()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS message_entities (
+                channel TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 1,
+                PRIMARY KEY (channel, timestamp, kind, value)
+            ) WITHOUT ROWID
+        """
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_message_entities_kind_value ON message_entities(kind, value)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_message_entities_kind_ts ON message_entities(kind, timestamp)")
+        conn.commit()
+        if not exists:
+            message_entities.backfill(conn)
+            cursor.execute(
+                """
+                CREATE TABLE message_entities_backfill (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    finished_at TEXT NOT NULL
+                )
+            """
+            )
+            cursor.execute("INSERT INTO message_entities_backfill (id, finished_at) VALUES (1, CURRENT_TIMESTAMP)")
+            conn.commit()
+            entities_backfilled = True
+    except Exception:
+        conn.rollback()
+
+    # Rollup giornaliere per /stats (rollups.py), con backfill una tantum
+    try:
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'rollup_watermark'"
+        ).fetchone()
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rollup_user_day (
+                day TEXT NOT NULL,
+                user TEXT NOT NULL,
+                messages INTEGER NOT NULL DEFAULT 0,
+                words INTEGER NOT NULL DEFAULT 0,
+                images INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, user)
+            ) WITHOUT ROWID
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rollup_channel_day (
+                day TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                messages INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, channel)
+            ) WITHOUT ROWID
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rollup_hour_day (
+                day TEXT NOT NULL,
+                hour INTEGER NOT NULL,
+                messages INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, hour)
+            ) WITHOUT ROWID
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rollup_emoji_day (
+                day TEXT NOT NULL,
+                emoji TEXT NOT NULL,
+                uses INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, emoji)
+            ) WITHOUT ROWID
+        """
+        )
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rollup_users (
+                user TEXT NOT NULL PRIMARY KEY,
+                last_ts TEXT
+            ) WITHOUT ROWID
+        """
+        )
+        cursor.execute("CREATE TABLE IF NOT EXISTS rollup_dirty_days (day TEXT NOT NULL PRIMARY KEY) WITHOUT ROWID")
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS rollup_watermark (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                last_rowid INTEGER NOT NULL
+            )
+        """
+        )
+        # Emoji e file si contano dalle entità: dopo il loro backfill si ricalcola tutto
+        if not exists or entities_backfilled:
+            rollups.backfill(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+
+
+def get_generation(conn, scope):
+    """Generazione corrente di uno scope di cache (0 se mai modificato)."""
+    row = conn.execute("SELECT generation FROM cache_generations WHERE scope = ?", (scope,)).fetchone()
+    return row[0] if row else 0
+
+
+def bump_generation(conn, scope):
+    """Segnala agli altri worker che i dati dello scope sono cambiati (non fa commit)."""
+    conn.execute(
+        """
+        INSERT INTO cache_generations (scope, generation, updated_at) VALUES (?, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT(scope) DO UPDATE SET generation = generation + 1, updated_at = CURRENT_TIMESTAMP
+        """,
+        (scope,),
+    )
+
+
+def acquire_sync_lease(conn, name, owner, now, lease_seconds):
+    """Prende il lease del sync `name` se libero o scaduto. True se acquisito."""
+    conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT owner, lease_until FROM sync_state WHERE name = ?", (name,)).fetchone()
+        if row is not None and row[0] and row[0] != owner and (row[1] or 0) > now:
+            conn.rollback()
+            return False
+        conn.execute(
+            """
+            INSERT INTO sync_state (name, owner, lease_until, last_synced_at) VALUES (?, ?, ?, NULL)
+            ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, lease_until = excluded.lease_until
+            """,
+            (name, owner, now + lease_seconds),
+        )
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def release_sync_lease(conn, name, owner, synced_at=None):
+    """Rilascia il lease; con `synced_at` registra anche la fine del sync."""
+    if synced_at is None:
+        conn.execute(
+            "UPDATE sync_state SET owner = NULL, lease_until = NULL WHERE name = ? AND owner = ?",
+            (name, owner),
+        )
+    else:
+        conn.execute(
+            "UPDATE sync_state SET owner = NULL, lease_until = NULL, last_synced_at = ? WHERE name = ? AND owner = ?",
+            (synced_at, name, owner),
+        )
+    conn.commit()
+
+
+def last_synced_at(conn, name):
+    row = conn.execute("SELECT last_synced_at FROM sync_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row and row[0] is not None else None
 
 
 def db_connect(database_path):